@@ -1,21 +1,69 @@
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file
 from werkzeug.utils import secure_filename
+import hmac
 import traceback
 import os
 from datetime import datetime
-from data_processor import analyze_dormant_customers, analyze_dormant_customers_by_range
+from functools import partial
+from ingest import IngestRequest, IngestedUpload, MAX_DECOMPRESSED_BYTES, open_export
+from upload_store import UploadStore
+from dataset_store import dataset_store
+from jobs import job_registry
+from cancellation import AnalysisControl, AnalysisStopped, CancelToken
+from data_helpers import ShippingClassifier, DEFAULT_SHIPPING_KEYWORDS, DEFAULT_SHIPPING_EXCLUSIONS
+from profiling import profile_store
+from customer_names import FUZZY_MERGE, MATCH_THRESHOLD
+from report_scheduler import ReportScheduler, STANDARD_REPORTS, standard_report_ranges
 
-# Create Flask app
-app = Flask(__name__)
+# Create Flask app; the page templates sit next to this module rather than in templates/
+app = Flask(__name__, template_folder='.')
+# Hash and sniff uploads while the request body is received
+app.request_class = IngestRequest
 app.secret_key = "trendd_secret_key"
 app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max upload size
+app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max upload size (as received, so compressed uploads can hold more)
+app.config['MAX_DECOMPRESSED_BYTES'] = MAX_DECOMPRESSED_BYTES  # .gz/.zst/.zip uploads may not decompress to more than this (1GB unless TRENDD_MAX_DECOMPRESSED_MB is set)
+app.config['UPLOAD_STORE_MAX_BYTES'] = 2 * 1024 * 1024 * 1024  # Evict least recently used uploads past 2GB
+app.config['UPLOAD_STORE_MAX_AGE_DAYS'] = 30  # Expire upload records after 30 days
+app.config['SHIPPING_KEYWORDS'] = list(DEFAULT_SHIPPING_KEYWORDS)  # Word starts marking an item as a shipping charge
+app.config['SHIPPING_EXCLUSIONS'] = list(DEFAULT_SHIPPING_EXCLUSIONS)  # Item phrases that are never shipping (e.g. "Shipley Donuts")
+app.config['PREVIEW_MIN_BYTES'] = 20 * 1024 * 1024  # CSV uploads this large get an instant preview while the exact analysis runs in the background
+app.config['PREVIEW_TIME_BUDGET'] = 5.0  # Seconds the preview may spend reading the file
+app.config['ANALYSIS_TIME_BUDGET'] = 120  # Seconds an analysis may run inside a request before returning partial results
+app.config['BACKGROUND_TIME_BUDGET'] = 900  # Same limit for analyses running as background jobs
+app.config['ANALYSIS_MEMORY_BUDGET'] = 1024 * 1024 * 1024  # Exports estimated to need more memory than this are loaded in chunks
+app.config['PROFILE_TOKEN'] = os.environ.get('TRENDD_PROFILE_TOKEN')  # Admin token that profiles an upload's analysis when sent as the X-Trendd-Profile header or a profile_token field of the upload form (never the query string, which ends up in logs); unset disables profiling
 
-# Create uploads directory if it doesn't exist
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+# Content-addressed upload storage (creates the uploads directory if it doesn't exist)
+def _upload_deleted(digest):
+    """Delete the cleaned dataset, cached stages and precomputed reports of an evicted upload."""
+    from data_processor import forget_dataset
 
-# Global variable to store current analysis results
-current_results = None
+    dataset_store.remove(digest)
+    forget_dataset(digest)
+    report_scheduler.reports.prune(digest)
+
+upload_store = UploadStore(
+    app.config['UPLOAD_FOLDER'],
+    max_bytes=app.config['UPLOAD_STORE_MAX_BYTES'],
+    max_age_days=app.config['UPLOAD_STORE_MAX_AGE_DAYS'],
+    on_delete=_upload_deleted
+)
+
+# Shop-specific shipping-charge rules used by every analysis
+shipping_classifier = ShippingClassifier(app.config['SHIPPING_KEYWORDS'], app.config['SHIPPING_EXCLUSIONS'])
+
+# Standard reports (last month, last quarter, same month last year) of new uploads are precomputed off-peak
+report_scheduler = ReportScheduler(
+    upload_store, shipping_classifier, job_registry,
+    lambda: AnalysisControl(app.config['BACKGROUND_TIME_BUDGET'], memory_budget=app.config['ANALYSIS_MEMORY_BUDGET'])
+)
+
+def _profiling_requested():
+    """True when the request carries the admin profiling token in its header or POSTed form."""
+    token = app.config['PROFILE_TOKEN']
+    given = request.headers.get('X-Trendd-Profile') or request.form.get('profile_token')
+    return bool(token and given) and hmac.compare_digest(given.encode(), token.encode())
 
 @app.route('/')
 def index():
@@ -23,8 +71,6 @@ def index():
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    global current_results
-    
     # Debug: Print all form data
     print("Form data received:")
     for key, value in request.form.items():
@@ -70,24 +116,70 @@ def upload_file():
         return redirect('/')
     
     if file:
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        print(f"File saved successfully: {filepath}")
+        # Content hash and format were computed while the upload was received
+        try:
+            upload = IngestedUpload.from_file_storage(file)
+        except ValueError as ve:
+            # Unreadable compressed upload, e.g. a zip without exactly one export
+            flash(str(ve))
+            return render_template('index.html', start_date=start_date_str, end_date=end_date_str)
+        filepath, is_new = upload_store.put(upload)
+        if is_new:
+            print(f"File saved successfully: {filepath}")
+            report_scheduler.schedule(upload.digest)
+        else:
+            print(f"Upload {secure_filename(file.filename)} already stored as {filepath} - skipping save")
+        
+        # Admins can capture a profile of this analysis, computed afresh, to diagnose slow exports
+        profile_id = profile_store.new_id() if _profiling_requested() else None
+        profile_info = {'filename': upload.filename, 'digest': upload.digest, 'format': upload.file_format,
+                        'bytes': upload.size, 'start_date': start_date_str, 'end_date': end_date_str}
         
         try:
             # Pass the actual date range to the analysis function
             print(f"CALLING analyze_dormant_customers_by_range with dates {start_date} to {end_date}")
-            result = analyze_dormant_customers_by_range(filepath, start_date, end_date)
+            # Imported here so worker boot doesn't load pandas before the first analysis
+            from data_processor import analyze_dormant_customers_by_range, cached_range_analysis, range_analysis_key
+            analyze = analyze_dormant_customers_by_range
+            if profile_id:
+                print(f"Profiling this analysis as {profile_id}")
+                analyze = partial(profile_store.call, profile_id, profile_info, analyze_dormant_customers_by_range, refresh=True)
+            
+            # Large CSVs get an approximate preview now; the exact analysis replaces it when the background job finishes
+            if (upload.file_format == 'csv' and upload.size >= app.config['PREVIEW_MIN_BYTES']
+                    and (profile_id or cached_range_analysis(upload.digest, start_date, end_date, shipping_classifier) is None)):
+                from preview import preview_dormant_customers
+                preview = preview_dormant_customers(
+                    open_export(filepath, max_bytes=app.config['MAX_DECOMPRESSED_BYTES']), start_date, end_date,
+                    time_budget=app.config['PREVIEW_TIME_BUDGET'])
+                if preview is not None:
+                    cancel_token = CancelToken()
+                    job_id = job_registry.submit(
+                        analyze,
+                        open_export(filepath, max_bytes=app.config['MAX_DECOMPRESSED_BYTES']), start_date, end_date,
+                        file_format=upload.file_format, dataset_hash=upload.digest,
+                        shipping_classifier=shipping_classifier,
+                        control=AnalysisControl(app.config['BACKGROUND_TIME_BUDGET'], cancel_token, app.config['ANALYSIS_MEMORY_BUDGET']),
+                        # A profiled run must not be merged into another job for the same analysis
+                        key=range_analysis_key(upload.digest, start_date, end_date, shipping_classifier) if not profile_id else None,
+                        info={'filename': upload.filename, 'start_date': start_date_str, 'end_date': end_date_str, 'profile_id': profile_id},
+                        cancel_token=cancel_token
+                    )
+                    return render_template('preview.html', preview=preview, job_id=job_id, filename=upload.filename)
+            
+            # Parse straight from the received buffer instead of reading the saved copy back
+            result = analyze(
+                upload.open_buffer(max_bytes=app.config['MAX_DECOMPRESSED_BYTES']), start_date, end_date,
+                file_format=upload.file_format, dataset_hash=upload.digest,
+                shipping_classifier=shipping_classifier,
+                control=AnalysisControl(app.config['ANALYSIS_TIME_BUDGET'], memory_budget=app.config['ANALYSIS_MEMORY_BUDGET'])
+            )
             print(f"RESULT KEYS: {result.keys()}")   
-             
             
-            # Store results for customer details page
-            current_results = result
-            return render_template('results.html', result=result, report_type="dormant_customers")
+            return render_template('results.html', result=result, report_type="dormant_customers", profile_id=profile_id)
             
-        except ValueError as ve:
-            # Handle our custom date range validation error
+        except (ValueError, AnalysisStopped) as ve:
+            # Handle our custom date range validation error, or an analysis that ran out of time
             flash(str(ve))
             return render_template('index.html', start_date=start_date_str, end_date=end_date_str)
         except Exception as e:
@@ -95,18 +187,91 @@ def upload_file():
             flash(f'Error processing file: {str(e)}')
             return render_template('index.html', start_date=start_date_str, end_date=end_date_str)
 
+@app.context_processor
+def customer_merge_setting():
+    """How customer name spellings are merged, for the results page's data-quality notes."""
+    return {'fuzzy_customer_merge': FUZZY_MERGE, 'customer_match_threshold': MATCH_THRESHOLD}
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    """Status of a background analysis, polled by the preview page."""
+    job = job_registry.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify({
+        'id': job['id'],
+        'status': job['status'],
+        'error': job['error'],
+        'elapsed_seconds': (job['finished_at'] or datetime.now().timestamp()) - job['submitted_at']
+    })
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Stop a background analysis at its next checkpoint."""
+    if not job_registry.cancel(job_id):
+        return jsonify({'error': 'Job not found or already finished'}), 409
+    return jsonify({'id': job_id, 'status': 'cancelling'})
+
+@app.route('/results/<job_id>')
+def job_results(job_id):
+    """Results page for a finished background analysis."""
+    job = job_registry.get(job_id)
+    if job is None:
+        flash('This analysis has expired. Please upload the file again.')
+        return redirect('/')
+    if job['status'] == 'failed':
+        flash(f"Error processing file: {job['error']}")
+        return redirect('/')
+    if job['status'] == 'cancelled':
+        flash('The analysis was cancelled.')
+        return redirect('/')
+    if job['status'] != 'done':
+        flash('The analysis is still running. Please try again in a moment.')
+        return redirect('/')
+    
+    return render_template('results.html', result=job['result'], report_type="dormant_customers",
+                           profile_id=(job['info'] or {}).get('profile_id'))
+
+@app.route('/reports/<dataset_hash>/<report>')
+def standard_report(dataset_hash, report):
+    """A standard report of a stored upload: a cache lookup once precomputed, otherwise analyzed now."""
+    if report not in STANDARD_REPORTS:
+        flash('Unknown report')
+        return redirect('/')
+    start_date, end_date = standard_report_ranges()[report]
+    
+    from data_processor import analyze_dormant_customers_by_range, cached_range_analysis
+    result = (report_scheduler.report(dataset_hash, start_date, end_date)
+              or cached_range_analysis(dataset_hash, start_date, end_date, shipping_classifier))
+    if result is None:
+        source = upload_store.lookup(dataset_hash)
+        if source is None:
+            flash('This upload has expired. Please upload the file again.')
+            return redirect('/')
+        try:
+            result = analyze_dormant_customers_by_range(
+                source, start_date, end_date, dataset_hash=dataset_hash,
+                shipping_classifier=shipping_classifier,
+                control=AnalysisControl(app.config['ANALYSIS_TIME_BUDGET'], memory_budget=app.config['ANALYSIS_MEMORY_BUDGET'])
+            )
+        except (ValueError, AnalysisStopped) as ve:
+            flash(str(ve))
+            return redirect('/')
+    return render_template('results.html', result=result, report_type="dormant_customers")
+
 @app.route('/customer_details/<customer_name>')
 def customer_details(customer_name):
-    # Access the global results
-    global current_results
+    # Details come from the dataset's read-only handle, which any request thread or worker can query
+    dataset_hash = request.args.get('dataset')
+    customer_data = None
+    if dataset_hash:
+        from data_processor import customer_details_from_dataset
+        customer_data = customer_details_from_dataset(dataset_hash, customer_name, source=upload_store.lookup(dataset_hash))
     
-    if not current_results or customer_name not in current_results['dormant_customers']:
+    if not customer_data:
         flash("Customer information not found")
         return redirect('/')
     
-    # Get customer data
-    customer_data = current_results['dormant_customers'][customer_name]
-    
     # Format order date
     from datetime import datetime
     if isinstance(customer_data['last_order_date'], datetime):
@@ -125,5 +290,177 @@ def customer_details(customer_name):
                           lifetime_sales=customer_data['total_spent'],
                           customer_data=customer_data)
 
+@app.route('/api/dormancy_cutoff')
+def dormancy_cutoff():
+    """Count, value and top customers with no order in the last N days, for the results page slider."""
+    dataset_hash = request.args.get('dataset', '')
+    days = request.args.get('days', type=int)
+    top_k = request.args.get('top', default=10, type=int)
+    as_of = request.args.get('as_of')
+    
+    if not dataset_hash or days is None or days < 0:
+        return jsonify({'error': 'dataset and a non-negative days value are required'}), 400
+    
+    from data_processor import get_cutoff_index
+    index = get_cutoff_index(dataset_hash, source=upload_store.lookup(dataset_hash))
+    if index is None:
+        return jsonify({'error': 'Dataset not found'}), 404
+    
+    try:
+        return jsonify(index.query(days, as_of=as_of, top_k=top_k))
+    except ValueError:
+        return jsonify({'error': 'Invalid as_of date'}), 400
+
+@app.route('/api/breakdown')
+def breakdown():
+    """
+    Sales breakdown for a dataset, answered from its pre-aggregated cube.
+    
+    Query: dataset=<hash>, by=comma-separated dimensions (customer, month, item,
+    region, month_of_year, year), optional filters customer/month/item/region
+    (repeatable), sort (sales, orders, lines, customers) and top.
+    """
+    dataset_hash = request.args.get('dataset', '')
+    dimensions = [d for d in request.args.get('by', '').split(',') if d]
+    sort_by = request.args.get('sort', 'sales')
+    top = request.args.get('top', default=50, type=int)
+    
+    if not dataset_hash:
+        return jsonify({'error': 'dataset is required'}), 400
+    
+    from data_processor import get_sales_cube
+    cube = get_sales_cube(dataset_hash, source=upload_store.lookup(dataset_hash))
+    if cube is None:
+        return jsonify({'error': 'Dataset not found'}), 404
+    
+    filters = {d: request.args.getlist(d) for d in ('customer', 'month', 'item', 'region') if request.args.getlist(d)}
+    try:
+        rows = cube.slice(**filters).rollup(*dimensions, sort_by=sort_by if dimensions else None, top=top)
+    except (ValueError, KeyError) as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if 'month' in rows.columns:
+        rows['month'] = rows['month'].dt.strftime('%Y-%m')
+    return jsonify({'by': dimensions, 'filters': filters, 'rows': rows.to_dict('records')})
+
+def _parse_comparison(args):
+    """
+    Dataset hashes and date ranges of a dormant-set comparison from query arguments.
+    
+    Returns (params, error); `error` is a message when an argument is missing or invalid.
+    """
+    params = {
+        'dataset': args.get('dataset', ''),
+        'previous_dataset': args.get('previous_dataset') or args.get('dataset', '')
+    }
+    if not params['dataset']:
+        return params, 'dataset is required'
+    for name in ('start', 'end', 'previous_start', 'previous_end'):
+        value = args.get(name, '')
+        try:
+            params[name] = datetime.strptime(value, '%Y-%m-%d')
+        except ValueError:
+            return params, f'{name} must be a YYYY-MM-DD date'
+    if params['start'] >= params['end'] or params['previous_start'] >= params['previous_end']:
+        return params, 'Start date must be before end date'
+    return params, None
+
+def _compare_dormant(params):
+    """Run a parsed comparison; returns (summary, error, status)."""
+    source = upload_store.lookup(params['dataset'])
+    previous_source = upload_store.lookup(params['previous_dataset'])
+    if source is None or previous_source is None:
+        return None, 'Dataset not found', 404
+    
+    from data_processor import compare_dormant_ranges
+    try:
+        diff, partial = compare_dormant_ranges(
+            params['dataset'], params['start'], params['end'], params['previous_start'], params['previous_end'],
+            previous_hash=params['previous_dataset'], source=source, previous_source=previous_source,
+            shipping_classifier=shipping_classifier,
+            control=AnalysisControl(app.config['ANALYSIS_TIME_BUDGET'], memory_budget=app.config['ANALYSIS_MEMORY_BUDGET'])
+        )
+    except (ValueError, AnalysisStopped) as e:
+        return None, str(e), 400
+    
+    summary = diff.summary(top=request.args.get('top', default=50, type=int))
+    summary['partial'] = partial
+    for side in ('current', 'previous'):
+        prefix = '' if side == 'current' else 'previous_'
+        summary[side].update(dataset=params[prefix + 'dataset'],
+                             start=params[prefix + 'start'].strftime('%Y-%m-%d'),
+                             end=params[prefix + 'end'].strftime('%Y-%m-%d'))
+    return summary, None, 200
+
+@app.route('/api/compare')
+def compare_api():
+    """
+    Newly dormant, reactivated and still-dormant customers between two date ranges.
+    
+    Query: dataset=<hash>, start, end (the current range), previous_start,
+    previous_end, optional previous_dataset=<hash> (default: the same
+    dataset) and top (customers listed per set).
+    """
+    params, error = _parse_comparison(request.args)
+    if error:
+        return jsonify({'error': error}), 400
+    summary, error, status = _compare_dormant(params)
+    if error:
+        return jsonify({'error': error}), status
+    return jsonify(summary)
+
+@app.route('/compare')
+def compare_view():
+    """Comparison page: a form for the two ranges, and the comparison once both are given."""
+    comparison = None
+    if request.args.get('previous_start') or request.args.get('previous_end'):
+        params, error = _parse_comparison(request.args)
+        if not error:
+            comparison, error, _ = _compare_dormant(params)
+        if error:
+            flash(error)
+    return render_template('compare.html', form=request.args, comparison=comparison,
+                           uploads=upload_store.recent())
+
+@app.route('/admin/uploads')
+def upload_stats():
+    """Stored upload counts and bytes against the store's limits (requires the profiling token)."""
+    if not _profiling_requested():
+        return jsonify({'error': 'Profiling token required'}), 403
+    return jsonify(dict(upload_store.stats(), max_bytes=upload_store.max_bytes, max_age_days=upload_store.max_age_days))
+
+@app.route('/admin/profiles')
+def list_profiles():
+    """Summaries of the latest captured profiles (requires the profiling token)."""
+    if not _profiling_requested():
+        return jsonify({'error': 'Profiling token required'}), 403
+    return jsonify({'profiles': profile_store.recent(limit=request.args.get('limit', default=20, type=int))})
+
+@app.route('/admin/profiles/<profile_id>')
+def profile_summary(profile_id):
+    """One profile's summary: request details, dataset shape, stage timings and hottest functions."""
+    if not _profiling_requested():
+        return jsonify({'error': 'Profiling token required'}), 403
+    try:
+        summary = profile_store.summary(profile_id)
+    except ValueError:
+        summary = None
+    if summary is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return jsonify(summary)
+
+@app.route('/admin/profiles/<profile_id>/download')
+def download_profile(profile_id):
+    """The raw cProfile dump, for snakeviz or `python -m pstats`."""
+    if not _profiling_requested():
+        return jsonify({'error': 'Profiling token required'}), 403
+    try:
+        path = profile_store.path(profile_id, 'prof')
+    except ValueError:
+        path = None
+    if path is None or not os.path.exists(path):
+        return jsonify({'error': 'Profile not found'}), 404
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=f"trendd-{profile_id}.prof")
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
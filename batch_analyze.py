@@ -0,0 +1,212 @@
+"""
+Headless batch run of the dormant-customer analysis over many exports.
+
+Each export is analyzed for every date range in a separate worker process,
+and the results are written to the output directory as <name>.json (the
+full analysis per range) and <name>.csv (one row per dormant customer per
+range), with the worker's log in <name>.log. A timing summary is printed
+and saved as summary.json. Exits non-zero if any export failed.
+
+Ranges are START:END dates (2024-01-01:2024-03-31) or a whole month (2024-01).
+Exports may be compressed (.gz, .zst, .zip); they are decompressed as they are read.
+
+Usage: python batch_analyze.py EXPORT_DIR_OR_GLOB... --range 2024-01 [--range ...]
+       [--output-dir batch_results] [--workers N] [--format json,csv] [--time-budget SECONDS]
+"""
+import argparse
+import calendar
+import contextlib
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime
+
+from ingest import export_filename
+
+EXPORT_EXTENSIONS = ('.csv', '.txt', '.xlsx', '.xls', '.gz', '.zst', '.zip')
+
+CSV_FIELDS = ['range_start', 'range_end', 'customer', 'last_order_date', 'last_order_amount',
+              'days_since_order', 'total_orders', 'total_spent', 'segment', 'suggested_items']
+
+
+def parse_range(text):
+    """(start, end) datetimes for 'YYYY-MM-DD:YYYY-MM-DD' or a whole month 'YYYY-MM'."""
+    try:
+        if ':' in text:
+            start, end = (datetime.strptime(part, '%Y-%m-%d') for part in text.split(':', 1))
+        else:
+            start = datetime.strptime(text, '%Y-%m')
+            end = start.replace(day=calendar.monthrange(start.year, start.month)[1])
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid range '{text}' (use YYYY-MM-DD:YYYY-MM-DD or YYYY-MM)")
+    if start >= end:
+        raise argparse.ArgumentTypeError(f"range '{text}' must start before it ends")
+    return start, end
+
+
+def find_exports(patterns):
+    """Export files named by directories (searched non-recursively) or glob patterns, largest first."""
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            candidates = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        else:
+            candidates = glob.glob(pattern)
+        paths.update(os.path.abspath(path) for path in candidates
+                     if os.path.isfile(path) and path.lower().endswith(EXPORT_EXTENSIONS))
+    # Largest first so one big export doesn't start last and hold up the batch
+    return sorted(paths, key=lambda path: (-os.path.getsize(path), path))
+
+
+def output_names(paths):
+    """Distinct output base names for the exports, suffixing repeats of the same file name."""
+    names, seen = {}, {}
+    for path in sorted(paths):
+        stem = os.path.splitext(export_filename(os.path.basename(path)))[0]
+        seen[stem] = seen.get(stem, 0) + 1
+        names[path] = stem if seen[stem] == 1 else f"{stem}-{seen[stem]}"
+    return names
+
+
+def _json_default(value):
+    """JSON encoding for the dates and numpy scalars in analysis results."""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+def _csv_rows(start, end, result):
+    for customer, data in result.get('dormant_customers', {}).items():
+        last_order = data.get('last_order_date')
+        yield {
+            'range_start': start.strftime('%Y-%m-%d'),
+            'range_end': end.strftime('%Y-%m-%d'),
+            'customer': customer,
+            'last_order_date': last_order.strftime('%Y-%m-%d') if hasattr(last_order, 'strftime') else last_order,
+            'last_order_amount': round(float(data.get('last_order_amount', 0)), 2),
+            'days_since_order': data.get('days_since_order'),
+            'total_orders': data.get('total_orders'),
+            'total_spent': round(float(data.get('total_spent', 0)), 2),
+            'segment': data.get('segment', ''),
+            'suggested_items': '; '.join(data.get('suggested_items', []))
+        }
+
+
+def analyze_export(path, name, ranges, output_dir, formats, time_budget=None):
+    """
+    Analyze one export for every range and write its outputs; runs in a worker process.
+
+    Returns the export's summary entry. A range outside the data is
+    recorded as an error for that range and the others still run.
+    """
+    started = time.perf_counter()
+    summary = {'file': path, 'name': name, 'status': 'ok', 'ranges': [], 'error': None}
+    log_path = os.path.join(output_dir, f"{name}.log")
+    with open(log_path, 'w') as log, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        try:
+            # Imported here so the parent process stays light
+            from cancellation import AnalysisControl, AnalysisStopped
+            from data_processor import analyze_dormant_customers_by_range
+            from ingest import file_digest
+
+            dataset_hash = file_digest(path)
+            results, rows = [], []
+            for start, end in ranges:
+                range_started = time.perf_counter()
+                entry = {'start': start.strftime('%Y-%m-%d'), 'end': end.strftime('%Y-%m-%d')}
+                result = None
+                try:
+                    result = analyze_dormant_customers_by_range(
+                        path, start, end, dataset_hash=dataset_hash,
+                        control=AnalysisControl(time_budget=time_budget))
+                    entry.update(dormant_count=result['total_count'], total_value=round(float(result['total_value']), 2),
+                                 partial=bool(result.get('partial')))
+                    rows.extend(_csv_rows(start, end, result))
+                except (ValueError, AnalysisStopped) as e:
+                    entry['error'] = str(e)
+                entry['seconds'] = round(time.perf_counter() - range_started, 3)
+                summary['ranges'].append(entry)
+                results.append(dict(entry, result=result))
+
+            if 'json' in formats:
+                with open(os.path.join(output_dir, f"{name}.json"), 'w') as f:
+                    json.dump({'file': path, 'dataset_hash': dataset_hash, 'ranges': results}, f, default=_json_default, indent=2)
+            if 'csv' in formats:
+                with open(os.path.join(output_dir, f"{name}.csv"), 'w', newline='') as f:
+                    writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+                    writer.writeheader()
+                    writer.writerows(rows)
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            summary['status'] = 'failed'
+            summary['error'] = str(e)
+    summary['seconds'] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+def print_summary(summaries, wall_seconds, workers):
+    """Print one line per export plus totals."""
+    width = max([len(s['name']) for s in summaries] + [4])
+    print(f"{'file':<{width}}  {'status':<8} {'seconds':>8}  dormant per range")
+    for s in sorted(summaries, key=lambda s: s['name']):
+        counts = ', '.join(str(r.get('dormant_count', 'error')) for r in s['ranges']) or s['error']
+        print(f"{s['name']:<{width}}  {s['status']:<8} {s['seconds']:>8.1f}  {counts}")
+    busy = sum(s['seconds'] for s in summaries)
+    print(f"{len(summaries)} exports in {wall_seconds:.1f}s wall ({busy:.1f}s of analysis on {workers} workers, "
+          f"{busy / wall_seconds if wall_seconds else 0:.1f}x parallel speedup)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('exports', nargs='+', help='export files, directories or glob patterns')
+    parser.add_argument('--range', dest='ranges', action='append', type=parse_range, required=True,
+                        help='date range START:END or month YYYY-MM; repeat for several')
+    parser.add_argument('--output-dir', default='batch_results')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--format', default='json,csv', help='comma-separated output formats: json, csv')
+    parser.add_argument('--time-budget', type=float, default=None, help='seconds allowed per range analysis')
+    args = parser.parse_args(argv)
+
+    formats = {f.strip() for f in args.format.split(',') if f.strip()}
+    if not formats <= {'json', 'csv'}:
+        parser.error(f"unknown output format: {', '.join(sorted(formats - {'json', 'csv'}))}")
+    paths = find_exports(args.exports)
+    if not paths:
+        parser.error('no export files found')
+    os.makedirs(args.output_dir, exist_ok=True)
+    names = output_names(paths)
+    workers = max(1, min(args.workers, len(paths)))
+
+    print(f"Analyzing {len(paths)} exports x {len(args.ranges)} ranges on {workers} workers")
+    started = time.perf_counter()
+    summaries = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(analyze_export, path, names[path], args.ranges, args.output_dir, formats, args.time_budget): path
+                   for path in paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                summary = future.result()
+            except Exception as e:
+                # The worker process itself died (e.g. killed for memory)
+                summary = {'file': path, 'name': names[path], 'status': 'failed', 'ranges': [],
+                           'error': f"worker crashed: {e}", 'seconds': 0.0}
+            summaries.append(summary)
+            print(f"  {summary['name']}: {summary['status']} in {summary['seconds']:.1f}s")
+    wall_seconds = time.perf_counter() - started
+
+    print_summary(summaries, wall_seconds, workers)
+    with open(os.path.join(args.output_dir, 'summary.json'), 'w') as f:
+        json.dump({'wall_seconds': round(wall_seconds, 3), 'workers': workers, 'exports': summaries}, f, indent=2)
+    return 1 if any(s['status'] == 'failed' for s in summaries) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""
+Cold-start benchmark for the web app.
+
+Imports `app` in fresh interpreters, serves `/` once, and checks that
+pandas/numpy were not imported along the way. Exits non-zero when the
+median import time is over budget, `/` didn't return 200 or a heavy
+module was loaded.
+
+Usage: python bench_startup.py [--runs 5] [--budget-ms 400]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ['pandas', 'numpy']
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+import_ms = (time.perf_counter() - start) * 1000
+loaded_after_import = [m for m in %(heavy)r if m in sys.modules]
+start = time.perf_counter()
+status = app.app.test_client().get('/').status_code
+first_request_ms = (time.perf_counter() - start) * 1000
+loaded_after_request = [m for m in %(heavy)r if m in sys.modules]
+print(json.dumps({
+    'import_ms': import_ms,
+    'first_request_ms': first_request_ms,
+    'status': status,
+    'loaded_after_import': loaded_after_import,
+    'loaded_after_request': loaded_after_request,
+}))
+"""
+
+
+def run_probe():
+    """Run one cold start in a fresh interpreter and return its measurements."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    output = subprocess.run(
+        [sys.executable, '-c', _PROBE % {'heavy': HEAVY_MODULES}],
+        cwd=here, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=float(os.environ.get('STARTUP_BUDGET_MS', 400)))
+    args = parser.parse_args(argv)
+
+    probes = [run_probe() for _ in range(args.runs)]
+    import_ms = statistics.median(p['import_ms'] for p in probes)
+    request_ms = statistics.median(p['first_request_ms'] for p in probes)
+    heavy_loaded = sorted({m for p in probes for m in p['loaded_after_import'] + p['loaded_after_request']})
+    statuses = sorted({p['status'] for p in probes})
+
+    print(f"import app:     {import_ms:.1f} ms (median of {args.runs}, budget {args.budget_ms:.0f} ms)")
+    print(f"first GET /:    {request_ms:.1f} ms (status {', '.join(str(s) for s in statuses)})")
+    print(f"heavy modules:  {', '.join(heavy_loaded) if heavy_loaded else 'none loaded'}")
+
+    failed = False
+    if import_ms > args.budget_ms:
+        print("FAIL: import time over budget")
+        failed = True
+    if statuses != [200]:
+        print("FAIL: GET / did not return 200")
+        failed = True
+    if heavy_loaded:
+        print("FAIL: heavy modules imported before the first analysis")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+import os
+import threading
+import time
+
+from memory_budget import MemoryTracker
+from data_audit import DataQualityAudit
+
+
+class AnalysisStopped(Exception):
+    """Raised when an analysis stops before it has anything to return."""
+
+
+class AnalysisCancelled(AnalysisStopped):
+    """The user cancelled the analysis."""
+
+
+class DeadlineExceeded(AnalysisStopped):
+    """The time budget ran out before any partial result was available."""
+
+
+class CancelToken:
+    """
+    Thread-safe flag a caller sets to ask a running analysis to stop.
+
+    A token watching a file also counts as cancelled once that file exists,
+    so a request handled by another worker process can cancel the analysis.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._path = None
+
+    def cancel(self):
+        self._event.set()
+
+    def watch(self, path):
+        self._path = path
+
+    @property
+    def cancelled(self):
+        if not self._event.is_set() and self._path is not None and os.path.exists(self._path):
+            self._event.set()
+        return self._event.is_set()
+
+
+class AnalysisControl:
+    """
+    Deadline, cancel token and memory budget checked by the analysis between stages and chunks.
+
+    `check` is for points with nothing useful to return yet: it raises when
+    the analysis was cancelled or is out of time. `out_of_time` is for points
+    where partial results exist: it still raises on cancel, but on an expired
+    deadline it records the stage and returns True so the caller can stop and
+    return what it has.
+
+    `memory` is the run's MemoryTracker; its budget decides whether the
+    export is loaded whole or in chunks. `audit` is the run's
+    DataQualityAudit, filled in while the export is cleaned.
+    `stage_timings` lists the pipeline stages the run computed or reused.
+    """
+
+    def __init__(self, time_budget=None, cancel_token=None, memory_budget=None):
+        self.time_budget = time_budget
+        self.cancel_token = cancel_token
+        self.memory = MemoryTracker(memory_budget)
+        self.audit = DataQualityAudit()
+        self.stage_timings = []
+        self.started = None
+        self.stopped_at = None
+
+    def start(self):
+        """Start the clock; called by the first check, so time spent queued doesn't count."""
+        if self.started is None:
+            self.started = time.monotonic()
+
+    def elapsed(self):
+        self.start()
+        return time.monotonic() - self.started
+
+    def _expired(self):
+        return bool(self.time_budget) and self.elapsed() > self.time_budget
+
+    def _check_cancelled(self, stage):
+        if self.cancel_token is not None and self.cancel_token.cancelled:
+            print(f"Analysis cancelled while {stage}")
+            raise AnalysisCancelled("The analysis was cancelled.")
+
+    def check(self, stage):
+        self._check_cancelled(stage)
+        if self._expired():
+            print(f"Analysis time budget exceeded while {stage}")
+            raise DeadlineExceeded(f"The analysis ran out of time ({self.time_budget:.0f}s) while {stage}. Try a smaller file or a shorter date range.")
+
+    def out_of_time(self, stage):
+        self._check_cancelled(stage)
+        if self.stopped_at is None and self._expired():
+            print(f"Analysis time budget exceeded while {stage} - returning partial results")
+            self.stopped_at = stage
+        return self.stopped_at is not None
@@ -0,0 +1,143 @@
+from lazy_imports import lazy_module
+
+np = lazy_module('numpy')
+pd = lazy_module('pandas')
+
+
+def customer_summary(df, columns):
+    """
+    Per-customer aggregates computed in one groupby over cleaned transactions.
+
+    Returns a DataFrame indexed by customer with first_order_date,
+    last_order_date, total_spent and total_orders (unique invoice numbers,
+    or unique order dates when there is no Num column).
+    """
+    customer_col, date_col, amount_col = columns['customer'], columns['date'], columns['amount']
+    grouped = df.groupby(customer_col, observed=True, sort=False)
+
+    summary = grouped.agg(
+        first_order_date=(date_col, 'min'),
+        last_order_date=(date_col, 'max'),
+        total_spent=(amount_col, 'sum')
+    )
+    if columns['num'] and columns['num'] in df.columns:
+        summary['total_orders'] = grouped[columns['num']].nunique()
+    else:
+        summary['total_orders'] = grouped[date_col].agg(lambda dates: dates.dt.normalize().nunique())
+
+    summary.index = summary.index.astype(object)
+    summary.index.name = 'customer'
+    return summary
+
+
+# Overdue ratios (days since last order / average interval) that mark a customer late, and lapsed
+AT_RISK_RATIO = 1.5
+LAPSED_RATIO = 3.0
+
+# Customers need this many orders before their interval pattern is trusted
+MIN_ORDERS_FOR_PATTERN = 3
+
+
+def score_customers(df, columns, as_of=None):
+    """
+    Inter-purchase interval statistics and next-order predictions for every customer.
+
+    Works on the distinct (customer, order date) pairs sorted by customer and
+    date, so all intervals come from a single vectorized diff. `as_of`
+    defaults to the last transaction date in the data, so older exports score
+    relative to their own end date rather than today.
+
+    Returns a DataFrame indexed by customer with orders, mean/median/std
+    interval days, last_order_date, expected_next_order, days_since_last_order,
+    overdue_ratio and status ('on_track', 'at_risk', 'lapsed', or
+    'insufficient_history' below MIN_ORDERS_FOR_PATTERN orders).
+    """
+    customer_col, date_col = columns['customer'], columns['date']
+
+    orders = pd.DataFrame({
+        'customer': df[customer_col].to_numpy(dtype=object),
+        'day': df[date_col].to_numpy(dtype='datetime64[D]').astype('int64')
+    }).drop_duplicates().sort_values(['customer', 'day'], kind='stable')
+
+    codes, customers = pd.factorize(orders['customer'], sort=False)
+    days = orders['day'].to_numpy()
+    n_customers = len(customers)
+
+    # Intervals between consecutive orders of the same customer
+    same_customer = codes[1:] == codes[:-1]
+    intervals = np.diff(days)[same_customer].astype('float64')
+    interval_codes = codes[1:][same_customer]
+
+    order_counts = np.bincount(codes, minlength=n_customers)
+    interval_counts = np.bincount(interval_codes, minlength=n_customers)
+    interval_sums = np.bincount(interval_codes, weights=intervals, minlength=n_customers)
+    interval_sq_sums = np.bincount(interval_codes, weights=intervals ** 2, minlength=n_customers)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_interval = interval_sums / interval_counts
+        variance = np.maximum(interval_sq_sums / interval_counts - mean_interval ** 2, 0.0)
+    std_interval = np.sqrt(variance)
+    median_interval = (
+        pd.Series(intervals).groupby(interval_codes).median()
+        .reindex(range(n_customers)).to_numpy()
+    )
+
+    # Rows are sorted by date within each customer, so the last row per code is the last order
+    last_positions = np.flatnonzero(np.append(codes[1:] != codes[:-1], True))
+    last_day = np.empty(n_customers, dtype='int64')
+    last_day[codes[last_positions]] = days[last_positions]
+
+    if as_of is not None:
+        as_of_day = np.datetime64(as_of, 'D').astype('int64')
+    else:
+        as_of_day = days.max() if len(days) else 0
+    days_since = as_of_day - last_day
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        overdue_ratio = days_since / mean_interval
+    has_pattern = (order_counts >= MIN_ORDERS_FOR_PATTERN) & (mean_interval > 0)
+    overdue_ratio = np.where(has_pattern, overdue_ratio, np.nan)
+
+    status = np.select(
+        [~has_pattern, overdue_ratio >= LAPSED_RATIO, overdue_ratio >= AT_RISK_RATIO],
+        ['insufficient_history', 'lapsed', 'at_risk'],
+        default='on_track'
+    )
+
+    expected_next = np.where(has_pattern, last_day + np.round(np.nan_to_num(mean_interval)), np.nan)
+
+    scores = pd.DataFrame({
+        'orders': order_counts,
+        'mean_interval_days': mean_interval,
+        'median_interval_days': median_interval,
+        'std_interval_days': std_interval,
+        'last_order_date': last_day.astype('datetime64[D]'),
+        'expected_next_order': pd.to_datetime(expected_next, unit='D'),
+        'days_since_last_order': days_since,
+        'overdue_ratio': overdue_ratio,
+        'status': status
+    }, index=pd.Index(customers, name='customer', dtype=object))
+    return scores
+
+
+def at_risk_customers(scores, exclude=(), limit=25):
+    """
+    Customers who are late for their next order but not yet lapsed, most overdue first.
+
+    `exclude` drops customers already reported elsewhere (e.g. the dormant set).
+    Returns a list of dicts ready for templates.
+    """
+    late = scores[(scores['status'] == 'at_risk') & ~scores.index.isin(list(exclude))]
+    late = late.sort_values('overdue_ratio', ascending=False).head(limit)
+    return [
+        {
+            'customer': customer,
+            'last_order_date': row.last_order_date.to_pydatetime(),
+            'mean_interval_days': float(row.mean_interval_days),
+            'expected_next_order': row.expected_next_order.to_pydatetime(),
+            'days_since_last_order': int(row.days_since_last_order),
+            'overdue_ratio': float(row.overdue_ratio),
+            'orders': int(row.orders)
+        }
+        for customer, row in zip(late.index, late.itertuples(index=False))
+    ]
@@ -0,0 +1,187 @@
+import os
+import re
+from collections import defaultdict
+from difflib import SequenceMatcher
+
+from lazy_imports import lazy_module
+from data_helpers import normalize_customer_name
+
+np = lazy_module('numpy')
+pd = lazy_module('pandas')
+
+# Minimum similarity (difflib ratio of normalized names) for two spellings to merge
+MATCH_THRESHOLD = 0.9
+
+# Also merge spellings that are only similar, not equal once normalized. Off by default:
+# similar names are often different customers ("Johnston Inc" and "Johnson Inc"), and a
+# wrong merge silently moves one customer's orders to another. The results page states
+# which rule was used. Datasets already in the dataset store keep the merges they were cleaned with.
+FUZZY_MERGE = os.environ.get('TRENDD_FUZZY_CUSTOMER_MERGE', '0') == '1'
+
+# Blocks up to this size are compared all-pairs; larger ones only against sorted neighbours
+MAX_BLOCK_PAIRS = 64
+NEIGHBOUR_WINDOW = 8
+
+_DIGITS = re.compile(r'\d+')
+_HISTOGRAM_BUCKETS = 32
+
+
+class _UnionFind:
+    def __init__(self, size):
+        self.parent = list(range(size))
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+
+def _blocking_keys(key):
+    """
+    Blocks a normalized name falls into: its first three letters and the start
+    of its longest word, each tagged with the name's numbers.
+
+    Numbers must match exactly, so "Store 12" never merges with "Store 13".
+    """
+    digits = ' '.join(_DIGITS.findall(key))
+    letters = _DIGITS.sub('', key).strip()
+    if not letters:
+        return [('#', digits)]
+    longest = max(letters.split(), key=len)
+    return [('p', letters[:3], digits), ('w', longest[:4], digits)]
+
+
+def _candidate_pairs(keys):
+    """Index pairs worth comparing, found through blocking instead of all pairs."""
+    blocks = defaultdict(list)
+    for i, key in enumerate(keys):
+        if not key:
+            continue
+        for block in _blocking_keys(key):
+            blocks[block].append(i)
+
+    pairs = set()
+    for members in blocks.values():
+        if len(members) < 2:
+            continue
+        if len(members) * (len(members) - 1) // 2 <= MAX_BLOCK_PAIRS:
+            for a in range(len(members)):
+                for b in range(a + 1, len(members)):
+                    pairs.add((members[a], members[b]))
+        else:
+            # Sorted neighbourhood: near-duplicates sort next to each other
+            ordered = sorted(members, key=keys.__getitem__)
+            for a in range(len(ordered)):
+                for b in range(a + 1, min(a + NEIGHBOUR_WINDOW, len(ordered))):
+                    pairs.add((min(ordered[a], ordered[b]), max(ordered[a], ordered[b])))
+    return pairs
+
+
+def _char_histograms(keys):
+    """Per-key character counts hashed into _HISTOGRAM_BUCKETS buckets (an upper bound on shared characters)."""
+    lengths = np.fromiter((len(k) for k in keys), dtype='int64', count=len(keys))
+    chars = np.frombuffer(''.join(keys).encode('utf-32-le'), dtype='uint32')
+    rows = np.repeat(np.arange(len(keys)), lengths)
+    counts = np.bincount(rows * _HISTOGRAM_BUCKETS + chars % _HISTOGRAM_BUCKETS,
+                         minlength=len(keys) * _HISTOGRAM_BUCKETS)
+    return lengths, counts.reshape(len(keys), _HISTOGRAM_BUCKETS).astype('int32')
+
+
+def _matching_pairs(keys, pairs, threshold):
+    """
+    The candidate pairs whose keys are at least `threshold` similar.
+
+    Length and shared-character bounds reject most pairs in bulk; only the
+    survivors get an exact difflib comparison.
+    """
+    if not pairs:
+        return []
+    pairs = np.array(list(pairs), dtype='int64')
+    lengths, histograms = _char_histograms(keys)
+    a, b = pairs[:, 0], pairs[:, 1]
+    total = lengths[a] + lengths[b]
+    keep = 2 * np.minimum(lengths[a], lengths[b]) >= threshold * total
+    a, b, total = a[keep], b[keep], total[keep]
+    shared = np.minimum(histograms[a], histograms[b]).sum(axis=1)
+    keep = 2 * shared >= threshold * total
+    return [
+        (i, j) for i, j in zip(a[keep].tolist(), b[keep].tolist())
+        if SequenceMatcher(None, keys[i], keys[j], autojunk=False).ratio() >= threshold
+    ]
+
+
+def canonical_name_map(names, weights=None, threshold=MATCH_THRESHOLD, fuzzy=False):
+    """
+    Map each spelling of a customer to one canonical spelling.
+
+    Spellings whose normalized forms (see data_helpers.normalize_customer_name)
+    are equal merge. With `fuzzy`, distinct normalized forms also merge when
+    they are at least `threshold` similar; candidates come from blocking
+    keys, so only names sharing a block are ever compared. The canonical
+    spelling is the one with the largest weight (e.g. transaction count),
+    then the shortest.
+
+    Returns a dict containing only the spellings that change.
+    """
+    names = list(names)
+    weights = list(weights) if weights is not None else [1] * len(names)
+
+    # Collapse exact normalized matches first; fuzzy matching runs on the distinct keys
+    key_index = {}
+    name_keys = []
+    for name in names:
+        # Invalid names normalize to '' and are kept apart rather than merged with each other
+        key = normalize_customer_name(name) or ('', len(name_keys))
+        name_keys.append(key_index.setdefault(key, len(key_index)))
+    keys = [key if isinstance(key, str) else '' for key in key_index]
+
+    groups = _UnionFind(len(keys))
+    if fuzzy:
+        for a, b in _matching_pairs(keys, _candidate_pairs(keys), threshold):
+            groups.union(a, b)
+
+    clusters = defaultdict(list)
+    for name, key_id, weight in zip(names, name_keys, weights):
+        clusters[groups.find(key_id)].append((name, weight))
+
+    name_map = {}
+    for members in clusters.values():
+        if len(members) < 2:
+            continue
+        canonical = min(members, key=lambda m: (-m[1], len(str(m[0])), str(m[0])))[0]
+        for name, _ in members:
+            if name != canonical:
+                name_map[name] = canonical
+    return name_map
+
+
+def merge_customer_names(df, customer_col, fuzzy=FUZZY_MERGE):
+    """
+    Rewrite spellings of one customer in `customer_col` to their canonical name.
+
+    Only spellings equal after normalization merge, unless `fuzzy` (see
+    canonical_name_map). Spellings are weighted by how many transactions
+    use them. Returns the updated DataFrame and the name map that was applied.
+    """
+    codes, uniques = pd.factorize(df[customer_col])
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    name_map = canonical_name_map(uniques, counts, fuzzy=fuzzy)
+    if name_map:
+        merged = np.array([name_map.get(name, name) for name in uniques], dtype=object)
+        df[customer_col] = np.where(codes >= 0, merged[np.maximum(codes, 0)], None)
+        print(f"Merged {len(name_map)} customer name variants into {len(set(name_map.values()))} customers")
+    return df, name_map
+
+
+def name_variants(name_map):
+    """Canonical name -> sorted list of the spellings merged into it."""
+    variants = defaultdict(list)
+    for name, canonical in name_map.items():
+        variants[canonical].append(name)
+    return {canonical: sorted(names, key=str) for canonical, names in variants.items()}
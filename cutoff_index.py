@@ -0,0 +1,101 @@
+import time
+
+from lazy_imports import lazy_module
+from customer_metrics import customer_summary
+
+np = lazy_module('numpy')
+pd = lazy_module('pandas')
+
+# Prefixes up to this size are ranked directly; larger ones are scanned in value order
+_PARTITION_LIMIT = 16384
+_SCAN_BLOCK = 1024
+
+
+class DormancyCutoffIndex:
+    """
+    Precomputed arrays for "no order in the last N days" queries on one dataset.
+
+    Customers are sorted by last order date, with a running sum of lifetime
+    sales alongside. The customers dormant at a cutoff are a prefix of that
+    order: one binary search gives their count, and the cumulative sum gives
+    their total value. Top-k ranks a small prefix directly, and walks the
+    customers in descending value order for large ones, so a query never
+    touches more than a few blocks.
+    """
+
+    def __init__(self, customers, last_order_dates, lifetime_sales):
+        order = np.argsort(last_order_dates, kind='stable')
+        self.customers = np.asarray(customers, dtype=object)[order]
+        self.last_order_dates = np.asarray(last_order_dates, dtype='datetime64[D]')[order]
+        self.lifetime_sales = np.asarray(lifetime_sales, dtype='float64')[order]
+        self.cumulative_sales = np.cumsum(self.lifetime_sales)
+        # Positions in descending value order, with their last order dates, for the top-k scan
+        self.value_order = np.argsort(-self.lifetime_sales, kind='stable')
+        self.last_order_by_value = self.last_order_dates[self.value_order]
+
+    @classmethod
+    def from_transactions(cls, df, columns):
+        return cls.from_summary(customer_summary(df, columns))
+
+    @classmethod
+    def from_summary(cls, summary):
+        """Build from a customer_metrics.customer_summary frame."""
+        return cls(
+            summary.index.to_numpy(),
+            summary['last_order_date'].to_numpy(dtype='datetime64[D]'),
+            summary['total_spent'].to_numpy(dtype='float64')
+        )
+
+    def __len__(self):
+        return len(self.customers)
+
+    def query(self, days, as_of=None, top_k=10):
+        """
+        Customers with no order in the `days` days before `as_of` (default today).
+
+        Returns the count, their total lifetime value and the `top_k` of them
+        by lifetime value.
+        """
+        started = time.perf_counter()
+        as_of = np.datetime64(as_of or pd.Timestamp.now().normalize(), 'D')
+        cutoff = as_of - np.timedelta64(int(days), 'D')
+
+        # Dormant customers are those whose last order is strictly before the cutoff
+        count = int(np.searchsorted(self.last_order_dates, cutoff, side='left'))
+        total_value = float(self.cumulative_sales[count - 1]) if count else 0.0
+
+        top = []
+        if count and top_k:
+            for i in self._top_positions(count, cutoff, min(top_k, count)):
+                top.append({
+                    'customer': self.customers[i],
+                    'last_order_date': str(self.last_order_dates[i]),
+                    'total_spent': float(self.lifetime_sales[i])
+                })
+
+        return {
+            'days': int(days),
+            'as_of': str(as_of),
+            'cutoff_date': str(cutoff),
+            'dormant_count': count,
+            'total_customers': len(self),
+            'total_value': total_value,
+            'top_customers': top,
+            'elapsed_ms': (time.perf_counter() - started) * 1000
+        }
+
+    def _top_positions(self, count, cutoff, k):
+        """Positions of the k highest-value customers among the first `count` (dormant) ones."""
+        if count <= _PARTITION_LIMIT:
+            prefix_sales = self.lifetime_sales[:count]
+            candidates = np.argpartition(-prefix_sales, k - 1)[:k]
+            return candidates[np.argsort(-prefix_sales[candidates], kind='stable')]
+
+        found = []
+        for start in range(0, len(self.value_order), _SCAN_BLOCK):
+            block = slice(start, start + _SCAN_BLOCK)
+            hits = self.value_order[block][self.last_order_by_value[block] < cutoff]
+            found.extend(hits[:k - len(found)])
+            if len(found) == k:
+                break
+        return found
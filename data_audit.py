@@ -0,0 +1,96 @@
+from lazy_imports import lazy_module
+
+np = lazy_module('numpy')
+
+# Offending rows kept per reason to show in the audit panel
+AUDIT_SAMPLE_ROWS = 5
+
+# Reason key -> description, in the order rows meet them while cleaning
+AUDIT_REASONS = {
+    'unrecognized_part': "Sheet or file without date, customer and amount columns",
+    'hashed_date': "Date exported as ####### (column too narrow in Excel)",
+    'invalid_date': "Missing or unreadable date",
+    'total_row': "'Total' summary row",
+    'missing_type': "No transaction type",
+    'non_invoice': "Not an invoice (the export has invoices)",
+    'total_customer': "Customer name contains 'Total'",
+    'invalid_customer': "Blank or numeric customer name",
+    'unparseable_amount': "Amount couldn't be read (counted as $0)",
+}
+
+# Reasons that repair a row instead of dropping it
+REPAIR_REASONS = {'unparseable_amount'}
+
+
+class DataQualityAudit:
+    """
+    Rows dropped or repaired while cleaning an export, counted by reason.
+
+    The cleaning steps pass in the boolean masks they filter with, so the
+    audit costs no extra pass over the data: a count per mask plus the
+    first AUDIT_SAMPLE_ROWS offending rows as strings. Audits of chunks or
+    parts of one export are combined with `merge`.
+    """
+
+    def __init__(self):
+        self.rows_read = 0
+        self.counts = {}
+        self.samples = {}
+
+    def read(self, rows):
+        """Count rows entering cleaning."""
+        self.rows_read += int(rows)
+
+    def record(self, reason, df, mask, columns=None):
+        """
+        Count the rows of `df` selected by `mask` under `reason` and keep a few
+        as samples, showing only `columns` (default: all) of each.
+        """
+        mask = np.asarray(mask, dtype=bool)
+        count = int(mask.sum())
+        if not count:
+            return
+        self.counts[reason] = self.counts.get(reason, 0) + count
+        samples = self.samples.setdefault(reason, [])
+        if len(samples) < AUDIT_SAMPLE_ROWS:
+            positions = np.flatnonzero(mask)[:AUDIT_SAMPLE_ROWS - len(samples)]
+            rows = df.iloc[positions]
+            if columns is not None:
+                rows = rows[[col for col in columns if col in rows.columns]]
+            for _, row in rows.iterrows():
+                samples.append({str(col): ('' if value is None else str(value)) for col, value in row.items()})
+
+    def merge(self, other):
+        """Add another audit of the same export (a chunk or part) to this one."""
+        self.rows_read += other.rows_read
+        for reason, count in other.counts.items():
+            self.counts[reason] = self.counts.get(reason, 0) + count
+            samples = self.samples.setdefault(reason, [])
+            samples.extend(other.samples.get(reason, [])[:AUDIT_SAMPLE_ROWS - len(samples)])
+        return self
+
+    def rows_dropped(self):
+        return sum(count for reason, count in self.counts.items() if reason not in REPAIR_REASONS)
+
+    def to_dict(self):
+        """JSON-friendly summary: rows read, kept and dropped, and each reason with its count and samples."""
+        return {
+            'rows_read': self.rows_read,
+            'rows_kept': self.rows_read - self.rows_dropped(),
+            'rows_dropped': self.rows_dropped(),
+            'reasons': [
+                {'reason': reason, 'description': description, 'count': self.counts[reason],
+                 'dropped': reason not in REPAIR_REASONS, 'samples': self.samples.get(reason, [])}
+                for reason, description in AUDIT_REASONS.items() if reason in self.counts
+            ]
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild an audit saved with to_dict."""
+        audit = cls()
+        audit.rows_read = data.get('rows_read', 0)
+        for entry in data.get('reasons', []):
+            audit.counts[entry['reason']] = entry['count']
+            audit.samples[entry['reason']] = entry['samples']
+        return audit
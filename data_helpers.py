@@ -1,8 +1,24 @@
-import pandas as pd
-import numpy as np
+import re
+from functools import lru_cache
 
-def safe_float_convert(value):
-    """Safely convert a value to float, handling various formats and errors."""
+from lazy_imports import lazy_module
+
+np = lazy_module('numpy')
+pd = lazy_module('pandas')
+
+# Item-name word starts that mark a line as a shipping charge ('ship' also matches "Shipment", "ShippingFee")
+DEFAULT_SHIPPING_KEYWORDS = ['ship', 'postage', 'deliver', 'freight', 'handling']
+# Whole-word phrases that are never shipping even though a keyword starts one of their words:
+# vehicles, equipment and supplies sold as products rather than charges for sending an order.
+# Shops add their own (e.g. a product line named "Shipley") through app.config['SHIPPING_EXCLUSIONS']
+DEFAULT_SHIPPING_EXCLUSIONS = ['delivery van', 'delivery truck', 'handling equipment', 'material handling',
+                               'shipping supplies', 'shipyard']
+
+# Distinct item names whose shipping classification each classifier remembers
+SHIPPING_CACHE_ITEMS = 65536
+
+def parse_amount(value):
+    """Float value of an amount such as "$1,234.50" or "(12.00)", 0.0 when blank, or None when unreadable."""
     if pd.isna(value):
         return 0.0
     
@@ -21,8 +37,7 @@ def safe_float_convert(value):
         
         return float(clean_value)
     except (ValueError, TypeError):
-        print(f"Warning: Could not convert value to float: '{value}' -> '{clean_value}'")
-        return 0.0
+        return None
 
 def format_date(date_val):
     """Safely format a date, handling NaT values."""
@@ -51,28 +66,104 @@ def is_valid_customer(name):
         
     return True
 
-def is_shipping_item(item):
-    """Check if an item is shipping-related."""
-    if pd.isna(item):
-        return False
+# Legal-form and filler words dropped when comparing customer names
+CUSTOMER_NAME_STOPWORDS = {'the', 'and', 'co', 'company', 'corp', 'corporation', 'inc', 'incorporated',
+                           'llc', 'llp', 'ltd', 'limited', 'plc', 'lp'}
+_NAME_PUNCTUATION = re.compile(r"[^\w\s]")
+
+def normalize_customer_name(name):
+    """
+    Comparison key for a customer name: lowercase words without punctuation or legal suffixes.
+
+    "SMITH COMPANY", "Smith Company LLC" and "SMITH CO." all normalize to
+    "smith". Names that are nothing but stopwords keep their words.
+    """
+    if not is_valid_customer(name):
+        return ''
+    words = _NAME_PUNCTUATION.sub(' ', str(name).replace('&', ' and ').lower()).split()
+    kept = [w for w in words if w not in CUSTOMER_NAME_STOPWORDS]
+    return ' '.join(kept or words)
+
+def _phrase_pattern(phrases, prefix=False):
+    """
+    Compile a case-insensitive matcher for any of `phrases` as whole words, or None if empty.
+
+    With `prefix`, a phrase only has to start a word ("ship" matches "Shipments").
+    """
+    phrases = [p.strip() for p in phrases if p and p.strip()]
+    if not phrases:
+        return None
+    # Longest first so multi-word phrases win over their parts
+    alternatives = '|'.join(re.escape(p) for p in sorted(phrases, key=len, reverse=True))
+    return re.compile(r'\b(?:' + alternatives + (r')' if prefix else r')\b'), re.IGNORECASE)
+
+class ShippingClassifier:
+    """
+    Classifies item names as shipping charges.
+
+    Keywords match at the start of a word, so 'ship' matches "Ship Charge",
+    "Shipment" and "ShippingFee" but not "Airship". Names that only start
+    like a keyword (e.g. "Shipley Donuts") need an exclusion: an item
+    matching any exclusion phrase, as whole words, is never shipping. Both
+    lists can be configured per shop. Results are remembered for the
+    SHIPPING_CACHE_ITEMS most recently classified names.
+    """
     
-    item_str = str(item).strip().lower()
-    shipping_keywords = ['shipping', 'ship', 'postage', 'delivery', 'freight', 'handling']
+    def __init__(self, keywords=None, exclusions=None):
+        self.keywords = list(keywords if keywords is not None else DEFAULT_SHIPPING_KEYWORDS)
+        self.exclusions = list(exclusions if exclusions is not None else DEFAULT_SHIPPING_EXCLUSIONS)
+        self._keyword_re = _phrase_pattern(self.keywords, prefix=True)
+        self._exclusion_re = _phrase_pattern(self.exclusions)
+        self._cached_classify = lru_cache(maxsize=SHIPPING_CACHE_ITEMS)(self._classify)
     
-    for keyword in shipping_keywords:
-        if keyword in item_str:
-            return True
-            
-    return False
-
-def is_total_row(row, customer_col, type_col=None):
-    """Check if a row is a 'Total' summary row for a customer."""
-    if type_col is not None and type_col in row and not pd.isna(row[type_col]):
-        return False  # If it has a transaction type, it's not a total row
+    @classmethod
+    def from_config(cls, config):
+        """Build from a mapping with optional 'keywords' and 'exclusions' lists."""
+        config = config or {}
+        return cls(config.get('keywords'), config.get('exclusions'))
     
-    # Check if customer name starts with 'Total'
-    if customer_col in row and not pd.isna(row[customer_col]):
-        customer_str = str(row[customer_col]).strip()
-        return customer_str.startswith('Total ')
+    def fingerprint(self):
+        """Stable description of the rules, for cache keys."""
+        return (tuple(sorted(k.lower() for k in self.keywords)), tuple(sorted(e.lower() for e in self.exclusions)))
     
-    return False
\ No newline at end of file
+    def _classify(self, item_str):
+        if self._keyword_re is None or not self._keyword_re.search(item_str):
+            return False
+        return not (self._exclusion_re and self._exclusion_re.search(item_str))
+    
+    def is_shipping(self, item):
+        """Check if a single item is shipping-related."""
+        if pd.isna(item):
+            return False
+        return self._cached_classify(str(item).strip())
+    
+    def mask(self, items):
+        """
+        Boolean array marking shipping items in a column of item names.
+
+        The column is factorized so each distinct name is classified once
+        and the result is mapped back to every row.
+        """
+        codes, uniques = pd.factorize(items)
+        flags = np.fromiter((self.is_shipping(u) for u in uniques), dtype=bool, count=len(uniques))
+        result = np.zeros(len(codes), dtype=bool)
+        present = codes >= 0
+        result[present] = flags[codes[present]]
+        return result
+
+# Classifier with the default rules, used when no shop-specific one is configured
+default_shipping_classifier = ShippingClassifier()
+
+def is_shipping_item(item):
+    """Check if an item is shipping-related."""
+    return default_shipping_classifier.is_shipping(item)
+
+def total_row_mask(df, customer_col, type_col=None):
+    """Boolean Series marking 'Total' summary rows: no transaction type and a customer starting with 'Total '."""
+    mask = pd.Series(True, index=df.index)
+    if type_col is not None and type_col in df.columns:
+        mask &= df[type_col].isna()  # If it has a transaction type, it's not a total row
+    if customer_col not in df.columns:
+        return mask & False
+    customers = df[customer_col]
+    return mask & customers.notna() & customers.astype(str).str.strip().str.startswith('Total ')
\ No newline at end of file
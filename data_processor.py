@@ -1,136 +1,108 @@
-import pandas as pd
-import numpy as np
 from datetime import datetime
+import os
 import traceback
 
-from data_helpers import safe_float_convert, is_valid_customer, is_shipping_item, is_total_row
-from insights_generator import generate_ai_insights
+from lazy_imports import lazy_module
+from ingest import file_digest, detect_format, open_export, DecompressedSizeError
+from result_cache import ResultCache, analysis_cache, make_cache_key
+from dataset_store import dataset_store, EXTRA_COLUMNS
+from data_helpers import parse_amount, is_valid_customer, total_row_mask, default_shipping_classifier
+from insights_generator import generate_ai_insights, segment_insights, cube_insights, affinity_insights
+from cutoff_index import DormancyCutoffIndex
+from dormant_diff import DormantSetDiff
+from customer_metrics import customer_summary, score_customers, at_risk_customers
+from customer_names import merge_customer_names, name_variants
+from rfm import rfm_segments, segment_summary
+from sales_cube import SalesCube
+from product_affinity import ProductAffinity
+from cancellation import AnalysisControl, AnalysisStopped
+from data_audit import DataQualityAudit
+from memory_budget import estimate_frame_bytes
+from excel_reader import ExcelRowReader, calamine_available
+from export_parts import find_parts, load_parts
+from pipeline import Pipeline, Stage
+from dataset_handle import DatasetHandle
 
-print("DATA PROCESSOR LOADED - analyze_dormant_customers_by_range function should be available")
+# pandas/numpy are imported on first use so importing this module stays cheap
+pd = lazy_module('pandas')
+np = lazy_module('numpy')
 
-def analyze_dormant_customers(filepath, target_month, actual_start_date=None, actual_end_date=None):
-    """Analyze a QuickBooks CSV export to find dormant customers."""
+# Bump whenever the analysis output changes so cached results are not reused
+ANALYSIS_VERSION = '13'
+
+# Customers processed between deadline/cancel checks
+CUSTOMER_CHECK_INTERVAL = 100
+
+# Rows sampled from the top of an export to estimate its in-memory size
+ESTIMATE_SAMPLE_ROWS = 2000
+ESTIMATE_SAMPLE_BYTES = 1024 * 1024
+
+# Rows per chunk when an export is too large to load whole
+CHUNK_ROWS = 50000
+
+# Intermediate outputs of analysis_pipeline stages (see the end of this module)
+STAGE_CACHE_ENTRIES = int(os.environ.get('TRENDD_STAGE_CACHE_ENTRIES', '64'))
+STAGE_CACHE_SECONDS = int(os.environ.get('TRENDD_STAGE_CACHE_SECONDS', '3600'))
+stage_cache = ResultCache(max_entries=STAGE_CACHE_ENTRIES, ttl_seconds=STAGE_CACHE_SECONDS)
+
+# Customer name maps per dataset, set when the export is cleaned
+index_cache = ResultCache(max_entries=32, ttl_seconds=None)
+
+def forget_dataset(dataset_hash):
+    """Drop this process's cached stages, results and name maps of a dataset."""
+    for cache in (stage_cache, analysis_cache, index_cache):
+        cache.invalidate(dataset_hash)
+
+def analyze_dormant_customers(filepath, target_month, actual_start_date=None, actual_end_date=None, file_format=None, shipping_classifier=None):
+    """
+    Analyze a QuickBooks CSV export to find dormant customers.
+
+    `filepath` may be a path or an open binary buffer; `file_format` ("csv",
+    "xlsx" or "xls") skips format probing when the caller already knows it.
+    `shipping_classifier` (a data_helpers.ShippingClassifier) decides which
+    items are shipping charges; the default rules are used if omitted.
+    Runs on analysis_pipeline, sharing its memoized stages with the
+    date-range analysis.
+    """
+    shipping_classifier = shipping_classifier or default_shipping_classifier
     try:
-        # Try reading with various encodings
-        print("Attempting to read CSV file...")
-        
-        try:
-            # First try with Excel format - your file looks like an Excel export
-            df = pd.read_excel(filepath)
-            print("Successfully read Excel file")
-        except Exception as e:
-            print(f"Error reading as Excel: {e}")
-            try:
-                # Try reading as CSV with different encodings
-                for encoding in ['utf-8', 'latin1', 'cp1252', 'iso-8859-1']:
-                    try:
-                        df = pd.read_csv(filepath, encoding=encoding, low_memory=False)
-                        print(f"Successfully read CSV with {encoding} encoding")
-                        break
-                    except Exception as e:
-                        print(f"Error reading with {encoding}: {e}")
-                        continue
-                else:
-                    # If all encodings fail, create sample data
-                    print("Could not read file with any encoding - using sample data")
-                    df = _create_sample_data()
-            except Exception as e:
-                print(f"Error in CSV reading attempts: {e}")
-                # Create sample data
-                print("Could not read file - using sample data")
-                df = _create_sample_data()
-        
-        # Check if dataframe is empty
-        if df.empty:
-            print("DataFrame is empty - using sample data")
-            df = _create_sample_data()
-        
-        # Display DataFrame shape and columns
-        print(f"DataFrame shape: {df.shape}")
-        print(f"Columns: {df.columns.tolist()}")
-        
-        # Process the DataFrame
-        df = _clean_dataframe(df)
-        
-        # Identify key columns
-        columns = _identify_columns(df)
-        
         # Parse target month 
         target_month_start, target_month_end = _parse_target_month(target_month)
         
+        run = analysis_pipeline.run(
+            dataset_hash=file_digest(filepath) if isinstance(filepath, (str, os.PathLike)) else None,
+            file_format=file_format, source=filepath, control=AnalysisControl(),
+            start_date=target_month_start, end_date=target_month_end, include_end=False,
+            shipping_rules=shipping_classifier.fingerprint(), shipping_classifier=shipping_classifier
+        )
+        df, columns, _ = run['transactions']
+        
         print(f"Target month: {target_month_start.strftime('%B %Y')}")
         print(f"Analyzing orders between {target_month_start} and {target_month_end}")
         
-        # CLEAN DATES BEFORE FILTERING
-        if columns['date'] in df.columns:
-            print("Cleaning date column...")
-            # Replace "#######" with NaT
-            df[columns['date']] = df[columns['date']].astype(str).replace('#######', np.nan)
-            df[columns['date']] = pd.to_datetime(df[columns['date']], errors='coerce')
-            # Handle any NaT values in the date column
-            df = df[df[columns['date']].notna()]
-            print(f"After date cleaning: {len(df)} rows remaining")
-        
-        # CHECK IF REQUESTED DATE RANGE IS IN THE DATA
-        if not df.empty and columns['date'] in df.columns:
-            data_start_date = df[columns['date']].min()
-            data_end_date = df[columns['date']].max()
-            
-            # Only proceed if we have valid dates
-            if not pd.isna(data_start_date) and not pd.isna(data_end_date):
-                print(f"Data date range: {data_start_date.strftime('%m/%d/%Y')} to {data_end_date.strftime('%m/%d/%Y')}")
-                
-                # Use actual dates if provided, otherwise use target month dates
-                check_start = actual_start_date if actual_start_date else target_month_start
-                check_end = actual_end_date if actual_end_date else target_month_end
-                
-                print(f"Requested date range: {check_start.strftime('%m/%d/%Y')} to {check_end.strftime('%m/%d/%Y')}")
-                
-                # Check if requested range is completely outside data range
-                if check_end < data_start_date or check_start > data_end_date:
-                    error_msg = f"Your data doesn't include the requested date range. Your data covers {data_start_date.strftime('%B %d, %Y')} to {data_end_date.strftime('%B %d, %Y')}, but you requested {check_start.strftime('%B %d, %Y')} to {check_end.strftime('%B %d, %Y')}."
-                    raise ValueError(error_msg)
-                
-                # Check if requested range is partially outside data range
-                if check_start < data_start_date or check_end > data_end_date:
-                    print(f"WARNING: Requested date range partially extends beyond your data range.")
-        
-        # Filter for orders in target month
-        target_month_df = df[(df[columns['date']] >= target_month_start) & (df[columns['date']] < target_month_end)]
-        print(f"Found {len(target_month_df)} transactions in target month")
-        
-        # Get unique customers
-        target_month_customers = target_month_df[columns['customer']].unique()
-        target_month_customers = [c for c in target_month_customers if is_valid_customer(c)]
+        # Use actual dates if provided, otherwise use target month dates
+        _check_date_range(run['date_span'], actual_start_date or target_month_start, actual_end_date or target_month_end)
         
-        print(f"Found {len(target_month_customers)} unique valid customers in target month")
+        # Valid customers who ordered in the target month
+        target_month_customers = run['range_customers']
 
         # Add a note about data limitations
-        data_limitations = {
-            'warning': "Note: The analysis is based only on the data contained in the uploaded file. If your export doesn't include your complete transaction history, the total order count and lifetime sales may be incomplete.",
-            'data_from_date': df[columns['date']].min().strftime('%m/%d/%Y') if not df.empty and not pd.isna(df[columns['date']].min()) else "Unknown",
-            'data_to_date': df[columns['date']].max().strftime('%m/%d/%Y') if not df.empty and not pd.isna(df[columns['date']].max()) else "Unknown",
-            'analysis_start_date': start_date.strftime('%m/%d/%Y'),
-            'analysis_end_date': end_date.strftime('%m/%d/%Y')
-        }
+        data_limitations = _data_limitations(run['date_span'])
+        data_limitations.update({
+            'analysis_start_date': (actual_start_date or target_month_start).strftime('%m/%d/%Y'),
+            'analysis_end_date': (actual_end_date or target_month_end).strftime('%m/%d/%Y')
+        })
         
         # If no customers found, create sample data for testing UI
         if len(target_month_customers) == 0:
             return _create_sample_results(target_month_start, data_limitations)
         
-        # Process customers to find dormant ones
-        dormant_customers = _process_customers(df, target_month_customers, columns, target_month_end)
+        # Dormant customers, most recent last order first
+        dormant_customers_sorted = _shared_records(run['month_dormant_customers'])
         
         # Check if we have any valid dormant customers
-        if not dormant_customers:
+        if not dormant_customers_sorted:
             return _create_sample_results(target_month_start, data_limitations, single_customer=True)
-            
-        # Sort dormant customers by last order date (most recent first)
-        dormant_customers_sorted = dict(sorted(
-            dormant_customers.items(),
-            key=lambda item: item[1]['last_order_date'],
-            reverse=True
-        ))
         
         # Calculate total value
         total_value = sum(data['total_spent'] for data in dormant_customers_sorted.values())
@@ -138,7 +110,7 @@ def analyze_dormant_customers(filepath, target_month, actual_start_date=None, ac
         print(f"Found {len(dormant_customers_sorted)} dormant customers")
         print(f"Total lifetime value: ${total_value:.2f}")
         
-        # Generate AI insights
+        # Generate AI insights from the same memoized stages as the date-range analysis
         ai_insights = generate_ai_insights(
             dormant_customers_sorted, 
             target_month_start.strftime('%B %Y'), 
@@ -146,7 +118,13 @@ def analyze_dormant_customers(filepath, target_month, actual_start_date=None, ac
             columns['customer'], 
             columns['date'], 
             columns['amount'], 
-            columns['item']
+            columns['item'],
+            columns.get('region'),
+            customer_scores=run['customer_scores'],
+            customer_segments=run['month_customer_segments'],
+            sales_cube=run['sales_cube'],
+            shipping_classifier=shipping_classifier,
+            product_affinity=run['product_affinity']
         )
         
         return {
@@ -162,108 +140,95 @@ def analyze_dormant_customers(filepath, target_month, actual_start_date=None, ac
         traceback.print_exc()
         raise e
 
-def analyze_dormant_customers_by_range(filepath, start_date, end_date):
-    """Analyze a QuickBooks CSV export to find dormant customers within a specific date range."""
+def analyze_dormant_customers_by_range(filepath, start_date, end_date, file_format=None, dataset_hash=None, shipping_classifier=None, control=None,
+                                       refresh=False):
+    """
+    Analyze a QuickBooks CSV export to find dormant customers within a specific date range.
+
+    `filepath` may be a path or an open binary buffer; `file_format` ("csv",
+    "xlsx" or "xls") skips format probing when the caller already knows it.
+
+    Results are memoized by (dataset content hash, date range, ANALYSIS_VERSION,
+    shipping rules). Pass `dataset_hash` when it is already known; for paths
+    it is computed from the file, and buffers without a hash are not cached.
+
+    `control` (a cancellation.AnalysisControl) carries a deadline and cancel
+    token checked between stages. If the deadline passes after customers
+    have been processed, the result so far is returned with a 'partial'
+    entry describing where it stopped; partial results are not cached.
+
+    With `refresh` the analysis and its pipeline stages are computed again
+    rather than reused (cleaned transactions still come from the dataset
+    store), so a profile of the call covers the whole analysis.
+    """
+    shipping_classifier = shipping_classifier or default_shipping_classifier
     print(f"analyze_dormant_customers_by_range called with {start_date} to {end_date}")
     
+    if dataset_hash is None and isinstance(filepath, (str, os.PathLike)):
+        dataset_hash = file_digest(filepath)
+    
+    cache_key = None
+    if dataset_hash:
+        cache_key = range_analysis_key(dataset_hash, start_date, end_date, shipping_classifier)
+        cached = analysis_cache.get(cache_key) if not refresh else None
+        if cached is not None:
+            print(f"Returning cached analysis for dataset {dataset_hash[:12]}")
+            return cached
+    
+    result = _analyze_dormant_customers_by_range(filepath, start_date, end_date, file_format, dataset_hash, shipping_classifier, control, refresh)
+    if cache_key is not None and not result.get('partial'):
+        analysis_cache.put(cache_key, result)
+    return result
+
+def range_analysis_key(dataset_hash, start_date, end_date, shipping_classifier=None):
+    """Cache key of a date-range analysis; also identifies the analysis when it runs as a background job."""
+    shipping_classifier = shipping_classifier or default_shipping_classifier
+    return make_cache_key(dataset_hash, start_date, end_date, ANALYSIS_VERSION, shipping_classifier.fingerprint())
+
+def cached_range_analysis(dataset_hash, start_date, end_date, shipping_classifier=None):
+    """The memoized analyze_dormant_customers_by_range result, or None if it hasn't been computed."""
+    return analysis_cache.get(range_analysis_key(dataset_hash, start_date, end_date, shipping_classifier))
+
+def _analyze_dormant_customers_by_range(filepath, start_date, end_date, file_format=None, dataset_hash=None, shipping_classifier=None, control=None,
+                                        refresh=False):
+    """
+    Run the date-range analysis without consulting the result cache.
+
+    The heavy lifting is done by analysis_pipeline, so only the stages that
+    depend on the date range run again when the same dataset is analyzed
+    over another range.
+    """
+    shipping_classifier = shipping_classifier or default_shipping_classifier
+    control = control or AnalysisControl()
+    control.start()
     try:
-        # Try reading with various encodings
-        print("Attempting to read CSV file...")
-        
-        try:
-            # First try with Excel format - your file looks like an Excel export
-            df = pd.read_excel(filepath)
-            print("Successfully read Excel file")
-        except Exception as e:
-            print(f"Error reading as Excel: {e}")
-            try:
-                # Try reading as CSV with different encodings
-                for encoding in ['utf-8', 'latin1', 'cp1252', 'iso-8859-1']:
-                    try:
-                        df = pd.read_csv(filepath, encoding=encoding, low_memory=False)
-                        print(f"Successfully read CSV with {encoding} encoding")
-                        break
-                    except Exception as e:
-                        print(f"Error reading with {encoding}: {e}")
-                        continue
-                else:
-                    # If all encodings fail, create sample data
-                    print("Could not read file with any encoding - using sample data")
-                    df = _create_sample_data()
-            except Exception as e:
-                print(f"Error in CSV reading attempts: {e}")
-                # Create sample data
-                print("Could not read file - using sample data")
-                df = _create_sample_data()
-        
-        # Check if dataframe is empty
-        if df.empty:
-            print("DataFrame is empty - using sample data")
-            df = _create_sample_data()
-        
-        # Display DataFrame shape and columns
-        print(f"DataFrame shape: {df.shape}")
-        print(f"Columns: {df.columns.tolist()}")
-        
-        # Process the DataFrame
-        df = _clean_dataframe(df)
-        
-        # Identify key columns
-        columns = _identify_columns(df)
+        run = analysis_pipeline.run(
+            refresh=refresh, dataset_hash=dataset_hash, file_format=file_format, source=filepath, control=control,
+            start_date=start_date, end_date=end_date, include_end=True,
+            shipping_rules=shipping_classifier.fingerprint(), shipping_classifier=shipping_classifier
+        )
+        df, columns, audit = run['transactions']
+        control.check('finding customers in the date range')
         
         print(f"Analyzing date range: {start_date.strftime('%m/%d/%Y')} to {end_date.strftime('%m/%d/%Y')}")
         
-        # CLEAN DATES BEFORE FILTERING
-        if columns['date'] in df.columns:
-            print("Cleaning date column...")
-            # Replace "#######" with NaT
-            df[columns['date']] = df[columns['date']].astype(str).replace('#######', np.nan)
-            df[columns['date']] = pd.to_datetime(df[columns['date']], errors='coerce')
-            # Handle any NaT values in the date column
-            df = df[df[columns['date']].notna()]
-            print(f"After date cleaning: {len(df)} rows remaining")
-        
-        # CHECK IF REQUESTED DATE RANGE IS IN THE DATA
-        if not df.empty and columns['date'] in df.columns:
-            data_start_date = df[columns['date']].min()
-            data_end_date = df[columns['date']].max()
-            
-            # Only proceed if we have valid dates
-            if not pd.isna(data_start_date) and not pd.isna(data_end_date):
-                print(f"Data date range: {data_start_date.strftime('%m/%d/%Y')} to {data_end_date.strftime('%m/%d/%Y')}")
-                print(f"Requested date range: {start_date.strftime('%m/%d/%Y')} to {end_date.strftime('%m/%d/%Y')}")
-                
-                # Check if requested range is completely outside data range
-                if end_date < data_start_date or start_date > data_end_date:
-                    error_msg = f"Your data doesn't include the requested date range. Your data covers {data_start_date.strftime('%B %d, %Y')} to {data_end_date.strftime('%B %d, %Y')}, but you requested {start_date.strftime('%B %d, %Y')} to {end_date.strftime('%B %d, %Y')}."
-                    raise ValueError(error_msg)
-                
-                # Check if requested range is partially outside data range
-                if start_date < data_start_date or end_date > data_end_date:
-                    print(f"WARNING: Requested date range partially extends beyond your data range.")
+        _check_date_range(run['date_span'], start_date, end_date)
         
-        # Filter for orders in target date range
-        target_range_df = df[(df[columns['date']] >= start_date) & (df[columns['date']] <= end_date)]
-        print(f"Found {len(target_range_df)} transactions in target date range")
-        
-        # Get unique customers who ordered in the target range
-        target_range_customers = target_range_df[columns['customer']].unique()
-        target_range_customers = [c for c in target_range_customers if is_valid_customer(c)]
-        
-        print(f"Found {len(target_range_customers)} unique valid customers in date range")
+        # Valid customers who ordered in the target range
+        target_range_customers = run['range_customers']
 
         # Add a note about data limitations
-        data_limitations = {
-            'warning': "Note: The analysis is based only on the data contained in the uploaded file. If your export doesn't include your complete transaction history, the total order count and lifetime sales may be incomplete.",
-            'data_from_date': df[columns['date']].min().strftime('%m/%d/%Y') if not df.empty and not pd.isna(df[columns['date']].min()) else "Unknown",
-            'data_to_date': df[columns['date']].max().strftime('%m/%d/%Y') if not df.empty and not pd.isna(df[columns['date']].max()) else "Unknown",
-        }
+        data_limitations = _data_limitations(run['date_span'])
         
         # If no customers found in the date range
         if len(target_range_customers) == 0:
             return {
                 'analysis_period': f"{start_date.strftime('%B %d, %Y')} - {end_date.strftime('%B %d, %Y')}",
                 'target_month': f"{start_date.strftime('%m/%d/%Y')} to {end_date.strftime('%m/%d/%Y')}",
+                'dataset_hash': dataset_hash,
+                'start_date': start_date.strftime('%Y-%m-%d'),
+                'end_date': end_date.strftime('%Y-%m-%d'),
+                'data_quality': audit.to_dict(),
                 'dormant_customers': {},
                 'total_count': 0,
                 'total_value': 0,
@@ -275,14 +240,18 @@ def analyze_dormant_customers_by_range(filepath, start_date, end_date):
                 }
             }
         
-        # Process customers to find dormant ones
-        dormant_customers = _process_customers_by_range(df, target_range_customers, columns, end_date)
+        # Dormant customers, most recent last order first
+        dormant_customers_sorted = _shared_records(run['dormant_customers'])
         
         # Check if we have any valid dormant customers
-        if not dormant_customers:
+        if not dormant_customers_sorted and control.stopped_at is None:
             return {
                 'analysis_period': f"{start_date.strftime('%B %d, %Y')} - {end_date.strftime('%B %d, %Y')}",
                 'target_month': f"{start_date.strftime('%m/%d/%Y')} to {end_date.strftime('%m/%d/%Y')}",
+                'dataset_hash': dataset_hash,
+                'start_date': start_date.strftime('%Y-%m-%d'),
+                'end_date': end_date.strftime('%Y-%m-%d'),
+                'data_quality': audit.to_dict(),
                 'dormant_customers': {},
                 'total_count': 0,
                 'total_value': 0,
@@ -293,13 +262,6 @@ def analyze_dormant_customers_by_range(filepath, start_date, end_date):
                     "actions": ["Continue your current customer engagement strategies."]
                 }
             }
-            
-        # Sort dormant customers by last order date (most recent first)
-        dormant_customers_sorted = dict(sorted(
-            dormant_customers.items(),
-            key=lambda item: item[1]['last_order_date'],
-            reverse=True
-        ))
         
         # Calculate total value
         total_value = sum(data['total_spent'] for data in dormant_customers_sorted.values())
@@ -314,21 +276,154 @@ def analyze_dormant_customers_by_range(filepath, start_date, end_date):
             "actions": ["Send personalized emails with special offers based on purchase history", "Follow up with phone calls for high-value customers"]
         }
         
-        return {
-            'analysis_period': f"Your uploaded CSV file includes sales from " + (df[columns['date']].min().strftime('%m/%d/%Y') if not df.empty and not pd.isna(df[columns['date']].min()) else "Unknown") + " to " + (df[columns['date']].max().strftime('%m/%d/%Y') if not df.empty and not pd.isna(df[columns['date']].max()) else "Unknown"),
+        # Score every customer's ordering cadence in one pass; late-but-not-dormant customers are at risk
+        at_risk = []
+        if not control.out_of_time('scoring customers'):
+            at_risk = at_risk_customers(run['customer_scores'], exclude=dormant_customers_sorted.keys())
+            if at_risk:
+                ai_insights["observations"].append(f"{len(at_risk)} other customers are overdue for their next order based on their usual ordering interval and may be about to go dormant.")
+                ai_insights["actions"].append("Reach out to at-risk customers before they go dormant")
+        
+        # RFM segments are scored over all customers, then reported for the dormant set
+        segments = []
+        if not control.out_of_time('segmenting customers'):
+            dormant_segments = run['customer_segments'].loc[list(dormant_customers_sorted)]
+            for customer, segment in zip(dormant_segments.index, dormant_segments['segment']):
+                dormant_customers_sorted[customer]['segment'] = segment
+            segment_observations, segment_recommendations = segment_insights(dormant_segments)
+            ai_insights["observations"].extend(segment_observations)
+            ai_insights["recommendations"].extend(segment_recommendations)
+            segments = segment_summary(dormant_segments)
+        
+        # Spellings merged into each dormant customer, so the combined totals can be explained
+        variants = name_variants(get_customer_aliases(dataset_hash)) if dataset_hash else {}
+        merged_count = 0
+        for customer, data in dormant_customers_sorted.items():
+            data['name_variants'] = variants.get(customer, [])
+            merged_count += bool(data['name_variants'])
+        if merged_count:
+            ai_insights["observations"].append(f"{merged_count} dormant customers appear under more than one name in your export; their orders and sales have been combined.")
+        
+        # Seasonality, product and regional breakdowns from the dataset's sales cube
+        if not control.out_of_time('building sales breakdowns'):
+            ai_insights["observations"].extend(cube_insights(run['sales_cube'], dormant_customers_sorted, shipping_classifier))
+        
+        # Win-back product suggestions from what customers with similar purchases buy
+        if not control.out_of_time('suggesting products'):
+            affinity = run['product_affinity']
+            if affinity is not None:
+                suggestions = affinity.suggestions(dormant_customers_sorted)
+                for customer, data in dormant_customers_sorted.items():
+                    data['suggested_items'] = suggestions.get(customer, [])
+                ai_insights["observations"].extend(affinity_insights(affinity, dormant_customers_sorted, suggestions))
+        
+        result = {
+            'analysis_period': f"Your uploaded CSV file includes sales from {data_limitations['data_from_date']} to {data_limitations['data_to_date']}",
             'target_month': f"Customers who ordered during {start_date.strftime('%m/%d/%Y')} to {end_date.strftime('%m/%d/%Y')} and haven't ordered since.",
+            'dataset_hash': dataset_hash,
+            'start_date': start_date.strftime('%Y-%m-%d'),
+            'end_date': end_date.strftime('%Y-%m-%d'),
+            'data_quality': audit.to_dict(),
             'dormant_customers': dormant_customers_sorted,
             'total_count': len(dormant_customers_sorted),
             'total_value': total_value,
             'data_limitations': data_limitations,
-            'ai_insights': ai_insights
+            'ai_insights': ai_insights,
+            'at_risk_customers': at_risk,
+            'segment_summary': segments,
+            'memory_report': control.memory.report()
         }
         
+        if control.stopped_at is not None:
+            result['partial'] = {
+                'stage': control.stopped_at,
+                'elapsed_seconds': control.elapsed(),
+                'time_budget': control.time_budget
+            }
+            ai_insights["observations"].insert(0, f"Partial results: the analysis reached its {control.time_budget:.0f}-second time limit while {control.stopped_at}, so these figures are incomplete.")
+        
+        return result
+        
     except Exception as e:
         print(f"Error in analyze_dormant_customers_by_range: {e}")
         traceback.print_exc()
         raise e
 
+def _check_date_range(date_span, start_date, end_date):
+    """Raise ValueError when the requested range lies entirely outside the data's `date_span`."""
+    data_start_date, data_end_date = date_span
+    if data_start_date is None:
+        return
+    print(f"Data date range: {data_start_date.strftime('%m/%d/%Y')} to {data_end_date.strftime('%m/%d/%Y')}")
+    print(f"Requested date range: {start_date.strftime('%m/%d/%Y')} to {end_date.strftime('%m/%d/%Y')}")
+    
+    # Check if requested range is completely outside data range
+    if end_date < data_start_date or start_date > data_end_date:
+        error_msg = f"Your data doesn't include the requested date range. Your data covers {data_start_date.strftime('%B %d, %Y')} to {data_end_date.strftime('%B %d, %Y')}, but you requested {start_date.strftime('%B %d, %Y')} to {end_date.strftime('%B %d, %Y')}."
+        raise ValueError(error_msg)
+    
+    # Check if requested range is partially outside data range
+    if start_date < data_start_date or end_date > data_end_date:
+        print(f"WARNING: Requested date range partially extends beyond your data range.")
+
+def _data_limitations(date_span):
+    """The note shown with every analysis about what the export covers."""
+    data_start_date, data_end_date = date_span
+    return {
+        'warning': "Note: The analysis is based only on the data contained in the uploaded file. If your export doesn't include your complete transaction history, the total order count and lifetime sales may be incomplete.",
+        'data_from_date': data_start_date.strftime('%m/%d/%Y') if data_start_date is not None else "Unknown",
+        'data_to_date': data_end_date.strftime('%m/%d/%Y') if data_end_date is not None else "Unknown",
+    }
+
+def _rewind(source):
+    """Seek an open buffer back to the start so it can be parsed again."""
+    if hasattr(source, 'seek'):
+        source.seek(0)
+
+def _read_dataframe(source, file_format=None):
+    """
+    Read an export into a DataFrame from a path or an open binary buffer.
+
+    When `file_format` is known the matching reader is used directly; otherwise
+    Excel is tried first and CSV with several encodings after that.
+    """
+    print("Attempting to read CSV file...")
+    
+    if file_format != 'csv':
+        try:
+            # First try with Excel format - your file looks like an Excel export
+            _rewind(source)
+            df = pd.read_excel(source, engine='calamine' if calamine_available() else None)
+            print("Successfully read Excel file")
+            return df
+        except DecompressedSizeError:
+            raise
+        except Exception as e:
+            print(f"Error reading as Excel: {e}")
+    
+    try:
+        # Try reading as CSV with different encodings
+        for encoding in ['utf-8', 'latin1', 'cp1252', 'iso-8859-1']:
+            try:
+                _rewind(source)
+                df = pd.read_csv(source, encoding=encoding, low_memory=False)
+                print(f"Successfully read CSV with {encoding} encoding")
+                return df
+            except DecompressedSizeError:
+                raise
+            except Exception as e:
+                print(f"Error reading with {encoding}: {e}")
+                continue
+        # If all encodings fail, create sample data
+        print("Could not read file with any encoding - using sample data")
+    except DecompressedSizeError:
+        raise
+    except Exception as e:
+        print(f"Error in CSV reading attempts: {e}")
+        # Create sample data
+        print("Could not read file - using sample data")
+    return _create_sample_data()
+
 def _create_sample_data():
     """Create sample data for testing."""
     data = {
@@ -359,6 +454,7 @@ def _identify_columns(df):
     amount_col = None
     item_col = None
     num_col = None
+    region_col = None
     
     # Try to find columns by exact name first
     for i, col in enumerate(column_names):
@@ -375,6 +471,8 @@ def _identify_columns(df):
             item_col = col
         elif col_str == 'num':
             num_col = col
+        elif col_str in ('region', 'territory', 'state') and region_col is None:
+            region_col = col
     
     # If not found by name, try by position (based on your screenshot)
     if date_col is None and len(column_names) > 6:
@@ -390,7 +488,7 @@ def _identify_columns(df):
     if type_col is None and len(column_names) > 3:
         type_col = column_names[3]  # Column D (Type)
     
-    print(f"DEBUG: Using columns: Date={date_col}, Customer={customer_col}, Amount={amount_col}, Item={item_col}, Num={num_col}, Type={type_col}")
+    print(f"DEBUG: Using columns: Date={date_col}, Customer={customer_col}, Amount={amount_col}, Item={item_col}, Num={num_col}, Type={type_col}, Region={region_col}")
     
     return {
         'type': type_col,
@@ -398,9 +496,438 @@ def _identify_columns(df):
         'customer': customer_col,
         'amount': amount_col,
         'item': item_col,
-        'num': num_col
+        'num': num_col,
+        'region': region_col
     }
 
+def _load_transactions(filepath, file_format=None, dataset_hash=None, control=None):
+    """
+    Return (df, columns): the cleaned transactions of an export and its key column names.
+
+    When the dataset store already holds `dataset_hash`, the transactions are
+    memory-mapped from there instead of parsed. Otherwise the export is parsed
+    and cleaned, then written to the store so other workers can map it too.
+
+    Spellings of a customer name that differ only in case, punctuation or
+    legal suffix are merged to one canonical spelling; the name map is
+    cached per dataset (see get_customer_aliases). `control` is
+    checked between the parsing and cleaning stages, and its memory tracker
+    records each stage. Exports whose estimated size exceeds the memory
+    budget are read and cleaned in chunks, keeping only the needed columns.
+    Workbooks are always streamed row by row through the same chunked path,
+    since loading a whole sheet at once is both slow and memory hungry.
+    Compressed exports (.gz, .zst, .zip) are decompressed as they are parsed.
+    Workbooks with several sheets and archives with several exports are
+    parsed part by part in parallel and combined (see export_parts).
+    """
+    control = control or AnalysisControl()
+    memory = control.memory
+    # Audit of this export only, even when one control runs several analyses
+    control.audit = DataQualityAudit()
+    if dataset_hash:
+        stored = dataset_store.load(dataset_hash)
+        if stored is not None:
+            print(f"Using stored dataset {dataset_hash[:12]}")
+            control.audit = DataQualityAudit.from_dict(dataset_store.data_audit(dataset_hash) or {})
+            return stored
+    
+    parts = find_parts(filepath)
+    if parts:
+        print(f"Export has {len(parts)} sheets or files")
+        control.check('reading the file')
+        memory.mode = 'parts'
+        with memory.stage('reading parts'):
+            df, columns = load_parts(filepath, parts, control)
+            memory.record_frame(df)
+        return _merge_and_store(df, columns, dataset_hash, control)
+    
+    export = open_export(filepath)
+    if export is not filepath:
+        print(f"Decompressing {export.compression} export while parsing")
+        try:
+            return _load_transactions(export, file_format, dataset_hash, control)
+        finally:
+            export.close()
+    
+    control.check('reading the file')
+    reader = None
+    loaded = None
+    try:
+        with memory.stage('estimating size'):
+            file_format = file_format or _sniff_format(filepath)
+            reader = _open_workbook(filepath, file_format)
+            sample = _sample_export(filepath, file_format, reader)
+            chunked = False
+            if sample is not None:
+                sample_df, total_rows = sample
+                chunked = memory.over_budget(estimate_frame_bytes(sample_df, total_rows))
+                print(f"Estimated {total_rows} rows, ~{memory.estimate / 1024 / 1024:.0f}MB in memory (budget {memory.budget / 1024 / 1024:.0f}MB)")
+        
+        if sample is not None and (chunked or reader is not None):
+            if chunked:
+                print("Export exceeds the memory budget - switching to chunked loading")
+            memory.mode = 'chunked' if chunked else 'streaming'
+            with memory.stage('reading and cleaning in chunks'):
+                loaded = _read_transactions_chunked(filepath, file_format, sample_df, control, reader)
+                if loaded is not None:
+                    memory.record_frame(loaded[0])
+            if loaded is None:
+                print("Chunked loading failed - falling back to loading the whole file")
+                memory.mode = 'in-memory'
+    finally:
+        if reader is not None:
+            reader.close()
+    
+    if loaded is not None:
+        df, columns = loaded
+    else:
+        with memory.stage('reading'):
+            df = _read_dataframe(filepath, file_format)
+            memory.record_frame(df)
+        control.check('cleaning the data')
+        
+        with memory.stage('cleaning'):
+            # Check if dataframe is empty
+            if df.empty:
+                print("DataFrame is empty - using sample data")
+                df = _create_sample_data()
+            
+            # Display DataFrame shape and columns
+            print(f"DataFrame shape: {df.shape}")
+            print(f"Columns: {df.columns.tolist()}")
+            
+            # Process the DataFrame
+            df = _clean_dataframe(df)
+            
+            # Identify key columns
+            columns = _identify_columns(df)
+            
+            df = _prepare_transactions(df, columns, control.audit)
+            memory.record_frame(df)
+    return _merge_and_store(df, columns, dataset_hash, control)
+
+def _merge_and_store(df, columns, dataset_hash, control):
+    """Merge near-duplicate customer names and write the cleaned transactions to the dataset store."""
+    memory = control.memory
+    control.check('merging customer names')
+    
+    with memory.stage('merging customer names'):
+        # Merge spellings such as "SMITH CO." and "Smith Company LLC" into one customer
+        df, customer_aliases = merge_customer_names(df, columns['customer'])
+    
+    if dataset_hash:
+        index_cache.put((dataset_hash, 'customer_aliases'), customer_aliases)
+        with memory.stage('storing'):
+            stored = dataset_store.save(dataset_hash, df, columns, customer_aliases, control.audit.to_dict())
+        if stored is not None:
+            return stored
+    return df, columns
+
+def _sniff_format(source):
+    """Detect the format of a path or buffer from its first bytes."""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            return detect_format(f.read(8), str(source))
+    _rewind(source)
+    head = source.read(8)
+    _rewind(source)
+    return detect_format(head)
+
+def _source_size(source):
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    source.seek(0, os.SEEK_END)
+    size = source.tell()
+    _rewind(source)
+    return size
+
+def _open_workbook(source, file_format):
+    """A streaming ExcelRowReader for a workbook export, or None for CSV or when it can't be opened."""
+    if file_format not in ('xlsx', 'xls'):
+        return None
+    try:
+        return ExcelRowReader(source, file_format)
+    except DecompressedSizeError:
+        raise
+    except Exception as e:
+        print(f"Could not stream the workbook: {e}")
+        _rewind(source)
+        return None
+
+def _sample_export(source, file_format, reader=None):
+    """
+    (header sample DataFrame, estimated total rows) for the memory estimate, or None if it can't be sampled.
+
+    CSV row counts are extrapolated from the bytes per line at the top of
+    the file; workbook row counts come from the sheet's declared dimensions,
+    read through `reader` (whose sampled rows are kept for the full read).
+    """
+    try:
+        if file_format == 'csv':
+            for encoding in ['utf-8', 'latin1', 'cp1252', 'iso-8859-1']:
+                try:
+                    _rewind(source)
+                    sample = pd.read_csv(source, encoding=encoding, nrows=ESTIMATE_SAMPLE_ROWS, low_memory=False)
+                    break
+                except DecompressedSizeError:
+                    raise
+                except Exception:
+                    continue
+            else:
+                return None
+            if isinstance(source, (str, os.PathLike)):
+                with open(source, 'rb') as f:
+                    head = f.read(ESTIMATE_SAMPLE_BYTES)
+            else:
+                _rewind(source)
+                head = source.read(ESTIMATE_SAMPLE_BYTES)
+            _rewind(source)
+            bytes_per_line = len(head) / max(head.count(b'\n'), 1)
+            return sample, int(_source_size(source) / bytes_per_line)
+        
+        if reader is not None:
+            return reader.sample(ESTIMATE_SAMPLE_ROWS), reader.max_row
+    except DecompressedSizeError:
+        raise
+    except Exception as e:
+        print(f"Could not sample export for the memory estimate: {e}")
+        _rewind(source)
+    return None
+
+def _iter_export_chunks(source, file_format, positions, encoding, reader=None):
+    """Chunks of an export holding only the columns at `positions`, with a running row index."""
+    if reader is not None:
+        yield from reader.chunks(positions, CHUNK_ROWS)
+        return
+    _rewind(source)
+    yield from pd.read_csv(source, encoding=encoding, usecols=positions, chunksize=CHUNK_ROWS, low_memory=False)
+
+def _read_transactions_chunked(source, file_format, sample, control, reader=None):
+    """
+    Low-memory load: read and clean an export in chunks, keeping only the identified columns.
+
+    Produces the same rows as _read_dataframe + _prepare_transactions. The
+    Invoice-only filter depends on the whole file, so it is applied once
+    after the chunks are combined. Workbooks are streamed through `reader`.
+    Returns (df, columns), or None if the export can't be read this way.
+    """
+    if file_format != 'csv' and reader is None:
+        return None
+    
+    columns = _identify_columns(_clean_dataframe(sample))
+    keep = [col for col in dict.fromkeys(columns.values()) if col is not None]
+    keep += [col for col in EXTRA_COLUMNS if col in sample.columns and col not in keep]
+    positions = sorted(list(sample.columns).index(col) for col in keep)
+    
+    for encoding in (['utf-8', 'latin1', 'cp1252', 'iso-8859-1'] if file_format == 'csv' else [None]):
+        parts, saw_invoice = [], False
+        audit = DataQualityAudit()
+        try:
+            for chunk in _iter_export_chunks(source, file_format, positions, encoding, reader):
+                control.check('reading the file in chunks')
+                chunk = _drop_invalid_rows(_clean_dataframe(chunk), columns, audit)
+                if columns['type'] and columns['type'] in chunk.columns:
+                    saw_invoice = saw_invoice or 'Invoice' in chunk[columns['type']].values
+                parts.append(_clean_customers_and_amounts(chunk, columns, audit))
+        except UnicodeDecodeError as e:
+            print(f"Error reading chunks with {encoding}: {e}")
+            continue
+        except (AnalysisStopped, DecompressedSizeError):
+            raise
+        except Exception as e:
+            print(f"Error in chunked read: {e}")
+            return None
+        
+        if not parts:
+            return None
+        df = pd.concat(parts)
+        if saw_invoice:
+            invoices = df[columns['type']] == 'Invoice'
+            audit.record('non_invoice', df, ~invoices, _audit_columns(columns))
+            df = df[invoices]
+        control.audit.merge(audit)
+        print(f"Loaded {len(df)} rows in {len(parts)} chunks ({len(positions)} of {len(sample.columns)} columns)")
+        return df, columns
+    return None
+
+def _prepare_transactions(df, columns, audit=None):
+    """Coerce dates and amounts and drop summary, non-invoice and invalid-customer rows, counting each in `audit`."""
+    df = _drop_invalid_rows(df, columns, audit)
+    df = _filter_invoice_rows(df, columns, audit)
+    return _clean_customers_and_amounts(df, columns, audit)
+
+def _audit_columns(columns):
+    """Columns shown in data-quality audit samples: the identified ones."""
+    return [col for col in dict.fromkeys(columns.values()) if col is not None]
+
+def _drop_invalid_rows(df, columns, audit=None):
+    """Drop rows with unreadable dates, 'Total' summary rows and rows without a transaction type."""
+    # Without an audit to fill, counts go to a throwaway one
+    audit = audit or DataQualityAudit()
+    audit.read(len(df))
+    shown = _audit_columns(columns)
+    
+    # CLEAN DATES BEFORE FILTERING
+    if columns['date'] in df.columns:
+        print("Cleaning date column...")
+        # Replace "#######" with NaT
+        date_text = df[columns['date']].astype(str)
+        hashed = date_text == '#######'
+        dates = pd.to_datetime(date_text.replace('#######', np.nan), errors='coerce')
+        audit.record('hashed_date', df, hashed, shown)
+        audit.record('invalid_date', df, dates.isna() & ~hashed, shown)
+        df[columns['date']] = dates
+        # Handle any NaT values in the date column
+        df = df[dates.notna()]
+        print(f"After date cleaning: {len(df)} rows remaining")
+    
+    # Filter out "Total" rows
+    print("Filtering out 'Total' summary rows...")
+    if not df.empty:
+        total_rows = total_row_mask(df, columns['customer'], columns['type'])
+        audit.record('total_row', df, total_rows, shown)
+        df = df[~total_rows]
+        print(f"Removed {int(total_rows.sum())} 'Total' rows")
+    
+    # IMPORTANT: Ignore rows with Total or blank content
+    if columns['type'] and columns['type'] in df.columns:
+        # Filter out rows without a transaction type
+        missing_type = df[columns['type']].isna()
+        audit.record('missing_type', df, missing_type, shown)
+        df = df[~missing_type]
+    return df
+
+def _filter_invoice_rows(df, columns, audit=None):
+    """Keep only Invoice rows if the export has any."""
+    if columns['type'] and columns['type'] in df.columns:
+        if 'Invoice' in df[columns['type']].values:
+            invoices = df[columns['type']] == 'Invoice'
+            if audit is not None:
+                audit.record('non_invoice', df, ~invoices, _audit_columns(columns))
+            df = df[invoices]
+    return df
+
+def _clean_customers_and_amounts(df, columns, audit=None):
+    """Drop total-like and invalid customer names and convert amounts to floats."""
+    audit = audit or DataQualityAudit()
+    shown = _audit_columns(columns)
+    
+    # Clean up rows with blank or total-like entries
+    total_like = df[columns['customer']].astype(str).str.contains('Total', case=False, na=False)
+    audit.record('total_customer', df, total_like, shown)
+    df = df[~total_like]
+    
+    # IMPORTANT: Filter out invalid customer names (each distinct name is checked once; blanks are invalid)
+    codes, names = pd.factorize(df[columns['customer']])
+    valid = np.append(np.array([is_valid_customer(name) for name in names], dtype=bool), False)[codes]
+    audit.record('invalid_customer', df, ~valid, shown)
+    df = df[valid].copy()
+    
+    # Clean amount column - convert to float, parsing each distinct value once (blanks are 0)
+    codes, values = pd.factorize(df[columns['amount']])
+    parsed = [parse_amount(value) for value in values]
+    unreadable = np.append(np.array([amount is None for amount in parsed], dtype=bool), False)[codes]
+    if unreadable.any():
+        print(f"Warning: {int(unreadable.sum())} amounts could not be converted to numbers and count as 0")
+        audit.record('unparseable_amount', df, unreadable, shown)
+    amounts = np.array([0.0 if amount is None else amount for amount in parsed] + [0.0], dtype='float64')
+    df[columns['amount']] = amounts[codes]
+    
+    return df
+
+def _dataset_stage(name, dataset_hash, source=None, **values):
+    """
+    Output of a dataset-level analysis_pipeline stage, or None if the dataset can't be loaded.
+
+    Uses the memoized output when there is one, then the dataset store,
+    then parses `source` (the stored upload) when one is given.
+    """
+    run = analysis_pipeline.run(dataset_hash=dataset_hash, source=source, file_format=None, control=AnalysisControl(), **values)
+    if source is None and not run.cached(name) and dataset_store.load(dataset_hash) is None:
+        return None
+    return run[name]
+
+def get_cutoff_index(dataset_hash, source=None):
+    """DormancyCutoffIndex for a dataset, built on first use and cached per process."""
+    return _dataset_stage('cutoff_index', dataset_hash, source)
+
+def get_sales_cube(dataset_hash, source=None):
+    """SalesCube for a dataset, built on first use and cached per process."""
+    return _dataset_stage('sales_cube', dataset_hash, source)
+
+def get_product_affinity(dataset_hash, shipping_classifier=None, source=None):
+    """ProductAffinity for a dataset under the given shipping rules, built on first use and cached per process."""
+    shipping_classifier = shipping_classifier or default_shipping_classifier
+    return _dataset_stage('product_affinity', dataset_hash, source, shipping_rules=shipping_classifier.fingerprint(),
+                          shipping_classifier=shipping_classifier)
+
+def compare_dormant_ranges(dataset_hash, start_date, end_date, previous_start, previous_end, previous_hash=None,
+                           source=None, previous_source=None, shipping_classifier=None, control=None):
+    """
+    DormantSetDiff from the dormant customers of a previous date range to those of the current one.
+
+    The previous range may come from another dataset (e.g. last month's
+    export), given by `previous_hash`; by default both ranges are analyzed
+    on `dataset_hash`. The current set is the memoized range analysis.
+    The previous set uses the same rule (an order in the range and none
+    after its end) on the previous dataset's orders: all of them for
+    another export, which is the previous report's data, or within one
+    dataset those up to the current range's end, i.e. the previous report
+    as it stood when the current period closed. So a customer who went
+    quiet and ordered again since counts as reactivated. It is computed
+    on the previous dataset's customer codes (DatasetHandle.dormant_customers).
+    Data comes from the dataset store or `source` / `previous_source` when
+    needed, and customers are coded against the current dataset's cutoff
+    index. Returns (diff, partial) where `partial` is True when the current
+    analysis stopped at `control`'s time budget.
+    """
+    previous_hash = previous_hash or dataset_hash
+    if previous_source is None and previous_hash == dataset_hash:
+        previous_source = source
+    control = control or AnalysisControl()
+    current = analyze_dormant_customers_by_range(source, start_date, end_date, dataset_hash=dataset_hash,
+                                                 shipping_classifier=shipping_classifier, control=control)
+    previous_span = _dataset_stage('date_span', previous_hash, previous_source)
+    if previous_span is None:
+        raise ValueError("The previous dataset is no longer available. Please upload it again.")
+    _check_date_range(previous_span, previous_start, previous_end)
+    control.check('finding previously dormant customers')
+    
+    as_of = max(end_date, previous_end) if previous_hash == dataset_hash else None
+    previous = get_dataset(previous_hash, previous_source).dormant_customers(previous_start, previous_end, as_of=as_of)
+    diff = DormantSetDiff(previous, current['dormant_customers'], get_cutoff_index(dataset_hash, source))
+    print(f"Compared dormant sets: {len(diff.newly_dormant)} newly dormant, {len(diff.reactivated)} reactivated, "
+          f"{len(diff.persisting)} still dormant")
+    return diff, bool(current.get('partial'))
+
+def get_customer_aliases(dataset_hash):
+    """Customer name variant -> canonical name map for a dataset, or {} if unknown."""
+    key = (dataset_hash, 'customer_aliases')
+    aliases = index_cache.get(key)
+    if aliases is None:
+        aliases = dataset_store.customer_aliases(dataset_hash)
+        if aliases is None:
+            return {}
+        index_cache.put(key, aliases)
+    return aliases
+
+def get_dataset(dataset_hash, source=None):
+    """Read-only DatasetHandle for a dataset, built on first use and shared by every thread of the process."""
+    return _dataset_stage('dataset', dataset_hash, source)
+
+def customer_details_from_dataset(dataset_hash, customer_name, source=None):
+    """Summary of one customer computed from the dataset's handle, or None if unavailable."""
+    dataset = get_dataset(dataset_hash, source)
+    if dataset is None:
+        return None
+    # Links may use any spelling that was merged into the canonical name
+    customer_name = get_customer_aliases(dataset_hash).get(customer_name, customer_name)
+    record = dataset.customer_record(customer_name)
+    if record is None:
+        return None
+    record['last_order_date'] = record['last_order_date'].to_pydatetime()
+    return record
+
 def _parse_target_month(target_month):
     """Parse the target month string into start and end dates."""
     try:
@@ -419,36 +946,19 @@ def _parse_target_month(target_month):
     
     return target_month_start, target_month_end
 
-def _process_customers(df, target_month_customers, columns, target_month_end):
-    """Process customers to identify dormant ones."""
+def _process_customers(df, target_month_customers, columns, target_month_end, shipping_classifier=None):
+    """Process customers to identify dormant ones. `df` must come from _prepare_transactions."""
+    shipping_classifier = shipping_classifier or default_shipping_classifier
     dormant_customers = {}
     all_customers_data = {}
     
-    # Filter out "Total" rows
-    print("Filtering out 'Total' summary rows...")
-    total_rows_mask = df.apply(lambda row: is_total_row(row, columns['customer'], columns['type']), axis=1)
-    df = df[~total_rows_mask]
-    print(f"Removed {sum(total_rows_mask)} 'Total' rows")
-    
-    # IMPORTANT: Ignore rows with Total or blank content
-    if columns['type'] and columns['type'] in df.columns:
-        # Filter out rows without a transaction type
-        df = df[~df[columns['type']].isna()]
-        # Keep only Invoice rows if present
-        if 'Invoice' in df[columns['type']].values:
-            df = df[df[columns['type']] == 'Invoice']
-    
-    # Clean up rows with blank or total-like entries
-    df = df[~df[columns['customer']].astype(str).str.contains('Total', case=False, na=False)]
-    
-    # IMPORTANT: Filter out invalid customer names
-    df = df[df[columns['customer']].apply(is_valid_customer)]
-    
-    # Clean amount column - convert to float
-    df[columns['amount']] = df[columns['amount']].apply(safe_float_convert)
-    
     print("\n--- Processing customer data ---")
     
+    # Classify each distinct item name once and drop shipping charges from the amounts
+    non_shipping_df = df
+    if columns['item']:
+        non_shipping_df = df[~shipping_classifier.mask(df[columns['item']])]
+    
     # First, calculate metrics for all customers
     for customer in target_month_customers:
         # Skip invalid customers (additional check)
@@ -457,12 +967,7 @@ def _process_customers(df, target_month_customers, columns, target_month_end):
             continue
             
         # Get all transactions for this customer (excluding shipping)
-        customer_df = df[df[columns['customer']] == customer]
-        
-        # Filter out shipping charges from amounts
-        if columns['item']:
-            non_shipping_mask = ~customer_df[columns['item']].apply(is_shipping_item)
-            customer_df = customer_df[non_shipping_mask]
+        customer_df = non_shipping_df[non_shipping_df[columns['customer']] == customer]
         
         # Calculate total lifetime sales (sum of all non-shipping transactions)
         lifetime_sales = customer_df[columns['amount']].sum()
@@ -510,7 +1015,7 @@ def _process_customers(df, target_month_customers, columns, target_month_end):
                 item_name = str(row[columns['item']])
                 
                 # DEBUG: Check if shipping detection works
-                is_shipping = is_shipping_item(item_name)
+                is_shipping = shipping_classifier.is_shipping(item_name)
                 debug_info.append(f"Item: '{item_name}' -> Shipping: {is_shipping}")
                 print(f"DEBUG: Item '{item_name}' -> is_shipping: {is_shipping}")
                 
@@ -554,118 +1059,39 @@ def _process_customers(df, target_month_customers, columns, target_month_end):
     
     return dormant_customers
 
-def _process_customers_by_range(df, target_range_customers, columns, range_end_date):
-    """Process customers to identify dormant ones based on date range."""
+def _process_customers_by_range(dataset, target_range_customers, range_end_date, control=None):
+    """
+    Find the dormant customers among `target_range_customers` using a DatasetHandle.
+
+    `control` is checked every CUSTOMER_CHECK_INTERVAL customers; when it runs
+    out of time only the customers processed so far are classified.
+    """
     dormant_customers = {}
-    all_customers_data = {}
-    
-    # Filter out "Total" rows
-    print("Filtering out 'Total' summary rows...")
-    total_rows_mask = df.apply(lambda row: is_total_row(row, columns['customer'], columns['type']), axis=1)
-    df = df[~total_rows_mask]
-    print(f"Removed {sum(total_rows_mask)} 'Total' rows")
-    
-    # IMPORTANT: Ignore rows with Total or blank content
-    if columns['type'] and columns['type'] in df.columns:
-        # Filter out rows without a transaction type
-        df = df[~df[columns['type']].isna()]
-        # Keep only Invoice rows if present
-        if 'Invoice' in df[columns['type']].values:
-            df = df[df[columns['type']] == 'Invoice']
-    
-    # Clean up rows with blank or total-like entries
-    df = df[~df[columns['customer']].astype(str).str.contains('Total', case=False, na=False)]
-    
-    # IMPORTANT: Filter out invalid customer names
-    df = df[df[columns['customer']].apply(is_valid_customer)]
-    
-    # Clean amount column - convert to float
-    df[columns['amount']] = df[columns['amount']].apply(safe_float_convert)
+    range_end_date = pd.Timestamp(range_end_date)
     
     print("\n--- Processing customer data for date range ---")
     
-    # First, calculate metrics for all customers
-    for customer in target_range_customers:
+    for i, customer in enumerate(target_range_customers):
+        if control is not None and i % CUSTOMER_CHECK_INTERVAL == 0:
+            if control.out_of_time(f"checking customers ({i:,} of {len(target_range_customers):,} done)"):
+                break
+        
         # Skip invalid customers (additional check)
         if not is_valid_customer(customer):
             print(f"Skipping invalid customer: {customer}")
             continue
-            
-        # Get all transactions for this customer
-        customer_df = df[df[columns['customer']] == customer]
-        
-        # Calculate total lifetime sales (sum of all transactions)
-        lifetime_sales = customer_df[columns['amount']].sum()
         
-        # Count unique invoice numbers (total orders)
-        if columns['num'] and columns['num'] in df.columns:
-            # Count unique invoice numbers
-            unique_invoices = customer_df[columns['num']].unique()
-            total_orders = len(unique_invoices)
-            print(f"Customer '{customer}' has {total_orders} unique invoices")
-        else:
-            # Fall back to just counting unique dates
-            total_orders = customer_df[columns['date']].dt.date.nunique()
-            print(f"Customer '{customer}' has {total_orders} unique dates")
-        
-        # Get last order date
-        last_order_date = customer_df[columns['date']].max()
-        
-        # Get last order transactions and amount
-        last_order_mask = customer_df[columns['date']] == last_order_date
-        last_order_df = customer_df[last_order_mask]
-        last_order_amount = last_order_df[columns['amount']].sum()
-        print(f"Customer '{customer}' - Last order date: {last_order_date}, Amount: ${last_order_amount:.2f}, Total spent: ${lifetime_sales:.2f}")
-        
-        # Store the data
-        all_customers_data[customer] = {
-            'last_order_date': last_order_date,
-            'last_order_amount': last_order_amount,
-            'days_since_order': (pd.Timestamp.now() - last_order_date).days,
-            'total_orders': total_orders,
-            'total_spent': lifetime_sales,
-            'last_order_items': [],
-            'report_incomplete': False  # Flag to indicate if data might be incomplete
-        }
-        
-        # If item_col exists, capture last order items
-        if columns['item']:
-            last_order_items = []
-            for _, row in last_order_df.iterrows():
-                if pd.isna(row[columns['item']]):
-                    continue
-                    
-                item_name = str(row[columns['item']])
-                qty = int(float(row['Qty'])) if 'Qty' in df.columns and not pd.isna(row['Qty']) else 1
-                
-                if qty > 1:
-                    last_order_items.append(f"{qty}x {item_name}")
-                else:
-                    last_order_items.append(item_name)
-                    
-            all_customers_data[customer]['last_order_items'] = last_order_items
-    
-    # Now, identify which customers are dormant
-    for customer, data in all_customers_data.items():
-        # Get all transactions for this customer
-        customer_df = df[df[columns['customer']] == customer]
-        
-        # Check if customer ordered after the range end date
-        after_range_orders = customer_df[customer_df[columns['date']] > range_end_date]
-        if len(after_range_orders) > 0:
-            print(f"Customer '{customer}' ordered after range end date - not dormant")
+        # Customers who ordered after the range end date are not dormant
+        last_order_date = dataset.last_order_date(customer)
+        if last_order_date is None or last_order_date > range_end_date:
             continue
         
-        # Customer is dormant
-        print(f"Customer '{customer}' is dormant - adding to list")
-        
+        data = dataset.customer_record(customer)
         # Convert pd.Timestamp to datetime to avoid NaT issues
-        if isinstance(data['last_order_date'], pd.Timestamp):
-            data['last_order_date'] = data['last_order_date'].to_pydatetime()
-        
-        # Add to dormant customers list
+        data['last_order_date'] = data['last_order_date'].to_pydatetime()
         dormant_customers[customer] = data
     
+    print(f"Found {len(dormant_customers)} dormant customers among {len(target_range_customers)} in the date range")
     return dormant_customers
 
 def _create_sample_results(target_month_start, data_limitations, single_customer=False):
@@ -731,4 +1157,105 @@ def _create_sample_results(target_month_start, data_limitations, single_customer
         'total_value': sum(c['total_spent'] for c in sample_customers.values()),
         'data_limitations': data_limitations,
         'ai_insights': sample_ai_insights
-    }
\ No newline at end of file
+    }
+
+def _shared_records(dormant_customers):
+    """Copies of memoized dormant-customer records, safe to modify, with days_since_order counted to today."""
+    now = pd.Timestamp.now()
+    return {customer: dict(data, days_since_order=(now - data['last_order_date']).days)
+            for customer, data in dormant_customers.items()}
+
+def _transactions_stage(source, file_format, dataset_hash, control):
+    """(df, columns, audit): the cleaned transactions and the audit of cleaning them."""
+    control = control or AnalysisControl()
+    df, columns = _load_transactions(source, file_format, dataset_hash, control)
+    return df, columns, control.audit
+
+def _date_span_stage(transactions):
+    """(first, last) transaction date, or (None, None) when the data has no dates."""
+    df, columns, _ = transactions
+    if df.empty or columns['date'] not in df.columns:
+        return None, None
+    first, last = df[columns['date']].min(), df[columns['date']].max()
+    if pd.isna(first) or pd.isna(last):
+        return None, None
+    return first, last
+
+def _dataset_handle_stage(transactions):
+    df, columns, _ = transactions
+    return DatasetHandle(df, columns)
+
+def _range_customers_stage(dataset, start_date, end_date, include_end):
+    """Valid customers with an order from `start_date` to `end_date` (inclusive when `include_end`)."""
+    customers = dataset.customers_between(start_date, end_date, include_end)
+    print(f"Found {len(customers)} unique valid customers in the date range")
+    return customers
+
+def _by_last_order(dormant_customers):
+    """Dormant customers sorted by last order date (most recent first)."""
+    return dict(sorted(dormant_customers.items(), key=lambda item: item[1]['last_order_date'], reverse=True))
+
+def _dormant_customers_stage(dataset, range_customers, end_date, control):
+    if not range_customers:
+        return {}
+    return _by_last_order(_process_customers_by_range(dataset, range_customers, end_date, control))
+
+def _month_dormant_customers_stage(transactions, range_customers, end_date, shipping_rules, shipping_classifier):
+    df, columns, _ = transactions
+    if not range_customers:
+        return {}
+    return _by_last_order(_process_customers(df, range_customers, columns, end_date, shipping_classifier))
+
+def _customer_summary_stage(transactions):
+    df, columns, _ = transactions
+    return customer_summary(df, columns)
+
+def _customer_scores_stage(transactions):
+    df, columns, _ = transactions
+    return score_customers(df, columns)
+
+def _customer_segments_stage(customer_summary):
+    return rfm_segments(customer_summary)
+
+def _month_customer_segments_stage(transactions, shipping_rules, shipping_classifier):
+    """RFM segments over sales without shipping charges, the same sales month_dormant_customers totals."""
+    df, columns, _ = transactions
+    sales = df
+    if columns['item'] and columns['item'] in df.columns:
+        sales = df[~shipping_classifier.mask(df[columns['item']])]
+    return rfm_segments(customer_summary(sales, dict(columns, num=None)))
+
+def _cutoff_index_stage(customer_summary):
+    return DormancyCutoffIndex.from_summary(customer_summary)
+
+def _sales_cube_stage(transactions):
+    df, columns, _ = transactions
+    return SalesCube.from_transactions(df, columns)
+
+def _product_affinity_stage(transactions, shipping_rules, shipping_classifier):
+    df, columns, _ = transactions
+    return ProductAffinity.from_transactions(df, columns, shipping_classifier)
+
+# Every report is built from these stages. Run values: dataset_hash, source,
+# file_format and control identify and load the export; start_date, end_date
+# and include_end select the customers; shipping_rules is the classifier's
+# fingerprint and shipping_classifier the classifier itself.
+analysis_pipeline = Pipeline([
+    Stage('transactions', _transactions_stage, context=('source', 'file_format', 'dataset_hash', 'control'), key='dataset_hash'),
+    Stage('date_span', _date_span_stage, inputs=('transactions',)),
+    Stage('dataset', _dataset_handle_stage, inputs=('transactions',)),
+    Stage('range_customers', _range_customers_stage, inputs=('dataset',), params=('start_date', 'end_date', 'include_end')),
+    Stage('dormant_customers', _dormant_customers_stage, inputs=('dataset', 'range_customers'),
+          params=('end_date',), context=('control',)),
+    Stage('month_dormant_customers', _month_dormant_customers_stage, inputs=('transactions', 'range_customers'),
+          params=('end_date', 'shipping_rules'), context=('shipping_classifier',)),
+    Stage('customer_summary', _customer_summary_stage, inputs=('transactions',)),
+    Stage('customer_scores', _customer_scores_stage, inputs=('transactions',)),
+    Stage('customer_segments', _customer_segments_stage, inputs=('customer_summary',)),
+    Stage('month_customer_segments', _month_customer_segments_stage, inputs=('transactions',),
+          params=('shipping_rules',), context=('shipping_classifier',)),
+    Stage('cutoff_index', _cutoff_index_stage, inputs=('customer_summary',)),
+    Stage('sales_cube', _sales_cube_stage, inputs=('transactions',)),
+    Stage('product_affinity', _product_affinity_stage, inputs=('transactions',),
+          params=('shipping_rules',), context=('shipping_classifier',)),
+], stage_cache)
@@ -0,0 +1,139 @@
+from types import MappingProxyType
+
+from lazy_imports import lazy_module
+from data_helpers import is_valid_customer
+
+np = lazy_module('numpy')
+pd = lazy_module('pandas')
+
+
+def _frozen(values):
+    """`values` as a numpy array that can't be written to, copied unless it already was read-only (e.g. memory-mapped)."""
+    array = np.asarray(values)
+    if array.flags.writeable:
+        array = array.copy()
+        array.flags.writeable = False
+    return array
+
+
+class DatasetHandle:
+    """
+    Read-only view of one dataset's cleaned transactions for concurrent queries.
+
+    The columns the queries need are held in numpy arrays marked
+    read-only, with the rows grouped by customer, and the handle refuses
+    attribute assignment after construction. Queries only read those arrays
+    and build new objects, so one handle can serve range queries and
+    customer lookups from many threads at once; the numpy work in them runs
+    without holding the GIL.
+    """
+
+    def __init__(self, df, columns):
+        object.__setattr__(self, '_ready', False)
+        self.columns = MappingProxyType(dict(columns))
+        codes, customers = pd.factorize(df[columns['customer']])
+        self.customers = _frozen(np.asarray(customers, dtype=object))
+        self.customer_codes = _frozen(codes.astype('int64'))
+        self.customer_positions = MappingProxyType({name: code for code, name in enumerate(self.customers)})
+        self.dates = _frozen(df[columns['date']].to_numpy(dtype='datetime64[ns]'))
+        self.amounts = _frozen(df[columns['amount']].to_numpy(dtype='float64'))
+
+        # Orders are unique invoice numbers (missing numbers count as one), or unique order dates without a Num column
+        if columns['num'] and columns['num'] in df.columns:
+            order_codes, _ = pd.factorize(df[columns['num']], use_na_sentinel=False)
+        else:
+            order_codes = self.dates.astype('datetime64[D]').astype('int64')
+        self.order_codes = _frozen(order_codes.astype('int64'))
+        self.items = _frozen(df[columns['item']].to_numpy(dtype=object)) if columns['item'] else None
+        self.quantities = _frozen(df['Qty'].to_numpy(dtype=object)) if 'Qty' in df.columns else None
+
+        # Row positions grouped by customer, in file order within each customer
+        known = np.flatnonzero(codes >= 0)
+        self.rows_by_customer = _frozen(known[np.argsort(codes[known], kind='stable')])
+        self.customer_bounds = _frozen(np.concatenate([[0], np.cumsum(np.bincount(codes[known], minlength=len(customers)))]))
+        self._ready = True
+
+    def __setattr__(self, name, value):
+        if self._ready:
+            raise AttributeError(f"DatasetHandle is read-only (tried to set {name})")
+        object.__setattr__(self, name, value)
+
+    def __len__(self):
+        return len(self.dates)
+
+    def customer_rows(self, customer):
+        """Row positions of one customer's transactions (empty if unknown)."""
+        code = self.customer_positions.get(customer)
+        if code is None:
+            return self.rows_by_customer[:0]
+        return self.rows_by_customer[self.customer_bounds[code]:self.customer_bounds[code + 1]]
+
+    def customers_between(self, start_date, end_date, include_end=True):
+        """Valid customers with an order from `start_date` to `end_date`, in order of their first such order."""
+        start, end = pd.Timestamp(start_date).to_datetime64(), pd.Timestamp(end_date).to_datetime64()
+        in_range = (self.dates >= start) & ((self.dates <= end) if include_end else (self.dates < end))
+        codes = pd.unique(self.customer_codes[in_range])
+        return [self.customers[code] for code in codes if code >= 0 and is_valid_customer(self.customers[code])]
+
+    def dormant_customers(self, start_date, end_date, as_of=None):
+        """
+        Valid customers with an order from `start_date` to `end_date` (inclusive) and none after it.
+
+        Orders dated after `as_of` are ignored, so the set is the one a
+        range analysis would have reported on that day. Computed on the
+        customer codes in one pass: returns a DataFrame indexed by customer
+        with last_order_date and total_spent (both as of `as_of`).
+        """
+        start, end = pd.Timestamp(start_date).to_datetime64(), pd.Timestamp(end_date).to_datetime64()
+        counted = self.customer_codes >= 0
+        if as_of is not None:
+            counted &= self.dates <= pd.Timestamp(as_of).to_datetime64()
+        codes, dates = self.customer_codes[counted], self.dates[counted]
+        customers = len(self.customers)
+
+        ordered = np.bincount(codes[(dates >= start) & (dates <= end)], minlength=customers) > 0
+        ordered_later = np.bincount(codes[dates > end], minlength=customers) > 0
+        dormant = np.flatnonzero(ordered & ~ordered_later)
+        dormant = dormant[np.fromiter((is_valid_customer(self.customers[code]) for code in dormant), dtype=bool, count=len(dormant))]
+
+        spent = np.bincount(codes, weights=np.nan_to_num(self.amounts[counted]), minlength=customers)
+        last_order = np.full(customers, np.iinfo('int64').min, dtype='int64')
+        np.maximum.at(last_order, codes, dates.view('int64'))
+        return pd.DataFrame({
+            'last_order_date': last_order[dormant].view('datetime64[ns]'),
+            'total_spent': spent[dormant]
+        }, index=pd.Index(self.customers[dormant], dtype=object, name='customer'))
+
+    def last_order_date(self, customer):
+        rows = self.customer_rows(customer)
+        return pd.Timestamp(self.dates[rows].max()) if len(rows) else None
+
+    def customer_record(self, customer):
+        """The per-customer summary (last order, totals, last order items), or None if the customer is unknown."""
+        rows = self.customer_rows(customer)
+        if not len(rows):
+            return None
+        dates = self.dates[rows]
+        amounts = self.amounts[rows]
+        last_order_date = pd.Timestamp(dates.max())
+        last_order_rows = rows[dates == dates.max()]
+
+        record = {
+            'last_order_date': last_order_date,
+            'last_order_amount': np.nansum(self.amounts[last_order_rows]),
+            'days_since_order': (pd.Timestamp.now() - last_order_date).days,
+            'total_orders': len(np.unique(self.order_codes[rows])),
+            'total_spent': np.nansum(amounts),
+            'last_order_items': [],
+            'report_incomplete': False  # Flag to indicate if data might be incomplete
+        }
+
+        if self.items is not None:
+            for row in last_order_rows:
+                item = self.items[row]
+                if pd.isna(item):
+                    continue
+                quantity = self.quantities[row] if self.quantities is not None else None
+                qty = int(float(quantity)) if quantity is not None and not pd.isna(quantity) else 1
+                record['last_order_items'].append(f"{qty}x {item}" if qty > 1 else str(item))
+        return record
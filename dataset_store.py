@@ -0,0 +1,183 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from importlib.util import find_spec
+
+from lazy_imports import lazy_module
+
+pa = lazy_module('pyarrow')
+feather = lazy_module('pyarrow.feather')
+pd = lazy_module('pandas')
+
+# Bump when the stored columns (or how they are cleaned) change so older files are rebuilt instead of reused
+STORE_FORMAT_VERSION = 5
+
+# Schema metadata key holding the role -> column name mapping from _identify_columns
+COLUMNS_METADATA_KEY = b'trendd.columns'
+
+# Schema metadata key holding the customer name variant -> canonical name map
+ALIASES_METADATA_KEY = b'trendd.customer_aliases'
+
+# Schema metadata key holding the data-quality audit of the cleaning (DataQualityAudit.to_dict)
+AUDIT_METADATA_KEY = b'trendd.data_audit'
+
+# Extra columns kept alongside the identified ones
+EXTRA_COLUMNS = ['Qty']
+
+# Datasets each worker keeps mapped; past this the least recently used mapping is dropped
+MAPPED_DATASETS = int(os.environ.get('TRENDD_MAPPED_DATASETS', '8'))
+
+
+def arrow_available():
+    """True when pyarrow is installed."""
+    return find_spec('pyarrow') is not None
+
+
+def _arrow_strings(arrow_type):
+    """pandas dtype for an Arrow column: text stays Arrow-backed instead of becoming Python strings."""
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return pd.ArrowDtype(arrow_type)
+    return None
+
+
+class DatasetStore:
+    """
+    Cleaned transactions shared between web workers through memory-mapped Arrow files.
+
+    The first worker to clean an upload writes the transactions once as an
+    uncompressed Feather (Arrow IPC) file named after the upload's content
+    hash. Every worker then maps that file read-only, so the column buffers
+    live in the shared page cache instead of one private copy per worker.
+
+    Customer, item and region names are dictionary-encoded, so each worker
+    only builds their distinct values; other text columns stay Arrow-backed.
+    A worker keeps up to `max_mapped` datasets mapped, least recently used
+    first out. Without pyarrow the store is disabled and callers fall back
+    to parsing the upload themselves.
+    """
+
+    def __init__(self, root, max_mapped=MAPPED_DATASETS):
+        self.root = root
+        self.max_mapped = max_mapped
+        self._mapped = OrderedDict()
+        self._aliases = {}
+        self._audits = {}
+        self._lock = threading.Lock()
+
+    def path(self, digest):
+        return os.path.join(self.root, f"{digest}.v{STORE_FORMAT_VERSION}.arrow")
+
+    def load(self, digest):
+        """Return (df, columns) mapped from the store, or None if the dataset isn't stored."""
+        with self._lock:
+            if digest in self._mapped:
+                self._mapped.move_to_end(digest)
+                return self._mapped[digest]
+
+        path = self.path(digest)
+        if not arrow_available() or not os.path.exists(path):
+            return None
+
+        table = feather.read_table(path, memory_map=True)
+        columns = json.loads(table.schema.metadata[COLUMNS_METADATA_KEY])
+        aliases = json.loads(table.schema.metadata.get(ALIASES_METADATA_KEY, b'{}'))
+        audit = json.loads(table.schema.metadata.get(AUDIT_METADATA_KEY, b'{}'))
+        # split_blocks keeps one block per column so numeric columns stay zero-copy views
+        df = table.to_pandas(split_blocks=True, types_mapper=_arrow_strings)
+
+        with self._lock:
+            self._mapped[digest] = (df, columns)
+            self._aliases[digest] = aliases
+            self._audits[digest] = audit
+            while len(self._mapped) > self.max_mapped:
+                dropped, _ = self._mapped.popitem(last=False)
+                self._aliases.pop(dropped, None)
+                self._audits.pop(dropped, None)
+        return df, columns
+
+    def save(self, digest, df, columns, customer_aliases=None, data_audit=None):
+        """
+        Write cleaned transactions to the store and return them mapped (df, columns).
+
+        Only the identified columns (plus Qty) are kept. `customer_aliases`
+        (the name map applied by customer_names.merge_customer_names) and
+        `data_audit` (the cleaning's DataQualityAudit.to_dict()) are stored
+        alongside. Returns None when pyarrow isn't installed.
+        """
+        if not arrow_available():
+            return None
+
+        keep = [col for col in dict.fromkeys(columns.values()) if col is not None and col in df.columns]
+        keep += [col for col in EXTRA_COLUMNS if col in df.columns and col not in keep]
+        frame = df[keep].copy()
+
+        # Arrow needs string column names and single-typed columns
+        frame.columns = [str(col) for col in keep]
+        stored_columns = {role: (str(col) if col is not None else None) for role, col in columns.items()}
+        for col in frame.columns:
+            if col in (stored_columns['customer'], stored_columns['item'], stored_columns.get('region')):
+                frame[col] = frame[col].astype('string').astype('category')
+            elif frame[col].dtype == object:
+                frame[col] = frame[col].astype('string')
+
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        metadata[COLUMNS_METADATA_KEY] = json.dumps(stored_columns).encode()
+        metadata[ALIASES_METADATA_KEY] = json.dumps({str(k): str(v) for k, v in (customer_aliases or {}).items()}).encode()
+        metadata[AUDIT_METADATA_KEY] = json.dumps(data_audit or {}).encode()
+        table = table.replace_schema_metadata(metadata)
+
+        os.makedirs(self.root, exist_ok=True)
+        path = self.path(digest)
+        tmp_path = f"{path}.{os.getpid()}.part"
+        feather.write_feather(table, tmp_path, compression='uncompressed')
+        os.replace(tmp_path, path)
+        print(f"Stored dataset {digest[:12]} ({len(frame)} rows) at {path}")
+
+        return self.load(digest)
+
+    def customer_aliases(self, digest):
+        """Customer name variant -> canonical name map for a stored dataset, or None if it isn't stored."""
+        if self.load(digest) is None:
+            return None
+        with self._lock:
+            return self._aliases.get(digest, {})
+
+    def data_audit(self, digest):
+        """Data-quality audit dict of a stored dataset ({} if none was saved), or None if it isn't stored."""
+        if self.load(digest) is None:
+            return None
+        with self._lock:
+            return self._audits.get(digest, {})
+
+    def forget(self, digest):
+        """Drop this process's mapping of a dataset (the file stays on disk)."""
+        with self._lock:
+            self._mapped.pop(digest, None)
+            self._aliases.pop(digest, None)
+            self._audits.pop(digest, None)
+
+    def remove(self, digest):
+        """
+        Forget a dataset and delete its files, including those of older store formats.
+
+        Other workers that still map the file keep reading it until they
+        forget it; the space is freed once the last mapping is closed.
+        """
+        self.forget(digest)
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if name.startswith(f"{digest}.v") and name.endswith('.arrow'):
+                try:
+                    os.remove(os.path.join(self.root, name))
+                    print(f"Removed stored dataset {name}")
+                except OSError as e:
+                    print(f"Could not remove stored dataset {name}: {e}")
+
+
+# Shared store used by the analysis entry points
+dataset_store = DatasetStore(os.environ.get('TRENDD_DATASET_FOLDER', 'datasets'))
@@ -0,0 +1,124 @@
+from lazy_imports import lazy_module
+
+np = lazy_module('numpy')
+pd = lazy_module('pandas')
+
+# Customers listed per set; counts and totals always cover the whole set
+DIFF_TOP_CUSTOMERS = 50
+
+
+class DormantSetDiff:
+    """
+    Who went dormant, came back or stayed dormant between two dormant-customer analyses.
+
+    Customers are coded against one shared index: the current dataset's
+    customers in DormancyCutoffIndex order, then any only seen in the
+    previous analysis. Each dormant set is an integer code array, and the
+    newly dormant, no-longer-dormant and persisting sets are numpy set
+    operations on those arrays, with lifetime values and last order dates
+    held in arrays indexed by code. A previously dormant customer who is no
+    longer dormant counts as reactivated when the current data has a later
+    order from them; the rest simply fall outside the current date range.
+
+    Each dormant set is a dict of customer -> record (as in an analysis
+    result) or a DataFrame indexed by customer; both need total_spent and
+    last_order_date.
+    """
+
+    def __init__(self, previous, current, cutoff_index=None):
+        previous, current = self._frame(previous), self._frame(current)
+        known = pd.Index(cutoff_index.customers if cutoff_index is not None else [], dtype=object)
+        self.customers = known.append(pd.Index(list(previous.index) + list(current.index), dtype=object)).unique()
+        self.previous_codes = self._codes(previous)
+        self.current_codes = self._codes(current)
+        self.previous_value = self._values(previous, self.previous_codes, 'total_spent')
+        self.current_value = self._values(current, self.current_codes, 'total_spent')
+        self.previous_last_order = self._dates(previous, self.previous_codes)
+
+        # Latest order and lifetime value of every customer in the current data
+        self.latest_order = np.full(len(self.customers), np.datetime64('NaT'), dtype='datetime64[D]')
+        self.lifetime_value = self.current_value.copy()
+        if cutoff_index is not None:
+            self.latest_order[:len(known)] = cutoff_index.last_order_dates
+            self.lifetime_value[:len(known)] = cutoff_index.lifetime_sales
+        self.latest_order[self.current_codes] = self._dates(current, self.current_codes)[self.current_codes]
+
+        self.newly_dormant = np.setdiff1d(self.current_codes, self.previous_codes, assume_unique=True)
+        self.persisting = np.intersect1d(self.previous_codes, self.current_codes, assume_unique=True)
+        no_longer = np.setdiff1d(self.previous_codes, self.current_codes, assume_unique=True)
+        came_back = self.latest_order[no_longer] > self.previous_last_order[no_longer]
+        self.reactivated = no_longer[came_back]
+        self.out_of_range = no_longer[~came_back]
+
+    @staticmethod
+    def _frame(dormant_customers):
+        if isinstance(dormant_customers, pd.DataFrame):
+            return dormant_customers
+        return pd.DataFrame({
+            'total_spent': [data.get('total_spent') for data in dormant_customers.values()],
+            'last_order_date': [data.get('last_order_date') for data in dormant_customers.values()]
+        }, index=pd.Index(list(dormant_customers), dtype=object))
+
+    def _codes(self, dormant_customers):
+        return self.customers.get_indexer(dormant_customers.index).astype('int64')
+
+    def _values(self, dormant_customers, codes, field):
+        values = np.zeros(len(self.customers))
+        values[codes] = pd.to_numeric(dormant_customers[field], errors='coerce').fillna(0).to_numpy(dtype='float64')
+        return values
+
+    def _dates(self, dormant_customers, codes):
+        dates = np.full(len(self.customers), np.datetime64('NaT'), dtype='datetime64[D]')
+        dates[codes] = pd.to_datetime(dormant_customers['last_order_date']).to_numpy(dtype='datetime64[D]')
+        return dates
+
+    def _listing(self, codes, top, **columns):
+        """Up to `top` customers of a set, by the first of `columns` (name -> value array) descending."""
+        sort_values = next(iter(columns.values()))[codes]
+        ordered = codes[np.argsort(-sort_values, kind='stable')][:top]
+        return [
+            dict({'customer': self.customers[code]},
+                 **{name: (str(values[code]) if values.dtype.kind == 'M' else round(float(values[code]), 2))
+                    for name, values in columns.items()})
+            for code in ordered
+        ]
+
+    def summary(self, top=DIFF_TOP_CUSTOMERS):
+        """Counts, value totals and deltas for each set, with its `top` customers by value."""
+        previous_total = float(self.previous_value[self.previous_codes].sum())
+        current_total = float(self.current_value[self.current_codes].sum())
+        regained = self.lifetime_value - self.previous_value
+        change = self.current_value - self.previous_value
+        return {
+            'previous': {'count': len(self.previous_codes), 'total_value': round(previous_total, 2)},
+            'current': {'count': len(self.current_codes), 'total_value': round(current_total, 2)},
+            'count_delta': len(self.current_codes) - len(self.previous_codes),
+            'value_delta': round(current_total - previous_total, 2),
+            'newly_dormant': {
+                'count': len(self.newly_dormant),
+                'total_value': round(float(self.current_value[self.newly_dormant].sum()), 2),
+                'customers': self._listing(self.newly_dormant, top, total_spent=self.current_value,
+                                           last_order_date=self.latest_order)
+            },
+            'reactivated': {
+                'count': len(self.reactivated),
+                'total_value': round(float(self.previous_value[self.reactivated].sum()), 2),
+                # Sales since coming back: lifetime value now less lifetime value when they were dormant
+                'value_delta': round(float(regained[self.reactivated].sum()), 2),
+                'customers': self._listing(self.reactivated, top, previous_total_spent=self.previous_value,
+                                           total_spent=self.lifetime_value, value_delta=regained,
+                                           last_order_date=self.latest_order)
+            },
+            'persisting': {
+                'count': len(self.persisting),
+                'total_value': round(float(self.current_value[self.persisting].sum()), 2),
+                'value_delta': round(float(change[self.persisting].sum()), 2),
+                'customers': self._listing(self.persisting, top, total_spent=self.current_value,
+                                           previous_total_spent=self.previous_value, value_delta=change,
+                                           last_order_date=self.latest_order)
+            },
+            'out_of_range': {
+                'count': len(self.out_of_range),
+                'total_value': round(float(self.previous_value[self.out_of_range].sum()), 2)
+            }
+        }
@@ -0,0 +1,138 @@
+from collections import deque
+from importlib.util import find_spec
+from itertools import islice
+
+from lazy_imports import lazy_module
+from ingest import DecompressedSizeError
+
+pd = lazy_module('pandas')
+
+
+def calamine_available():
+    """True when python-calamine (a Rust Excel parser, much faster than openpyxl) is installed."""
+    return find_spec('python_calamine') is not None
+
+
+def excel_header(values):
+    """Column names for a header row, named the way pd.read_excel names blank and repeated headers."""
+    header, seen = [], {}
+    for i, value in enumerate(values):
+        name = value if value is not None else f"Unnamed: {i}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        header.append(name)
+    return header
+
+
+def sheet_names(source, file_format='xlsx'):
+    """Names of the sheets in a workbook, in workbook order."""
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    try:
+        if calamine_available():
+            from python_calamine import CalamineWorkbook
+            workbook = CalamineWorkbook.from_object(source)
+            try:
+                return list(workbook.sheet_names)
+            finally:
+                workbook.close()
+        if file_format != 'xlsx':
+            raise ValueError(f"Reading {file_format} files requires python-calamine")
+        from openpyxl import load_workbook
+        workbook = load_workbook(source, read_only=True)
+        try:
+            return list(workbook.sheetnames)
+        finally:
+            workbook.close()
+    finally:
+        if hasattr(source, 'seek'):
+            source.seek(0)
+
+
+class ExcelRowReader:
+    """
+    Row-at-a-time reader for one sheet of a workbook (the first unless `sheet` is given).
+
+    Uses python-calamine when installed (xlsx and xls) and otherwise
+    openpyxl in read-only mode (xlsx only), so cell objects for the whole
+    workbook are never built. Rows read by `sample` are buffered and
+    replayed by `chunks`, so a workbook is only opened and parsed once.
+    Blank cells are None with either engine.
+    """
+
+    def __init__(self, source, file_format='xlsx', sheet=None):
+        self.source = source
+        self._workbook = None
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        if calamine_available():
+            try:
+                from python_calamine import CalamineWorkbook
+                self._workbook = CalamineWorkbook.from_object(source)
+                worksheet = (self._workbook.get_sheet_by_index(0) if sheet is None
+                             else self._workbook.get_sheet_by_name(sheet))
+                self.engine = 'calamine'
+                self.max_row = worksheet.height
+                self._rows = (
+                    tuple(None if value == '' else value for value in row)
+                    for row in worksheet.iter_rows()
+                )
+            except DecompressedSizeError:
+                raise
+            except Exception as e:
+                print(f"calamine could not open the workbook, using openpyxl: {e}")
+                self._workbook = None
+                if hasattr(source, 'seek'):
+                    source.seek(0)
+        if self._workbook is None:
+            if file_format != 'xlsx':
+                raise ValueError(f"Streaming {file_format} files requires python-calamine")
+            from openpyxl import load_workbook
+            self._workbook = load_workbook(source, read_only=True, data_only=True)
+            worksheet = self._workbook.worksheets[0] if sheet is None else self._workbook[sheet]
+            self.engine = 'openpyxl'
+            self.max_row = worksheet.max_row
+            self._rows = worksheet.iter_rows(values_only=True)
+        self.header = excel_header(next(self._rows, ()))
+        self._buffer = deque()
+        print(f"Streaming workbook with {self.engine} ({self.max_row} rows declared)")
+
+    def sample(self, rows):
+        """DataFrame of up to `rows` rows from the top of the sheet (all columns)."""
+        while len(self._buffer) < rows:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._buffer.append(row)
+        return pd.DataFrame(list(islice(self._buffer, rows)), columns=self.header)
+
+    def chunks(self, positions, chunk_rows):
+        """DataFrames of `chunk_rows` rows holding only the columns at `positions`, with a running row index."""
+        names = [self.header[i] for i in positions]
+        offset = 0
+        while True:
+            batch = []
+            while self._buffer and len(batch) < chunk_rows:
+                batch.append(self._buffer.popleft())
+            batch.extend(islice(self._rows, chunk_rows - len(batch)))
+            if not batch:
+                break
+            projected = [[row[i] if i < len(row) else None for i in positions] for row in batch]
+            yield pd.DataFrame(projected, columns=names, index=pd.RangeIndex(offset, offset + len(batch)))
+            offset += len(batch)
+
+    def close(self):
+        if self._workbook is not None:
+            self._workbook.close()
+            self._workbook = None
+        if hasattr(self.source, 'seek'):
+            self.source.seek(0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
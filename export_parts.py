@@ -0,0 +1,244 @@
+import io
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from lazy_imports import lazy_module
+from ingest import (DecompressedStream, DecompressedSizeError, MAX_DECOMPRESSED_BYTES, SNIFF_BYTES,
+                    archive_members, detect_compression, detect_format)
+from excel_reader import ExcelRowReader, sheet_names
+from dataset_store import EXTRA_COLUMNS
+from data_audit import DataQualityAudit
+
+pd = lazy_module('pandas')
+
+# Worker processes parsing the parts of one export
+PART_WORKERS = int(os.environ.get('TRENDD_PART_WORKERS', str(min(os.cpu_count() or 1, 8))))
+
+# Exports smaller than this are parsed part by part in-process; starting workers would take longer
+PARALLEL_MIN_BYTES = 8 * 1024 * 1024
+
+# Rows per batch when reading a sheet
+SHEET_CHUNK_ROWS = 50000
+
+_WORKBOOK_FORMATS = ('xlsx', 'xls')
+
+# Source of the export in a worker process, set once per worker by _init_worker
+_worker_base = None
+
+
+def _location(source):
+    """(base, compression, member, max_bytes): how to open `source` again from its stored or received bytes."""
+    if isinstance(source, DecompressedStream):
+        return source.source, source.compression, source.member, source.max_bytes
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            head = f.read(SNIFF_BYTES)
+        return source, detect_compression(head, str(source)), None, MAX_DECOMPRESSED_BYTES
+    source.seek(0)
+    head = source.read(SNIFF_BYTES)
+    source.seek(0)
+    return source, detect_compression(head), None, MAX_DECOMPRESSED_BYTES
+
+
+def _open_base(base):
+    if isinstance(base, (str, os.PathLike)):
+        return open(base, 'rb')
+    if isinstance(base, bytes):
+        return io.BytesIO(base)
+    base.seek(0)
+    return base
+
+
+def _open_stream(base, compression, member, max_bytes):
+    """Readable stream of one export in `base`, decompressed when needed."""
+    if compression:
+        return DecompressedStream(base if not isinstance(base, bytes) else io.BytesIO(base), compression, max_bytes, member)
+    return _open_base(base)
+
+
+def _part_format(stream, member):
+    head = stream.read(SNIFF_BYTES)
+    stream.seek(0)
+    return detect_format(head, member or getattr(stream, 'name', None))
+
+
+def find_parts(source):
+    """
+    The parts of an export that has several, or None for a single-part export.
+
+    Parts are the exports in a zip archive and the sheets of a workbook
+    (including each workbook in an archive). Each part is a dict with
+    'member' (archive member or None), 'sheet' (sheet name or None) and
+    'size' (approximate uncompressed bytes, for scheduling).
+    """
+    base, compression, member, max_bytes = _location(source)
+    try:
+        if compression == 'zip' and member is None:
+            handle = _open_base(base)
+            try:
+                members = archive_members(zipfile.ZipFile(handle))
+            finally:
+                if handle is not base:
+                    handle.close()
+            if sum(info.file_size for info in members) > max_bytes:
+                raise DecompressedSizeError(f"The uploaded file decompresses to more than {max_bytes // (1024 * 1024)}MB, which is over the limit.")
+            if len(members) > 1:
+                parts = []
+                for info in members:
+                    sheets = [None]
+                    if detect_format(b'', info.filename) in _WORKBOOK_FORMATS:
+                        with _open_stream(base, compression, info.filename, max_bytes) as stream:
+                            sheets = sheet_names(stream, detect_format(b'', info.filename))
+                    parts.extend({'member': info.filename, 'sheet': sheet, 'size': info.file_size // len(sheets)}
+                                 for sheet in sheets)
+                return parts
+            member = members[0].filename if members else None
+
+        stream = _open_stream(base, compression, member, max_bytes)
+        try:
+            file_format = _part_format(stream, member or (str(base) if isinstance(base, (str, os.PathLike)) else None))
+            if file_format not in _WORKBOOK_FORMATS:
+                return None
+            sheets = sheet_names(stream, file_format)
+            if len(sheets) < 2:
+                return None
+            size = stream.seek(0, io.SEEK_END)
+            return [{'member': member, 'sheet': sheet, 'size': size // len(sheets)} for sheet in sheets]
+        finally:
+            if stream is not base:
+                stream.close()
+            elif hasattr(base, 'seek'):
+                base.seek(0)
+    except DecompressedSizeError:
+        raise
+    except Exception as e:
+        print(f"Could not list the parts of the export: {e}")
+        return None
+
+
+def _init_worker(base):
+    global _worker_base
+    _worker_base = base
+
+
+def _read_part_frame(stream, file_format, sheet):
+    """The raw rows of one part, every column kept."""
+    if file_format in _WORKBOOK_FORMATS:
+        with ExcelRowReader(stream, file_format, sheet) as reader:
+            frames = list(reader.chunks(range(len(reader.header)), SHEET_CHUNK_ROWS))
+            return pd.concat(frames) if frames else pd.DataFrame(columns=reader.header)
+    for encoding in ['utf-8', 'latin1', 'cp1252', 'iso-8859-1']:
+        try:
+            if hasattr(stream, 'seek'):
+                stream.seek(0)
+            return pd.read_csv(stream, encoding=encoding, low_memory=False)
+        except UnicodeDecodeError:
+            continue
+    raise ValueError("unreadable text encoding")
+
+
+def _load_part(part, compression, max_bytes, base=None):
+    """
+    Parse and clean one part of an export; runs in a worker process.
+
+    Returns (df, columns, saw_invoice, audit) with only the identified
+    columns kept; df and columns are None when the part holds no transactions.
+    """
+    # Imported here to avoid a circular import with data_processor
+    from data_processor import _clean_dataframe, _identify_columns, _drop_invalid_rows, _clean_customers_and_amounts
+
+    base = _worker_base if base is None else base
+    label = ' / '.join(name for name in (part['member'], part['sheet']) if name)
+    stream = _open_stream(base, compression, part['member'], max_bytes)
+    try:
+        file_format = _part_format(stream, part['member'] or (str(base) if isinstance(base, (str, os.PathLike)) else None))
+        df = _clean_dataframe(_read_part_frame(stream, file_format, part['sheet']))
+    except DecompressedSizeError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Could not read {label or 'the export'}: {e}")
+    finally:
+        if stream is not base:
+            stream.close()
+
+    columns = _identify_columns(df)
+    audit = DataQualityAudit()
+    if df.empty or any(columns[role] is None or columns[role] not in df.columns for role in ('date', 'customer', 'amount')):
+        print(f"Skipping {label}: no transactions found")
+        audit.read(len(df))
+        audit.record('unrecognized_part', df, [True] * len(df))
+        return None, None, False, audit
+    keep = [col for col in dict.fromkeys(columns.values()) if col is not None]
+    keep += [col for col in EXTRA_COLUMNS if col in df.columns and col not in keep]
+    df = _drop_invalid_rows(df[keep].copy(), columns, audit)
+    saw_invoice = bool(columns['type']) and 'Invoice' in df[columns['type']].values
+    df = _clean_customers_and_amounts(df, columns, audit)
+    print(f"Loaded {len(df)} rows from {label}")
+    return df, columns, saw_invoice, audit
+
+
+def _combine(results, audit):
+    """Rename each part's identified columns to one set of names and concatenate the parts, merging their audits into `audit`."""
+    for _, _, _, part_audit in results:
+        audit.merge(part_audit)
+    loaded = [result[:3] for result in results if result[0] is not None]
+    if not loaded:
+        raise ValueError("None of the sheets or files in this export contain transactions.")
+    roles = list(loaded[0][1])
+    # Each role takes the name it has in the first part that has it
+    canonical = {role: next((columns[role] for _, columns, _ in loaded if columns[role] is not None), None)
+                 for role in roles}
+    frames = []
+    for df, columns, _ in loaded:
+        renames = {columns[role]: canonical[role] for role in roles
+                   if columns[role] is not None and columns[role] != canonical[role]}
+        frames.append(df.rename(columns=renames))
+    df = pd.concat(frames, ignore_index=True)
+    # Keep only invoices when any part has them, as for a single export
+    if any(saw_invoice for _, _, saw_invoice in loaded):
+        invoices = df[canonical['type']] == 'Invoice'
+        audit.record('non_invoice', df, ~invoices, [col for col in dict.fromkeys(canonical.values()) if col is not None])
+        df = df[invoices]
+    print(f"Combined {len(loaded)} of {len(results)} parts: {len(df)} rows")
+    return df, canonical
+
+
+def load_parts(source, parts, control):
+    """
+    (df, columns) for a multi-part export found by find_parts.
+
+    Each part is parsed and cleaned on its own, largest first, in a pool
+    of worker processes (or in-process for small exports and single-core
+    hosts), so the load takes about as long as the largest part. Columns
+    are identified per part and renamed to a common set before the parts
+    are concatenated in their original order. `control` is checked as
+    parts complete, and the parts' data-quality audits are added to its audit.
+    """
+    base, compression, _, max_bytes = _location(source)
+    order = sorted(range(len(parts)), key=lambda i: -parts[i]['size'])
+    results = [None] * len(parts)
+    workers = min(PART_WORKERS, len(parts))
+
+    if workers > 1 and sum(part['size'] for part in parts) >= PARALLEL_MIN_BYTES:
+        # Workers open paths themselves; buffers are sent once per worker
+        if not isinstance(base, (str, os.PathLike)):
+            base.seek(0)
+            base = base.read()
+        print(f"Parsing {len(parts)} parts on {workers} worker processes")
+        pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_init_worker, initargs=(base,))
+        try:
+            futures = {pool.submit(_load_part, parts[i], compression, max_bytes): i for i in order}
+            for future in as_completed(futures):
+                control.check('reading the parts of the export')
+                results[futures[future]] = future.result()
+        finally:
+            pool.shutdown(cancel_futures=True)
+    else:
+        print(f"Parsing {len(parts)} parts in-process")
+        for i in order:
+            control.check('reading the parts of the export')
+            results[i] = _load_part(parts[i], compression, max_bytes, base)
+    return _combine(results, control.audit)
@@ -0,0 +1,454 @@
+import gzip
+import hashlib
+import io
+import mmap
+import os
+import shutil
+import tempfile
+import zipfile
+
+from flask import Request
+
+# Uploads up to this size stay in memory; larger ones roll over to a temp file
+SPOOL_MAX_MEMORY = 8 * 1024 * 1024
+
+# Number of leading bytes kept for format detection
+SNIFF_BYTES = 8
+
+_EXTENSION_FORMATS = {'.csv': 'csv', '.txt': 'csv', '.xlsx': 'xlsx', '.xls': 'xls'}
+
+# Compressed uploads by extension. Zips are only treated as archives by
+# extension, since .xlsx workbooks are zip files too.
+COMPRESSION_EXTENSIONS = {'.gz': 'gzip', '.zst': 'zstd', '.zip': 'zip'}
+
+# Compressed exports may not decompress to more than this (zip/gzip bomb guard)
+MAX_DECOMPRESSED_BYTES = int(os.environ.get('TRENDD_MAX_DECOMPRESSED_MB', '1024')) * 1024 * 1024
+
+_READ_BLOCK = 1024 * 1024
+
+
+class DecompressedSizeError(ValueError):
+    """A compressed export decompresses to more than the allowed size."""
+
+
+def file_digest(path):
+    """SHA-256 hex digest of a file on disk, read in 1MB blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def detect_format(head, filename=None):
+    """Detect the export format from its leading bytes, falling back to the file extension."""
+    if head.startswith(b'PK\x03\x04'):
+        return 'xlsx'
+    if head.startswith(b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'):
+        return 'xls'
+    if filename:
+        ext = os.path.splitext(filename)[1].lower()
+        if ext in _EXTENSION_FORMATS:
+            return _EXTENSION_FORMATS[ext]
+    return 'csv'
+
+
+def detect_compression(head, filename=None):
+    """'gzip', 'zstd' or 'zip' for a compressed upload, or None for a plain export."""
+    if head.startswith(b'\x1f\x8b'):
+        return 'gzip'
+    if head.startswith(b'\x28\xb5\x2f\xfd'):
+        return 'zstd'
+    if head.startswith(b'PK\x03\x04') and filename and filename.lower().endswith('.zip'):
+        return 'zip'
+    return None
+
+
+def compression_extension(compression):
+    """File extension for a compression name ('gzip' -> '.gz')."""
+    return next(ext for ext, name in COMPRESSION_EXTENSIONS.items() if name == compression)
+
+
+def export_filename(filename):
+    """`filename` without a compression extension ('sales.csv.gz' -> 'sales.csv')."""
+    root, ext = os.path.splitext(filename or '')
+    return root if ext.lower() in COMPRESSION_EXTENSIONS else filename
+
+
+def _zstd_reader(source):
+    try:
+        from compression import zstd  # Python 3.14+
+        return zstd.ZstdFile(source)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("Reading .zst files requires the zstandard package")
+    return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(source, closefd=False), _READ_BLOCK)
+
+
+def archive_members(archive):
+    """ZipInfo of every CSV or Excel export in a zip archive, in archive order."""
+    return [info for info in archive.infolist()
+            if not info.is_dir() and not info.filename.startswith('__MACOSX/')
+            and os.path.splitext(info.filename)[1].lower() in _EXTENSION_FORMATS]
+
+
+def _archive_member(archive, name=None):
+    """The export `name` in a zip archive, or its first export when no name is given."""
+    if name is not None:
+        return archive.getinfo(name)
+    members = archive_members(archive)
+    if not members:
+        raise ValueError("The zip file doesn't contain a CSV or Excel export.")
+    return members[0]
+
+
+class DecompressedStream(io.BufferedIOBase):
+    """
+    Read-only stream of a compressed export's decompressed bytes.
+
+    Bytes are decompressed as the parser reads them; no decompressed copy is
+    kept in memory or written to disk. Seeking backwards restarts
+    decompression from the start and seeking forwards reads ahead, so
+    parsers that rewind to re-read the file still work, at the cost of
+    another pass. Reading more than `max_bytes` raises DecompressedSizeError.
+    For zip archives `member` names the export to read (default: the first;
+    see export_parts for reading all of them).
+    """
+
+    def __init__(self, source, compression, max_bytes=None, member=None):
+        super().__init__()
+        self.source = source
+        self.compression = compression
+        self.max_bytes = max_bytes or MAX_DECOMPRESSED_BYTES
+        self.member = member
+        self.name = None
+        self._compressed = None
+        self._archive = None
+        self._reader = None
+        self._pos = 0
+        self._size = None
+        self._restart()
+
+    def _open_compressed(self):
+        if isinstance(self.source, (str, os.PathLike)):
+            return open(self.source, 'rb')
+        self.source.seek(0)
+        return self.source
+
+    def _restart(self):
+        self._close_reader()
+        self._compressed = self._open_compressed()
+        if self.compression == 'gzip':
+            self._reader = gzip.GzipFile(fileobj=self._compressed, mode='rb')
+        elif self.compression == 'zstd':
+            self._reader = _zstd_reader(self._compressed)
+        else:
+            self._archive = zipfile.ZipFile(self._compressed)
+            member = _archive_member(self._archive, self.member)
+            if member.file_size > self.max_bytes:
+                raise DecompressedSizeError(self._too_large())
+            self.name = member.filename
+            self._reader = self._archive.open(member)
+        self._pos = 0
+
+    def _close_reader(self):
+        for handle in (self._reader, self._archive):
+            if handle is not None:
+                handle.close()
+        if self._compressed is not None and self._compressed is not self.source:
+            self._compressed.close()
+        self._reader = self._archive = self._compressed = None
+
+    def _too_large(self):
+        return f"The uploaded file decompresses to more than {self.max_bytes // (1024 * 1024)}MB, which is over the limit."
+
+    def _advance(self, data):
+        self._pos += len(data)
+        if self._pos > self.max_bytes:
+            raise DecompressedSizeError(self._too_large())
+        return data
+
+    def _capped(self, size):
+        # Never decompress more than one byte past the limit in a single call
+        remaining = self.max_bytes - self._pos + 1
+        return remaining if size is None or size < 0 else min(size, remaining)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(_READ_BLOCK), b''))
+        return self._advance(self._reader.read(self._capped(size)))
+
+    def read1(self, size=-1):
+        return self.read(_READ_BLOCK if size is None or size < 0 else size)
+
+    def readline(self, size=-1):
+        return self._advance(self._reader.readline(self._capped(size)))
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._end()
+        if offset < self._pos:
+            self._restart()
+        while self._pos < offset and self.read(min(offset - self._pos, _READ_BLOCK)):
+            pass
+        return self._pos
+
+    def _end(self):
+        """Decompressed size, found by reading to the end once."""
+        if self._size is None:
+            while self.read(_READ_BLOCK):
+                pass
+            self._size = self._pos
+        return self._size
+
+    def compressed_progress(self):
+        """Fraction of the compressed bytes consumed so far, for progress estimates that mustn't read ahead."""
+        position = self._compressed.tell()
+        end = self._compressed.seek(0, io.SEEK_END)
+        self._compressed.seek(position)
+        return min(position / end, 1.0) if end else 1.0
+
+    def close(self):
+        if not self.closed:
+            self._close_reader()
+        super().close()
+
+
+def open_export(source, filename=None, max_bytes=None):
+    """
+    A readable, seekable binary stream of an export's uncompressed bytes.
+
+    `source` is a path or an open binary buffer; compressed exports are
+    wrapped in a DecompressedStream (detected from the leading bytes, and
+    the .zip extension of `filename` or the path), plain ones are returned
+    as they are.
+    """
+    if isinstance(source, DecompressedStream):
+        return source
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            head = f.read(SNIFF_BYTES)
+        filename = filename or str(source)
+    else:
+        source.seek(0)
+        head = source.read(SNIFF_BYTES)
+        source.seek(0)
+    compression = detect_compression(head, filename)
+    if compression is None:
+        return source
+    return DecompressedStream(source, compression, max_bytes)
+
+
+class MappedFile(io.RawIOBase):
+    """Read-only, seekable file object over a memory-mapped file."""
+
+    def __init__(self, fileno):
+        super().__init__()
+        self._map = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        count = max(0, min(len(view), len(self._map) - self._pos))
+        view[:count] = self._map[self._pos:self._pos + count]
+        self._pos += count
+        return count
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._map)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            self._map.close()
+        super().close()
+
+
+class HashingSpool:
+    """
+    Writable upload container that hashes and sniffs bytes as werkzeug receives them.
+
+    Data is kept in memory until it grows past `max_memory`, then moved to an
+    anonymous temp file. Either way the content hash and format are known as
+    soon as the request body has been read, without a second pass over the data.
+    """
+
+    def __init__(self, max_memory=SPOOL_MAX_MEMORY):
+        self.max_memory = max_memory
+        self.size = 0
+        self._file = io.BytesIO()
+        self._in_memory = True
+        self._hash = hashlib.sha256()
+        self._head = b''
+
+    @property
+    def digest(self):
+        return self._hash.hexdigest()
+
+    @property
+    def head(self):
+        return self._head
+
+    @property
+    def in_memory(self):
+        return self._in_memory
+
+    def write(self, data):
+        self._hash.update(data)
+        if len(self._head) < SNIFF_BYTES:
+            self._head += bytes(data[:SNIFF_BYTES - len(self._head)])
+        self.size += len(data)
+        if self._in_memory and self.size > self.max_memory:
+            self._roll_over()
+        return self._file.write(data)
+
+    def _roll_over(self):
+        spilled = tempfile.TemporaryFile()
+        spilled.write(self._file.getbuffer())
+        self._file.close()
+        self._file = spilled
+        self._in_memory = False
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def readline(self, size=-1):
+        return self._file.readline(size)
+
+    def seek(self, offset, whence=0):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def open_buffer(self):
+        """
+        Return a readable, seekable view of the received bytes without copying them.
+
+        In-memory uploads are returned as the underlying BytesIO; uploads that
+        rolled over to disk are memory-mapped read-only.
+        """
+        self._file.flush()
+        if self._in_memory or self.size == 0:
+            self._file.seek(0)
+            return self._file
+        return io.BufferedReader(MappedFile(self._file.fileno()))
+
+    def save_to(self, path):
+        """Write the received bytes to `path` atomically."""
+        tmp_path = f"{path}.part"
+        self._file.flush()
+        with open(tmp_path, 'wb') as out:
+            if self._in_memory:
+                out.write(self._file.getbuffer())
+            else:
+                self._file.seek(0)
+                shutil.copyfileobj(self._file, out, 1024 * 1024)
+        os.replace(tmp_path, path)
+        self._file.seek(0)
+
+
+class IngestRequest(Request):
+    """Flask request class that receives uploaded files into a HashingSpool."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingSpool()
+
+
+class IngestedUpload:
+    """
+    A received upload: its content hash, detected format and parse buffer.
+
+    Compressed uploads are stored and hashed as received; `file_format` is
+    the format of the export inside, and `open_buffer` decompresses it.
+    """
+
+    def __init__(self, filename, spool):
+        self.filename = filename
+        self.spool = spool
+        self.digest = spool.digest
+        self.size = spool.size
+        self.compression = detect_compression(spool.head, filename)
+        if self.compression:
+            stream = DecompressedStream(spool.open_buffer(), self.compression)
+            try:
+                self.file_format = detect_format(stream.read(SNIFF_BYTES), stream.name or export_filename(filename))
+            finally:
+                stream.close()
+        else:
+            self.file_format = detect_format(spool.head, filename)
+
+    @classmethod
+    def from_file_storage(cls, file_storage):
+        """Wrap a werkzeug FileStorage whose stream was produced by IngestRequest."""
+        stream = file_storage.stream
+        if not isinstance(stream, HashingSpool):
+            # Request wasn't parsed by IngestRequest; hash the stream in one pass instead
+            spool = HashingSpool()
+            stream.seek(0)
+            for chunk in iter(lambda: stream.read(1024 * 1024), b''):
+                spool.write(chunk)
+            spool.seek(0)
+            stream = spool
+        return cls(file_storage.filename, stream)
+
+    @property
+    def extension(self):
+        if self.compression:
+            return '.' + self.file_format + compression_extension(self.compression)
+        return '.' + self.file_format
+
+    def open_buffer(self, max_bytes=None):
+        """Parse buffer over the received bytes, decompressing compressed uploads as they are read."""
+        if self.compression:
+            return DecompressedStream(self.spool.open_buffer(), self.compression, max_bytes)
+        return self.spool.open_buffer()
+
+    def save_to(self, path):
+        self.spool.save_to(path)
@@ -1,7 +1,104 @@
-import pandas as pd
 from datetime import datetime, timedelta
 
-def generate_ai_insights(dormant_customers, target_month, df, customer_col, date_col, amount_col, item_col=None, region_col=None):
+from customer_metrics import customer_summary, score_customers
+from data_helpers import default_shipping_classifier
+from product_affinity import ProductAffinity
+from rfm import RFM_BINS, PRIORITY_SEGMENTS, rfm_segments, segment_summary
+from sales_cube import SalesCube
+
+def segment_insights(dormant_segments):
+    """
+    Observation and recommendation text for the RFM segments of a dormant set.
+
+    `dormant_segments` is the rfm_segments frame restricted to dormant customers.
+    Returns (observations, recommendations).
+    """
+    observations = []
+    recommendations = []
+    segments = segment_summary(dormant_segments)
+    if segments:
+        breakdown = ", ".join(f"{s['count']} {s['segment']} (${s['total_value']:.2f})" for s in segments[:4])
+        observations.append(f"RFM Segments: your dormant customers break down as {breakdown}.")
+    for segment in PRIORITY_SEGMENTS:
+        count = int((dormant_segments['segment'] == segment).sum())
+        if count > 0:
+            recommendations.append(f"Prioritize the {count} dormant customers in the '{segment}' segment - they used to order often or recently, so they are the most valuable to win back.")
+            break
+    return observations, recommendations
+
+def cube_insights(sales_cube, dormant_customers, shipping_classifier=None):
+    """
+    Seasonality, top product and regional-share observations for a dormant set, answered from a SalesCube.
+
+    Items flagged by `shipping_classifier` (default rules if omitted) are
+    never reported as the top product.
+    """
+    shipping_classifier = shipping_classifier or default_shipping_classifier
+    insights = []
+    dormant_cube = sales_cube.slice(customer=list(dormant_customers))
+    if len(dormant_cube) == 0:
+        return insights
+    
+    # Check for seasonal patterns
+    try:
+        peak_month, peak_share = dormant_cube.share('month_of_year', measure='lines')
+        if peak_month is not None and peak_share * 100 > 30:  # If more than 30% of orders are in one month
+            peak_month_name = datetime(2000, int(peak_month), 1).strftime('%B')
+            insights.append(f"Seasonal Pattern: {peak_share * 100:.1f}% of these dormant customers' previous orders were in {peak_month_name}, suggesting a seasonal purchasing pattern.")
+    except Exception as e:
+        print(f"Error in trend analysis: {e}")
+    
+    # Most common item in each dormant customer's last month of ordering
+    if dormant_cube.has_dimension('item'):
+        try:
+            cells = dormant_cube.cells
+            last_month = cells.groupby('customer', sort=False)['month'].transform('max')
+            last_month_cube = SalesCube(cells[cells['month'] == last_month], dormant_cube.dimensions, dormant_cube.invoices)
+            top_items = last_month_cube.rollup('item', sort_by='customers')
+            top_items = top_items[top_items['item'].notna() & ~shipping_classifier.mask(top_items['item'])]
+            if not top_items.empty:
+                top_item = top_items.iloc[0]
+                if top_item['customers'] >= 3:  # At least 3 customers bought this
+                    insights.append(f"Product Insight: {int(top_item['customers'])} dormant customers last purchased {top_item['item']}. Consider a targeted promotion for this product line.")
+        except Exception as e:
+            print(f"Error in product analysis: {e}")
+    
+    # Region-based insights (if region data available)
+    if dormant_cube.has_dimension('region'):
+        try:
+            top_region, region_share = dormant_cube.share('region', measure='customers')
+            if top_region is not None and region_share * 100 > 30:  # If more than 30% from one region
+                insights.append(f"Regional Insight: {region_share * 100:.1f}% of your dormant customers are from {top_region}. Consider a region-specific re-engagement campaign.")
+        except Exception as e:
+            print(f"Error in region analysis: {e}")
+    
+    return insights
+
+def affinity_insights(product_affinity, dormant_customers, suggestions=None):
+    """
+    Win-back observations for a dormant set from a ProductAffinity.
+
+    `suggestions` is product_affinity.suggestions(dormant_customers), computed
+    here if omitted.
+    """
+    insights = []
+    try:
+        if suggestions is None:
+            suggestions = product_affinity.suggestions(dormant_customers)
+        top = product_affinity.top_item(dormant_customers)
+        if top is not None and top[1] >= 3:
+            top_item, buyers = top
+            companions = product_affinity.companions(top_item)
+            if companions:
+                companion, together = companions[0]
+                insights.append(f"Product Affinity: {buyers} dormant customers have bought {top_item}, and {together} customers who bought it also bought {companion}. Consider pairing them in a win-back offer.")
+        if suggestions:
+            insights.append(f"Win-back Suggestions: {len(suggestions)} dormant customers have product suggestions based on what customers with similar purchases also buy.")
+    except Exception as e:
+        print(f"Error in product affinity analysis: {e}")
+    return insights
+
+def generate_ai_insights(dormant_customers, target_month, df, customer_col, date_col, amount_col, item_col=None, region_col=None, customer_scores=None, customer_segments=None, sales_cube=None, shipping_classifier=None, product_affinity=None):
     """
     Generate AI insights for dormant customers report.
     
@@ -14,6 +111,11 @@ def generate_ai_insights(dormant_customers, target_month, df, customer_col, date
     - amount_col: Column name for amount
     - item_col: Column name for item (optional)
     - region_col: Column name for region (optional)
+    - customer_scores: Output of customer_metrics.score_customers (computed here if omitted)
+    - customer_segments: Output of rfm.rfm_segments for all customers (computed here if omitted)
+    - sales_cube: SalesCube for the dataset (built here if omitted)
+    - shipping_classifier: data_helpers.ShippingClassifier for the shop (default rules if omitted)
+    - product_affinity: ProductAffinity for the dataset (built here if omitted)
     
     Returns:
     - Dictionary with insights and recommendations
@@ -35,109 +137,72 @@ def generate_ai_insights(dormant_customers, target_month, df, customer_col, date
             "actions": ["Analyze what's working well in your customer engagement approach."]
         }
     
-    # Segment customers by value
-    high_value_customers = {k: v for k, v in dormant_customers.items() if v['total_spent'] >= 1000}
-    mid_value_customers = {k: v for k, v in dormant_customers.items() if 500 <= v['total_spent'] < 1000}
-    low_value_customers = {k: v for k, v in dormant_customers.items() if v['total_spent'] < 500}
+    # Segment customers by RFM quantile scores over the whole customer base
+    if customer_segments is None:
+        # Monetary value counts the same sales as the dormant customers' lifetime totals: shipping charges excluded
+        sales = df
+        if item_col and item_col in df.columns:
+            sales = df[~(shipping_classifier or default_shipping_classifier).mask(df[item_col])]
+        summary_columns = {'customer': customer_col, 'date': date_col, 'amount': amount_col, 'num': None}
+        customer_segments = rfm_segments(customer_summary(sales, summary_columns))
+    dormant_segments = customer_segments[customer_segments.index.isin(list(dormant_customers))]
+    high_value_customers = dormant_segments.index[dormant_segments['m_score'] == RFM_BINS]
+    mid_value_customers = dormant_segments.index[dormant_segments['m_score'] == RFM_BINS - 1]
     
     # Value-based insights
     high_value_count = len(high_value_customers)
     mid_value_count = len(mid_value_customers)
     if high_value_count > 0:
-        high_value_total = sum(data['total_spent'] for data in high_value_customers.values())
-        insights.append(f"There are {high_value_count} high-value dormant customers (${high_value_total:.2f} total lifetime value).")
+        high_value_total = sum(dormant_customers[c]['total_spent'] for c in high_value_customers)
+        insights.append(f"There are {high_value_count} high-value dormant customers (top 20% of all customers by lifetime sales, ${high_value_total:.2f} total lifetime value).")
         
         # Add top high-value customer insight
-        if high_value_customers:
-            top_customer = max(high_value_customers.items(), key=lambda x: x[1]['total_spent'])
-            insights.append(f"Your highest value dormant customer is {top_customer[0]} with ${top_customer[1]['total_spent']:.2f} in lifetime purchases.")
+        top_customer = max(high_value_customers, key=lambda c: dormant_customers[c]['total_spent'])
+        insights.append(f"Your highest value dormant customer is {top_customer} with ${dormant_customers[top_customer]['total_spent']:.2f} in lifetime purchases.")
     
-    # Trend analysis (comparing to previous period if possible)
-    try:
-        # Get customer order dates to check for patterns
-        customer_order_dates = {}
-        for customer, data in dormant_customers.items():
-            customer_df = df[df[customer_col] == customer]
-            dates = sorted(customer_df[date_col].tolist())
-            customer_order_dates[customer] = dates
-        
-        # Check for seasonal patterns
-        months = [d.month for customer in customer_order_dates.values() for d in customer]
-        month_counts = pd.Series(months).value_counts()
-        if len(month_counts) > 0:
-            peak_month = month_counts.idxmax()
-            peak_month_name = datetime(2000, peak_month, 1).strftime('%B')
-            peak_month_pct = month_counts[peak_month] / sum(month_counts) * 100
-            if peak_month_pct > 30:  # If more than 30% of orders are in one month
-                insights.append(f"Seasonal Pattern: {peak_month_pct:.1f}% of these dormant customers' previous orders were in {peak_month_name}, suggesting a seasonal purchasing pattern.")
-    except Exception as e:
-        print(f"Error in trend analysis: {e}")
+    segment_observations, segment_recommendations = segment_insights(dormant_segments)
+    insights.extend(segment_observations)
     
     # Purchase frequency analysis
     try:
-        regular_customers = 0
-        for customer, dates in customer_order_dates.items():
-            if len(dates) >= 3:  # At least 3 orders to detect a pattern
-                intervals = [(dates[i] - dates[i-1]).days for i in range(1, len(dates))]
-                avg_interval = sum(intervals) / len(intervals)
-                if avg_interval <= 45:  # Monthly-ish
-                    regular_customers += 1
+        if customer_scores is None:
+            customer_scores = score_customers(df, {'customer': customer_col, 'date': date_col})
+        dormant_scores = customer_scores[customer_scores.index.isin(list(dormant_customers))]
+        # At least 3 orders to detect a pattern, ordering monthly-ish
+        regular_customers = int(((dormant_scores['status'] != 'insufficient_history') &
+                                 (dormant_scores['mean_interval_days'] <= 45)).sum())
                     
         if regular_customers > 0:
             insights.append(f"Frequency Analysis: {regular_customers} dormant customers previously ordered regularly (avg. interval < 45 days), suggesting they may be ready to order again with the right incentive.")
     except Exception as e:
         print(f"Error in frequency analysis: {e}")
     
-    # Product-based insights
-    if item_col:
-        try:
-            # Find the most common last purchased items among dormant customers
-            last_items = []
-            for customer, data in dormant_customers.items():
-                if 'last_order_items' in data and data['last_order_items']:
-                    last_items.extend(data['last_order_items'])
-            
-            if last_items:
-                item_counts = pd.Series(last_items).value_counts()
-                top_item = item_counts.index[0] if len(item_counts) > 0 else None
-                if top_item:
-                    item_customers = sum(1 for data in dormant_customers.values() 
-                                      if 'last_order_items' in data and 
-                                         any(top_item in item for item in data['last_order_items']))
-                    if item_customers >= 3:  # At least 3 customers bought this
-                        insights.append(f"Product Insight: {item_customers} dormant customers last purchased {top_item}. Consider a targeted promotion for this product line.")
-        except Exception as e:
-            print(f"Error in product analysis: {e}")
+    # Seasonality, product and regional breakdowns come from the pre-aggregated cube
+    if sales_cube is None:
+        cube_columns = {'customer': customer_col, 'date': date_col, 'amount': amount_col,
+                        'item': item_col, 'region': region_col if region_col in df.columns else None}
+        sales_cube = SalesCube.from_transactions(df, cube_columns)
+    insights.extend(cube_insights(sales_cube, dormant_customers, shipping_classifier))
     
-    # Region-based insights (if region data available)
-    if region_col and region_col in df.columns:
-        try:
-            regions = []
-            for customer in dormant_customers:
-                customer_regions = df[df[customer_col] == customer][region_col].unique()
-                regions.extend(customer_regions)
-            
-            if regions:
-                region_counts = pd.Series(regions).value_counts()
-                top_region = region_counts.index[0] if len(region_counts) > 0 else None
-                if top_region:
-                    region_pct = region_counts[top_region] / sum(region_counts) * 100
-                    if region_pct > 30:  # If more than 30% from one region
-                        insights.append(f"Regional Insight: {region_pct:.1f}% of your dormant customers are from {top_region}. Consider a region-specific re-engagement campaign.")
-        except Exception as e:
-            print(f"Error in region analysis: {e}")
+    # Products that customers with similar purchase histories buy together
+    if product_affinity is None and item_col:
+        product_affinity = ProductAffinity.from_transactions(
+            df, {'customer': customer_col, 'item': item_col}, shipping_classifier)
+    if product_affinity is not None:
+        insights.extend(affinity_insights(product_affinity, dormant_customers))
     
     # Generate recommendations based on insights
     if high_value_count > 0:
-        recommendations.append(f"Consider a targeted re-engagement campaign for these dormant customers, particularly focusing on your high-value customers who spent over $1000 lifetime.")
-        actions.append(f"Send a personalized email to high-value dormant customers (Lifetime Sales > $1000) with a special offer based on their purchase history")
+        recommendations.append(f"Consider a targeted re-engagement campaign for these dormant customers, particularly focusing on your high-value customers (top 20% by lifetime sales).")
+        actions.append(f"Send a personalized email to high-value dormant customers (top 20% by lifetime sales) with a special offer based on their purchase history")
     elif mid_value_count > 0:
-        recommendations.append(f"Consider a targeted re-engagement campaign for these dormant customers, particularly focusing on your mid-tier customers who spent over $500 lifetime.")
-        actions.append(f"Send a personalized email to mid-tier dormant customers (Lifetime Sales $500-$1000) with a special offer based on their purchase history")
+        recommendations.append(f"Consider a targeted re-engagement campaign for these dormant customers, particularly focusing on your mid-tier customers (next 20% by lifetime sales).")
+        actions.append(f"Send a personalized email to mid-tier dormant customers (next 20% by lifetime sales) with a special offer based on their purchase history")
     else:
         recommendations.append(f"Consider a targeted re-engagement campaign for these dormant customers with appropriate incentives based on their purchase history.")
+    recommendations.extend(segment_recommendations)
     
-    actions.append("Create a \"We miss you\" campaign with a time-limited discount for mid-tier customers ($500-$1000)")
+    actions.append("Create a \"We miss you\" campaign with a time-limited discount for mid-tier customers (next 20% by lifetime sales)")
     actions.append("Monitor which re-engagement strategies are most effective to refine future campaigns")
     
     # Recommendation for retention
@@ -0,0 +1,192 @@
+import os
+import pickle
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from dataset_store import dataset_store
+
+# Job records are kept next to the cleaned datasets so any worker on the host can answer the polling requests
+JOB_FOLDER = os.environ.get('TRENDD_JOB_FOLDER', os.path.join(dataset_store.root, 'jobs'))
+
+
+class JobRegistry:
+    """
+    Runs analyses in background threads and keeps their results for polling.
+
+    Jobs submitted with the same `key` while one is still queued or running
+    share that job instead of starting another. Finished jobs are kept for
+    `retention_seconds` so the browser can fetch the result. A job submitted
+    with a cancellation.CancelToken can be cancelled; the job function is
+    expected to check the token itself.
+
+    With a `root` folder every change to a job record is also written there
+    as `<job id>.pickle`, so `get` and `cancel` work from any process sharing
+    the folder. Cancelling another process's job creates `<job id>.cancel`,
+    which the job's token watches.
+    """
+
+    def __init__(self, max_workers=2, retention_seconds=3600, root=None):
+        self.retention_seconds = retention_seconds
+        self.root = root
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='trendd-job')
+        self._jobs = {}
+        self._active_keys = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, key=None, info=None, cancel_token=None, **kwargs):
+        """Queue fn(*args, **kwargs) and return its job id; `info` is kept on the job record for display."""
+        with self._lock:
+            self._expire()
+            if key is not None and key in self._active_keys:
+                return self._active_keys[key]
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                'id': job_id,
+                'status': 'queued',
+                'submitted_at': time.time(),
+                'finished_at': None,
+                'result': None,
+                'error': None,
+                'info': info,
+                'cancel_token': cancel_token
+            }
+            if key is not None:
+                self._active_keys[key] = job_id
+            if self.root is not None and cancel_token is not None:
+                cancel_token.watch(self._path(job_id, 'cancel'))
+            self._save(job_id)
+        self._executor.submit(self._run, job_id, key, fn, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, key, fn, args, kwargs):
+        token = self._jobs[job_id]['cancel_token']
+        try:
+            if not self._start(job_id):
+                return
+            result = fn(*args, **kwargs)
+            self._update(job_id, status='done', result=result)
+        except Exception as e:
+            if token is not None and token.cancelled:
+                print(f"Background job {job_id} cancelled")
+                self._update(job_id, status='cancelled', error=str(e))
+                return
+            print(f"Background job {job_id} failed: {e}")
+            traceback.print_exc()
+            self._update(job_id, status='failed', error=str(e))
+        finally:
+            with self._lock:
+                if key is not None and self._active_keys.get(key) == job_id:
+                    del self._active_keys[key]
+                self._jobs[job_id]['finished_at'] = time.time()
+                self._save(job_id)
+
+    def _start(self, job_id):
+        """Move a queued job to running, or to cancelled if it was cancelled while queued; True if it should run."""
+        # One step under the lock, so a cancel can't land between the check and the transition
+        with self._lock:
+            job = self._jobs[job_id]
+            token = job['cancel_token']
+            if job['status'] == 'cancelled' or (token is not None and token.cancelled):
+                job['status'] = 'cancelled'
+                self._save(job_id)
+                return False
+            job['status'] = 'running'
+            self._save(job_id)
+            return True
+
+    def cancel(self, job_id):
+        """Ask a queued or running job to stop; returns False if it can't be cancelled."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return self._cancel_elsewhere(job_id)
+            if job['cancel_token'] is None or job['status'] not in ('queued', 'running'):
+                return False
+            job['cancel_token'].cancel()
+            if job['status'] == 'queued':
+                job['status'] = 'cancelled'
+                self._save(job_id)
+            return True
+
+    def _cancel_elsewhere(self, job_id):
+        """Ask the process running a job from the shared folder to stop it."""
+        job = self._load(job_id)
+        if job is None or not job['cancellable'] or job['status'] not in ('queued', 'running'):
+            return False
+        try:
+            open(self._path(job_id, 'cancel'), 'a').close()
+        except OSError as e:
+            print(f"Could not cancel background job {job_id}: {e}")
+            return False
+        return True
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+            self._save(job_id)
+
+    def _path(self, job_id, suffix):
+        return os.path.join(self.root, f"{job_id}.{suffix}")
+
+    def _save(self, job_id):
+        """Write the job's record to the shared folder; called with the lock held."""
+        if self.root is None:
+            return
+        job = dict(self._jobs[job_id])
+        job['cancellable'] = job.pop('cancel_token') is not None
+        path = self._path(job_id, 'pickle')
+        tmp_path = f"{path}.{os.getpid()}.part"
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(job, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except (OSError, pickle.PicklingError) as e:
+            print(f"Could not store background job {job_id}: {e}")
+
+    def _load(self, job_id):
+        """A job record another process wrote to the shared folder, or None."""
+        # Job ids are uuid4 hex; anything else must not become a path
+        if self.root is None or len(job_id) != 32 or any(c not in '0123456789abcdef' for c in job_id):
+            return None
+        try:
+            with open(self._path(job_id, 'pickle'), 'rb') as f:
+                job = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        if job['finished_at'] and job['finished_at'] < time.time() - self.retention_seconds:
+            return None
+        return job
+
+    def _expire(self):
+        cutoff = time.time() - self.retention_seconds
+        for job_id in [j for j, job in self._jobs.items() if job['finished_at'] and job['finished_at'] < cutoff]:
+            del self._jobs[job_id]
+        if self.root is None:
+            return
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.root, name)
+            try:
+                if os.path.getmtime(path) < cutoff and name.split('.')[0] not in self._jobs:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def get(self, job_id):
+        """A copy of the job's record (id, status, timestamps, result, error, info), or None if unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        return self._load(job_id)
+
+
+# Shared registry for background analyses
+job_registry = JobRegistry(max_workers=int(os.environ.get('TRENDD_JOB_WORKERS', '2')), root=JOB_FOLDER)
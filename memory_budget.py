@@ -0,0 +1,99 @@
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Default memory budget for one analysis, overridable per deployment
+DEFAULT_MEMORY_BUDGET = int(os.environ.get('TRENDD_MEMORY_BUDGET_MB', '1024')) * 1024 * 1024
+
+# Cleaning makes a few full copies of the frame, so estimates are scaled by this factor
+PIPELINE_OVERHEAD = 3
+
+_MB = 1024 * 1024
+
+
+def current_rss_bytes():
+    """Resident set size of this process, or None where /proc isn't available."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_bytes():
+    """Highest resident set size this process has reached so far, or None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+def frame_bytes(df):
+    """Deep memory footprint of a DataFrame, counting the Python strings in object columns."""
+    return int(df.memory_usage(deep=True, index=True).sum())
+
+
+def estimate_frame_bytes(sample, total_rows):
+    """Projected pipeline memory for `total_rows` rows shaped like the `sample` frame."""
+    if sample is None or len(sample) == 0 or not total_rows:
+        return 0
+    return int(frame_bytes(sample) / len(sample) * total_rows * PIPELINE_OVERHEAD)
+
+
+def _mb(value):
+    return round(value / _MB, 1) if value is not None else None
+
+
+class MemoryTracker:
+    """
+    Per-stage memory accounting for one analysis.
+
+    Each `stage` records the process RSS when it ends, the peak RSS so far
+    (a process-wide high-water mark, so it never goes down) and the time
+    taken; `record_frame` adds the deep size of a frame produced by the stage.
+    """
+
+    def __init__(self, budget=None):
+        self.budget = budget or DEFAULT_MEMORY_BUDGET
+        self.stages = []
+        self.estimate = None
+        self.mode = 'in-memory'
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        entry = {'stage': name, 'rss_mb': None, 'peak_rss_mb': None, 'frame_mb': None, 'seconds': None}
+        self.stages.append(entry)
+        try:
+            yield entry
+        finally:
+            entry['seconds'] = round(time.perf_counter() - started, 3)
+            entry['rss_mb'] = _mb(current_rss_bytes())
+            entry['peak_rss_mb'] = _mb(peak_rss_bytes())
+            print(f"Memory after {name}: rss={entry['rss_mb']}MB peak={entry['peak_rss_mb']}MB"
+                  + (f" frame={entry['frame_mb']}MB" if entry['frame_mb'] is not None else "")
+                  + f" ({entry['seconds']}s)")
+
+    def record_frame(self, df):
+        """Attach the deep size of `df` to the current stage."""
+        if self.stages:
+            self.stages[-1]['frame_mb'] = _mb(frame_bytes(df))
+
+    def over_budget(self, estimate):
+        """Record a size estimate and tell whether it exceeds the budget."""
+        self.estimate = estimate
+        return estimate > self.budget
+
+    def report(self):
+        return {
+            'mode': self.mode,
+            'budget_mb': _mb(self.budget),
+            'estimated_mb': _mb(self.estimate),
+            'stages': list(self.stages)
+        }
@@ -0,0 +1,138 @@
+import hashlib
+import time
+
+from result_cache import normalize_date
+
+
+class Stage:
+    """
+    One named step of a Pipeline.
+
+    `func` is called with keyword arguments: the outputs of the `inputs`
+    stages, and the run values named in `params` and `context`. `params`
+    are part of the stage's fingerprint; `context` values (open files, the
+    analysis control, classifier objects) are not, so whatever in them
+    changes the output must also be passed as a param. A stage without
+    inputs reads the run's data, identified by the run value named `key`
+    (the dataset hash); when that is missing nothing is cached. Bump
+    `version` when the stage's output changes.
+    """
+
+    def __init__(self, name, func, inputs=(), params=(), context=(), key=None, version=1):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.params = tuple(params)
+        self.context = tuple(context)
+        self.key = key
+        self.version = version
+
+
+class Pipeline:
+    """
+    Named stages with declared inputs whose outputs are memoized by fingerprint.
+
+    A stage's fingerprint covers its name, version, declared params and its
+    inputs' fingerprints, so an output is reused exactly when nothing
+    upstream of it changed: a new date range reruns only the stages that
+    read the range, and stages of the same data are shared by every report
+    built from them. Fingerprints start with the dataset hash, so
+    `cache.invalidate(dataset_hash)` drops a dataset's intermediates.
+    """
+
+    def __init__(self, stages, cache):
+        self.stages = {stage.name: stage for stage in stages}
+        for stage in stages:
+            missing = [name for name in stage.inputs if name not in self.stages]
+            if missing:
+                raise ValueError(f"Stage {stage.name} needs unknown stages: {', '.join(missing)}")
+        self.cache = cache
+
+    def run(self, refresh=False, **values):
+        """
+        A PipelineRun over `values` (params and context of every stage it will compute).
+
+        With `refresh` every stage is computed again (and cached) instead of
+        reused, e.g. to profile a whole analysis.
+        """
+        return PipelineRun(self, values, refresh)
+
+
+class PipelineRun:
+    """
+    Stage outputs for one set of run values, computed on first access.
+
+    `run['stage']` returns the cached output when the stage's fingerprint
+    matches, and otherwise computes it from its inputs. Outputs computed
+    after the run's `control` stopped for time are partial; they and
+    everything computed from them are not cached. Cached outputs are
+    shared, so callers must copy before modifying them. Each stage's time
+    (None when reused) is appended to the control's `stage_timings`.
+    """
+
+    def __init__(self, pipeline, values, refresh=False):
+        self.pipeline = pipeline
+        self.values = values
+        self.refresh = refresh
+        self.outputs = {}
+        self._fingerprints = {}
+        self._partial = set()
+
+    def fingerprint(self, name):
+        """(dataset hash, stage, digest) identifying the stage's output, or None when it can't be cached."""
+        if name not in self._fingerprints:
+            stage = self.pipeline.stages[name]
+            upstream = [self.fingerprint(input_name) for input_name in stage.inputs]
+            if name in self._partial or any(fingerprint is None for fingerprint in upstream):
+                fingerprint = None
+            elif not stage.inputs and (stage.key is None or self.values.get(stage.key) is None):
+                fingerprint = None
+            else:
+                dataset = self.values[stage.key] if not stage.inputs else upstream[0][0]
+                parts = [stage.name, stage.version] + [normalize_date(self.values.get(param)) for param in stage.params]
+                parts += [fingerprint[2] for fingerprint in upstream]
+                fingerprint = (dataset, stage.name, hashlib.sha1(repr(parts).encode()).hexdigest())
+            self._fingerprints[name] = fingerprint
+        return self._fingerprints[name]
+
+    def cached(self, name):
+        """True when the stage's output is already available without computing it."""
+        if name in self.outputs:
+            return True
+        fingerprint = self.fingerprint(name)
+        return fingerprint is not None and self.pipeline.cache.get(fingerprint) is not None
+
+    def __getitem__(self, name):
+        if name in self.outputs:
+            return self.outputs[name]
+        stage = self.pipeline.stages[name]
+
+        control = self.values.get('control')
+        fingerprint = self.fingerprint(name)
+        cached = self.pipeline.cache.get(fingerprint) if fingerprint is not None and not self.refresh else None
+        if cached is not None:
+            print(f"Stage {name}: reused")
+            if control is not None:
+                control.stage_timings.append({'stage': name, 'seconds': None, 'reused': True})
+            self.outputs[name] = cached[0]
+            return cached[0]
+
+        arguments = {input_name: self[input_name] for input_name in stage.inputs}
+        arguments.update((param, self.values.get(param)) for param in stage.params + stage.context)
+        started = time.perf_counter()
+        output = stage.func(**arguments)
+        seconds = time.perf_counter() - started
+        print(f"Stage {name}: {seconds:.2f}s")
+        if control is not None:
+            control.stage_timings.append({'stage': name, 'seconds': round(seconds, 3), 'reused': False})
+        self.outputs[name] = output
+
+        if control is not None and control.stopped_at is not None:
+            self._partial.add(name)
+        # Inputs may have turned out partial while computing them
+        self._fingerprints.pop(name, None)
+        fingerprint = self.fingerprint(name)
+        if fingerprint is not None:
+            # Wrapped so a None output is cached too
+            self.pipeline.cache.put(fingerprint, (output,))
+        return output
@@ -0,0 +1,222 @@
+import math
+import os
+import time
+
+from lazy_imports import lazy_module
+from ingest import open_export
+from customer_metrics import customer_summary
+from data_helpers import is_valid_customer, normalize_customer_name
+
+np = lazy_module('numpy')
+pd = lazy_module('pandas')
+
+# Customers kept in the preview sample; the sampling rate adapts to reach about this many
+PREVIEW_SAMPLE_CUSTOMERS = 2000
+PREVIEW_CHUNK_ROWS = 100000
+
+# HyperLogLog registers = 2**precision; relative standard error is about 1.04 / sqrt(registers)
+HLL_PRECISION = 12
+
+# Normal quantile for the reported 95% error margins
+Z_95 = 1.96
+
+_HASH_SPACE = float(2 ** 64)
+
+
+class HyperLogLog:
+    """Distinct-count sketch over 64-bit hashes."""
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype='uint8')
+
+    def add_hashes(self, hashes):
+        hashes = np.asarray(hashes, dtype='uint64')
+        if not len(hashes):
+            return
+        index = (hashes >> np.uint64(64 - self.precision)).astype('int64')
+        # Rank = position of the first set bit after the index bits (a sentinel bit bounds it)
+        rest = (hashes << np.uint64(self.precision)) | np.uint64(1 << (self.precision - 1))
+        rank = (64 - np.floor(np.log2(rest.astype('float64')))).astype('uint8')
+        np.maximum.at(self.registers, index, rank)
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.power(2.0, -self.registers.astype('float64')))
+        empty = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and empty:
+            # Linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / empty)
+        return estimate
+
+    @property
+    def relative_error(self):
+        return 1.04 / math.sqrt(len(self.registers))
+
+
+def _hash_values(values):
+    return pd.util.hash_array(values.astype(str).to_numpy(dtype=object))
+
+
+def _customer_keys(names):
+    """
+    Customer names replaced by their normalized form, as the exact analysis merges them.
+
+    Names whose normalized form isn't a valid customer (e.g. only a number)
+    are kept as they are.
+    """
+    codes, uniques = pd.factorize(names)
+    keys = []
+    for name in uniques:
+        key = normalize_customer_name(name)
+        keys.append(key if key and is_valid_customer(key) else name)
+    return pd.Series(np.array(keys, dtype=object)[codes], index=names.index)
+
+
+def _read_chunks(handle, encoding):
+    """CSV chunks of an open export plus a callable giving the fraction of bytes read so far."""
+    if hasattr(handle, 'compressed_progress'):
+        # Finding the decompressed size would mean decompressing the whole file first
+        handle.seek(0)
+        reader = pd.read_csv(handle, encoding=encoding, chunksize=PREVIEW_CHUNK_ROWS, low_memory=False)
+        return reader, handle.compressed_progress
+    handle.seek(0, os.SEEK_END)
+    size = handle.tell() or 1
+    handle.seek(0)
+    reader = pd.read_csv(handle, encoding=encoding, chunksize=PREVIEW_CHUNK_ROWS, low_memory=False)
+    return reader, lambda: min(handle.tell() / size, 1.0)
+
+
+def preview_dormant_customers(source, start_date, end_date, time_budget=5.0, sample_customers=PREVIEW_SAMPLE_CUSTOMERS):
+    """
+    Approximate dormant count and value for a CSV export in one streaming pass.
+
+    Customers are sampled by hash: every row of a sampled customer is kept,
+    so each sampled customer's dormancy is known exactly. The sampling
+    threshold is lowered whenever more than `sample_customers` are kept.
+    Totals are scaled up by the sampling rate with 95% error margins, and
+    distinct customers and invoices are counted with HyperLogLog sketches.
+
+    Customer names are keyed by their normalized form, so spellings the
+    exact analysis merges are sampled and counted as one customer; similar
+    but unequal spellings (TRENDD_FUZZY_CUSTOMER_MERGE) are not merged.
+
+    Reading stops once `time_budget` seconds have passed. An incomplete
+    preview ('complete' False) scales its totals by 'coverage', the
+    fraction of the file read, as well. The rows read are not a random
+    sample of the file and customers may have later orders in the unread
+    part, so each error margin is widened by the unread share of its
+    estimate. Only when nothing could be read are the estimates None.
+    """
+    # Imported here to avoid a circular import with data_processor
+    from data_processor import _clean_dataframe, _identify_columns, _prepare_transactions
+
+    started = time.perf_counter()
+    # Customers whose hash is below the threshold are sampled; None keeps everyone
+    threshold = None
+    customer_sketch, invoice_sketch = HyperLogLog(), HyperLogLog()
+    kept, rows_read, coverage, complete, columns = [], 0, 0.0, False, None
+
+    handle = open_export(source)
+    if isinstance(handle, (str, os.PathLike)):
+        handle = open(handle, 'rb')
+    for encoding in ['utf-8', 'latin1']:
+        try:
+            reader, progress = _read_chunks(handle, encoding)
+            for chunk in reader:
+                chunk = _clean_dataframe(chunk)
+                if columns is None:
+                    columns = _identify_columns(chunk)
+                rows_read += len(chunk)
+
+                names = chunk[columns['customer']]
+                chunk = chunk[names.notna()].copy()
+                chunk[columns['customer']] = _customer_keys(chunk[columns['customer']])
+                hashes = _hash_values(chunk[columns['customer']])
+                customer_sketch.add_hashes(hashes)
+                if columns['num'] and columns['num'] in chunk.columns:
+                    invoices = chunk[columns['num']]
+                    invoice_sketch.add_hashes(_hash_values(invoices[invoices.notna()]))
+
+                kept.append((chunk, hashes))
+                # Lower the threshold so the sample stays at `sample_customers` customers
+                kept_hashes = np.unique(np.concatenate([h for _, h in kept]))
+                if len(kept_hashes) > sample_customers:
+                    threshold = kept_hashes[sample_customers]
+                    kept = [(rows[h < threshold], h[h < threshold]) for rows, h in kept]
+
+                coverage = progress()
+                if time.perf_counter() - started > time_budget:
+                    print(f"Preview time budget reached after {rows_read} rows ({coverage:.0%} of the file)")
+                    break
+            else:
+                complete, coverage = True, 1.0
+            break
+        except UnicodeDecodeError as e:
+            print(f"Preview could not read with {encoding}: {e}")
+            threshold = None
+            customer_sketch, invoice_sketch = HyperLogLog(), HyperLogLog()
+            kept, rows_read, coverage, columns = [], 0, 0.0, None
+    if handle is not source:
+        handle.close()
+
+    if columns is None:
+        return None
+
+    sample = _prepare_transactions(pd.concat([rows for rows, _ in kept]), columns)
+    fraction = float(threshold) / _HASH_SPACE if threshold is not None else 1.0
+
+    dormant_values = np.array([], dtype='float64')
+    if not sample.empty:
+        summary = customer_summary(sample, columns)
+        dates = sample[columns['date']]
+        in_range = (dates >= start_date) & (dates <= end_date)
+        ordered_in_range = in_range.groupby(sample[columns['customer']], observed=True, sort=False).any()
+        ordered_in_range.index = ordered_in_range.index.astype(object)
+        dormant = ordered_in_range.reindex(summary.index, fill_value=False).to_numpy() & (
+            summary['last_order_date'] <= end_date).to_numpy()
+        dormant_values = summary['total_spent'].to_numpy(dtype='float64')[dormant]
+
+    # Horvitz-Thompson estimates under Bernoulli sampling of customers at rate `fraction`,
+    # with the part of the file read treated as a further sample when reading stopped early
+    rate = fraction * coverage
+    unread = 1.0 - coverage
+    if rate > 0:
+        count = len(dormant_values) / rate
+        count_error = Z_95 * math.sqrt(len(dormant_values) * (1 - rate)) / rate + unread * count
+        value = float(dormant_values.sum()) / rate
+        value_error = Z_95 * math.sqrt(float((dormant_values ** 2).sum()) * (1 - rate)) / rate + unread * value
+        customers = customer_sketch.count() / coverage
+        customers_error = Z_95 * customer_sketch.relative_error * customers + unread * customers
+        invoices = invoice_sketch.count() / coverage if columns['num'] else None
+        invoices_error = Z_95 * invoice_sketch.relative_error * invoices + unread * invoices if invoices is not None else None
+    preview = {
+        'analysis_period': f"{start_date.strftime('%m/%d/%Y')} to {end_date.strftime('%m/%d/%Y')}",
+        'dormant_count': None,
+        'dormant_count_error': None,
+        'total_value': None,
+        'total_value_error': None,
+        'total_customers': None,
+        'total_customers_error': None,
+        'total_invoices': None,
+        'total_invoices_error': None,
+        'sample_customers': int(sample[columns['customer']].nunique()) if not sample.empty else 0,
+        'sample_fraction': fraction,
+        'rows_read': rows_read,
+        'coverage': coverage,
+        'complete': complete,
+        'elapsed_ms': (time.perf_counter() - started) * 1000
+    }
+    if rate > 0:
+        preview.update({
+            'dormant_count': int(round(count)),
+            'dormant_count_error': int(math.ceil(count_error)),
+            'total_value': value,
+            'total_value_error': value_error,
+            'total_customers': int(round(customers)),
+            'total_customers_error': int(math.ceil(customers_error)),
+            'total_invoices': int(round(invoices)) if invoices is not None else None,
+            'total_invoices_error': int(math.ceil(invoices_error)) if invoices is not None else None,
+        })
+    return preview
@@ -0,0 +1,166 @@
+from importlib.util import find_spec
+
+from lazy_imports import lazy_module
+from data_helpers import default_shipping_classifier
+
+np = lazy_module('numpy')
+pd = lazy_module('pandas')
+sparse = lazy_module('scipy.sparse')
+
+# Item pairs bought by fewer customers than this are treated as noise
+MIN_SUPPORT = 2
+
+# Most similar items kept per item, which bounds the cost of scoring suggestions
+NEIGHBOURS_PER_ITEM = 20
+
+SUGGESTIONS_PER_CUSTOMER = 3
+
+# Upper bound on the rows of one customer self-join block without scipy
+JOIN_BLOCK_ROWS = 2000000
+
+
+def scipy_available():
+    """True when scipy is installed."""
+    return find_spec('scipy') is not None
+
+
+class ProductAffinity:
+    """
+    Products bought by the same customers, for win-back suggestions.
+
+    Holds the customer x item purchase matrix as sparse coordinates (one
+    entry per customer and item they bought, with the line count). Item
+    co-occurrence is B^T B over the binary matrix; its cosine similarities
+    are pruned to pairs with MIN_SUPPORT customers and the
+    NEIGHBOURS_PER_ITEM closest items per item. A customer's suggestions
+    are the items they haven't bought, scored by summed similarity to the
+    items they have. Nothing dense in customers or items x items is built.
+
+    The matrix products use scipy.sparse when it is installed and pandas
+    joins otherwise. Shipping lines are left out.
+    """
+
+    def __init__(self, customers, items, rows, cols, counts):
+        self.customers = customers
+        self.items = items
+        self.rows = rows
+        self.cols = cols
+        self.counts = counts
+        self.item_customers = np.bincount(cols, minlength=len(items))
+        self.neighbours = self._neighbours()
+
+    @classmethod
+    def from_transactions(cls, df, columns, shipping_classifier=None):
+        """Build from cleaned transactions, or return None when the export has no item column."""
+        item_col = columns.get('item')
+        if not item_col or item_col not in df.columns:
+            return None
+        shipping_classifier = shipping_classifier or default_shipping_classifier
+        item_values = df[item_col].to_numpy(dtype=object)
+        keep = pd.notna(item_values) & ~shipping_classifier.mask(item_values)
+        customer_codes, customers = pd.factorize(df[columns['customer']].to_numpy(dtype=object)[keep])
+        item_codes, items = pd.factorize(item_values[keep])
+
+        # One entry per (customer, item), counting the lines
+        keys = customer_codes.astype('int64') * max(len(items), 1) + item_codes
+        keys, counts = np.unique(keys, return_counts=True)
+        rows, cols = np.divmod(keys, max(len(items), 1))
+        affinity = cls(pd.Index(customers), np.asarray(items, dtype=object), rows, cols, counts)
+        print(f"Product affinity: {len(customers)} customers x {len(items)} items, "
+              f"{len(keys)} purchases, {len(affinity.neighbours)} item links")
+        return affinity
+
+    def _matrix(self, rows, cols, values, shape):
+        return sparse.csr_matrix((values, (rows, cols)), shape=shape)
+
+    def _cooccurrence(self):
+        """(item, other item, customers who bought both) for every pair of distinct items."""
+        if scipy_available():
+            bought = self._matrix(self.rows, self.cols, np.ones(len(self.rows), dtype='int64'),
+                                  (len(self.customers), len(self.items)))
+            together = (bought.T @ bought).tocoo()
+            item, other, count = together.row, together.col, together.data
+        else:
+            # Self-join on customer, in blocks of customers so the join stays bounded;
+            # each pair of items is counted under the key item * width + other
+            width = len(self.items)
+            pairs = pd.DataFrame({'customer': self.rows, 'item': self.cols})
+            per_customer = np.bincount(self.rows, minlength=len(self.customers)).astype('int64')
+            block = np.cumsum(per_customer ** 2) // JOIN_BLOCK_ROWS
+            keys, counts = [np.array([], dtype='int64')], [np.array([], dtype='int64')]
+            for _, part in pairs.groupby(block[self.rows], sort=False):
+                joined = part.merge(part, on='customer')
+                key, count = np.unique(joined['item_x'].to_numpy() * width + joined['item_y'].to_numpy(), return_counts=True)
+                keys.append(key)
+                counts.append(count)
+            together = pd.Series(np.concatenate(counts)).groupby(np.concatenate(keys)).sum()
+            item, other = np.divmod(together.index.to_numpy(dtype='int64'), max(width, 1))
+            count = together.to_numpy()
+        keep = (item != other) & (count >= MIN_SUPPORT)
+        return item[keep].astype('int64'), other[keep].astype('int64'), count[keep].astype('int64')
+
+    def _neighbours(self):
+        """The closest items to each item by cosine similarity, as (item, other, together, similarity) rows."""
+        item, other, together = self._cooccurrence()
+        similarity = together / np.sqrt(self.item_customers[item] * self.item_customers[other])
+        neighbours = pd.DataFrame({'item': item, 'other': other, 'together': together,
+                                   'similarity': similarity.round(9)})
+        neighbours = neighbours.sort_values(['item', 'similarity', 'together', 'other'],
+                                            ascending=[True, False, False, True])
+        return neighbours.groupby('item', sort=False).head(NEIGHBOURS_PER_ITEM).reset_index(drop=True)
+
+    def _customer_codes(self, customers):
+        codes = self.customers.get_indexer(list(customers))
+        return np.unique(codes[codes >= 0])
+
+    def suggestions(self, customers, limit=SUGGESTIONS_PER_CUSTOMER):
+        """Customer name -> up to `limit` items they haven't bought, best first, for the given customers."""
+        codes = self._customer_codes(customers)
+        if not len(codes) or self.neighbours.empty:
+            return {}
+        selected = np.isin(self.rows, codes)
+        rows, cols = self.rows[selected], self.cols[selected]
+
+        if scipy_available():
+            bought = self._matrix(rows, cols, np.ones(len(rows)), (len(self.customers), len(self.items)))
+            similar = self._matrix(self.neighbours['item'].to_numpy(), self.neighbours['other'].to_numpy(),
+                                   self.neighbours['similarity'].to_numpy(), (len(self.items), len(self.items)))
+            scores = (bought @ similar).tocoo()
+            customer, item, score = scores.row, scores.col, scores.data
+        else:
+            pairs = pd.DataFrame({'customer': rows, 'item': cols}).merge(
+                self.neighbours[['item', 'other', 'similarity']], on='item')
+            summed = pairs.groupby(['customer', 'other'], sort=False)['similarity'].sum()
+            customer = summed.index.get_level_values(0).to_numpy()
+            item = summed.index.get_level_values(1).to_numpy()
+            score = summed.to_numpy()
+
+        # Items the customer already buys are reorders, not suggestions
+        width = len(self.items)
+        unbought = ~np.isin(customer.astype('int64') * width + item, rows * width + cols)
+        ranked = pd.DataFrame({'customer': customer[unbought], 'item': item[unbought],
+                               'score': np.round(score[unbought], 9)})
+        ranked = ranked.sort_values(['customer', 'score', 'item'], ascending=[True, False, True])
+        ranked = ranked.groupby('customer', sort=False).head(limit)
+        return {
+            self.customers[code]: list(self.items[group])
+            for code, group in ranked.groupby('customer', sort=False)['item']
+        }
+
+    def top_item(self, customers):
+        """(item, number of the given customers who bought it) for their most widely bought item, or None."""
+        codes = self._customer_codes(customers)
+        cols = self.cols[np.isin(self.rows, codes)]
+        if not len(cols):
+            return None
+        buyers = np.bincount(cols, minlength=len(self.items))
+        best = int(buyers.argmax())
+        return self.items[best], int(buyers[best])
+
+    def companions(self, item, limit=1):
+        """[(other item, customers who bought both)] for the items most often bought with `item`."""
+        codes = np.flatnonzero(self.items == item)
+        if not len(codes):
+            return []
+        closest = self.neighbours[self.neighbours['item'] == codes[0]].head(limit)
+        return [(self.items[other], int(together)) for other, together in zip(closest['other'], closest['together'])]
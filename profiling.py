@@ -0,0 +1,148 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import time
+import uuid
+from datetime import datetime
+
+# Where captured profiles are kept, and how many (newest first) before older ones are deleted
+PROFILE_FOLDER = os.environ.get('TRENDD_PROFILE_FOLDER', 'profiles')
+PROFILE_KEEP = int(os.environ.get('TRENDD_PROFILE_KEEP', '50'))
+
+# Functions listed in a profile's summary, by cumulative time
+PROFILE_TOP_FUNCTIONS = 40
+
+_PROFILE_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+def _top_functions(profiler, limit=PROFILE_TOP_FUNCTIONS):
+    """The `limit` functions with the most cumulative time, as JSON-friendly dicts."""
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    rows = []
+    for (filename, line, function), (_, calls, total, cumulative, _) in stats.stats.items():
+        rows.append({
+            'function': f"{os.path.basename(filename)}:{line}({function})",
+            'calls': calls,
+            'total_seconds': round(total, 4),
+            'cumulative_seconds': round(cumulative, 4)
+        })
+    rows.sort(key=lambda row: row['cumulative_seconds'], reverse=True)
+    return rows[:limit]
+
+
+class ProfileStore:
+    """
+    Analyses run under cProfile on request, kept for download.
+
+    Each profile is two files named by its id: `<id>.prof`, a pstats dump
+    for snakeviz or `python -m pstats`, and `<id>.json`, a summary with the
+    request's details, the dataset's shape, the analysis's stage timings
+    and the hottest functions. Only the newest PROFILE_KEEP are kept.
+
+    cProfile follows the calling thread only, so parts of an export parsed
+    in worker processes show up as time spent waiting for them.
+    """
+
+    def __init__(self, root, keep=PROFILE_KEEP):
+        self.root = root
+        self.keep = keep
+
+    def new_id(self):
+        return uuid.uuid4().hex
+
+    def path(self, profile_id, extension):
+        if not _PROFILE_ID.match(profile_id or ''):
+            raise ValueError(f"Invalid profile id: {profile_id}")
+        return os.path.join(self.root, f"{profile_id}.{extension}")
+
+    def call(self, profile_id, info, fn, *args, **kwargs):
+        """
+        Return fn(*args, **kwargs), run under cProfile and saved as `profile_id`.
+
+        The profile is saved even when `fn` raises. `info` (a dict, e.g. the
+        file name and date range) is stored in the summary; a `control`
+        keyword argument supplies the stage timings.
+        """
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        result, error = None, None
+        profiler.enable()
+        try:
+            result = fn(*args, **kwargs)
+            return result
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            profiler.disable()
+            try:
+                self._save(profile_id, profiler, time.perf_counter() - started, info, kwargs.get('control'), result, error)
+            except Exception as e:
+                print(f"Error saving profile {profile_id}: {e}")
+
+    def _save(self, profile_id, profiler, elapsed, info, control, result, error):
+        os.makedirs(self.root, exist_ok=True)
+        profiler.dump_stats(self.path(profile_id, 'prof'))
+
+        data_quality = result.get('data_quality', {}) if isinstance(result, dict) else {}
+        summary = {
+            'id': profile_id,
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'elapsed_seconds': round(elapsed, 3),
+            'error': error,
+            'info': info or {},
+            'dataset': {
+                'rows_read': data_quality.get('rows_read'),
+                'rows_kept': data_quality.get('rows_kept'),
+                'dormant_customers': result.get('total_count') if isinstance(result, dict) else None
+            },
+            'memory_report': control.memory.report() if control is not None else None,
+            'stage_timings': list(control.stage_timings) if control is not None else [],
+            'top_functions': _top_functions(profiler)
+        }
+        tmp_path = f"{self.path(profile_id, 'json')}.{os.getpid()}.part"
+        with open(tmp_path, 'w') as f:
+            json.dump(summary, f, indent=2, default=str)
+        os.replace(tmp_path, self.path(profile_id, 'json'))
+        print(f"Saved profile {profile_id} ({elapsed:.2f}s) to {self.root}")
+        self._prune()
+
+    def _prune(self):
+        """Delete all but the newest `keep` profiles."""
+        for summary in self.recent(limit=None)[self.keep:]:
+            for extension in ('json', 'prof'):
+                try:
+                    os.remove(self.path(summary['id'], extension))
+                except OSError:
+                    pass
+
+    def summary(self, profile_id):
+        """The saved summary of a profile, or None if there is no such profile."""
+        try:
+            with open(self.path(profile_id, 'json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def recent(self, limit=20):
+        """Summaries of the latest profiles, newest first, without their function lists."""
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return []
+        summaries = []
+        for name in names:
+            profile_id, extension = os.path.splitext(name)
+            summary = self.summary(profile_id) if extension == '.json' and _PROFILE_ID.match(profile_id) else None
+            if summary is not None:
+                summary.pop('top_functions', None)
+                summaries.append(summary)
+        summaries.sort(key=lambda summary: summary['created_at'], reverse=True)
+        return summaries[:limit] if limit is not None else summaries
+
+
+# Shared store for profiles captured in this deployment
+profile_store = ProfileStore(PROFILE_FOLDER)
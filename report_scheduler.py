@@ -0,0 +1,260 @@
+import calendar
+import hashlib
+import os
+import pickle
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+try:
+    import fcntl
+except ImportError:  # Windows: every process runs its own scheduler
+    fcntl = None
+
+from dataset_store import dataset_store
+
+# Local hours (start-end, end exclusive, may wrap past midnight) in which standard reports are precomputed
+PRECOMPUTE_HOURS = os.environ.get('TRENDD_PRECOMPUTE_HOURS', '1-5')
+
+# Seconds between checks for reports to precompute
+PRECOMPUTE_CHECK_SECONDS = 300
+
+# Most recent uploads whose standard reports are kept precomputed
+PRECOMPUTE_DATASETS = int(os.environ.get('TRENDD_PRECOMPUTE_DATASETS', '10'))
+
+# Precomputed reports are kept until the next off-peak window has replaced them
+PRECOMPUTED_TTL_SECONDS = 26 * 3600
+
+# Reports that failed (e.g. a range the export doesn't cover) are retried after this long
+FAILED_RETRY_SECONDS = 24 * 3600
+
+# Precomputed reports are stored next to the cleaned datasets, shared by every worker on the host
+REPORT_FOLDER = os.environ.get('TRENDD_REPORT_FOLDER', os.path.join(dataset_store.root, 'reports'))
+SCHEDULER_LOCK_FILE = 'scheduler.lock'
+
+# Report name -> title of the standard reports offered for every dataset
+STANDARD_REPORTS = {
+    'last_month': "Last month",
+    'last_quarter': "Last quarter",
+    'same_month_last_year': "Same month last year",
+}
+
+
+def _month_end(year, month):
+    return date(year, month, calendar.monthrange(year, month)[1])
+
+
+def standard_report_ranges(today=None):
+    """Report name -> (start, end) datetimes of each standard report as of `today`, end day inclusive."""
+    today = today or date.today()
+    last_month_end = today.replace(day=1) - timedelta(days=1)
+    last_month_start = last_month_end.replace(day=1)
+    last_quarter_end = date(today.year, 3 * ((today.month - 1) // 3) + 1, 1) - timedelta(days=1)
+    last_quarter_start = date(last_quarter_end.year, last_quarter_end.month - 2, 1)
+    ranges = {
+        'last_month': (last_month_start, last_month_end),
+        'last_quarter': (last_quarter_start, last_quarter_end),
+        'same_month_last_year': (last_month_start.replace(year=last_month_start.year - 1),
+                                 _month_end(last_month_start.year - 1, last_month_start.month)),
+    }
+    return {name: (datetime.combine(start, datetime.min.time()), datetime.combine(end, datetime.min.time()))
+            for name, (start, end) in ranges.items()}
+
+
+def in_hours(hours, now=None):
+    """True when `now` (default: the local time) falls within `hours`, e.g. "1-5" or "22-4"."""
+    start, end = (int(hour) for hour in hours.split('-'))
+    hour = (now or datetime.now()).hour
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+class ReportStore:
+    """
+    Precomputed reports on disk, one pickle per analysis key.
+
+    Files are named `<dataset digest>.<hash of the key>.pickle`, where the
+    key is data_processor.range_analysis_key (dataset, dates, analysis
+    version and shipping rules). Reports older than `ttl_seconds` are
+    treated as missing and deleted by `prune`.
+    """
+
+    def __init__(self, root, ttl_seconds=PRECOMPUTED_TTL_SECONDS):
+        self.root = root
+        self.ttl_seconds = ttl_seconds
+
+    def path(self, key):
+        return os.path.join(self.root, f"{key[0]}.{hashlib.sha256(repr(key).encode()).hexdigest()[:32]}.pickle")
+
+    def get(self, key):
+        """The stored report for `key`, or None if there is none or it has expired."""
+        path = self.path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                return None
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    def put(self, key, result):
+        os.makedirs(self.root, exist_ok=True)
+        path = self.path(key)
+        tmp_path = f"{path}.{os.getpid()}.part"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def prune(self, digest=None):
+        """Delete expired reports, or every report of one dataset."""
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return
+        now = time.time()
+        for name in names:
+            if not name.endswith('.pickle'):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                if digest is not None:
+                    expired = name.startswith(f"{digest}.")
+                else:
+                    expired = now - os.path.getmtime(path) > self.ttl_seconds
+                if expired:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+class ReportScheduler:
+    """
+    Precomputes the standard dormant-customer reports of recent uploads in off-peak hours.
+
+    A daemon thread, started by the first `schedule` call, checks every
+    PRECOMPUTE_CHECK_SECONDS. Within `hours` it submits each missing report of
+    the scheduled datasets, then of the PRECOMPUTE_DATASETS most recent uploads,
+    as a background job. Jobs are keyed like the results they produce, so a
+    report a user already started is not computed twice. Finished reports are
+    saved to the ReportStore for PRECOMPUTED_TTL_SECONDS, so opening one from
+    any worker is a file read.
+
+    Only one process per host runs the checks: the thread holds an exclusive
+    lock on the report folder's SCHEDULER_LOCK_FILE, and the other processes'
+    threads keep trying to take it over. Datasets scheduled in those
+    processes are still precomputed once they are among the most recent
+    uploads. Reports that fail (e.g. a range the export doesn't cover) are
+    retried after FAILED_RETRY_SECONDS.
+    """
+
+    def __init__(self, upload_store, shipping_classifier, jobs, make_control, hours=PRECOMPUTE_HOURS,
+                 interval=PRECOMPUTE_CHECK_SECONDS, reports=None):
+        self.upload_store = upload_store
+        self.shipping_classifier = shipping_classifier
+        self.jobs = jobs
+        self.make_control = make_control
+        self.hours = hours
+        self.interval = interval
+        self.reports = reports or ReportStore(REPORT_FOLDER)
+        self._scheduled = {}
+        self._failed = {}
+        self._thread = None
+        self._lock_file = None
+        self._lock = threading.Lock()
+
+    def schedule(self, digest):
+        """Have the standard reports of a newly ingested or refreshed dataset computed in the next off-peak window."""
+        with self._lock:
+            self._scheduled[digest] = time.time()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='trendd-reports', daemon=True)
+                self._thread.start()
+        print(f"Scheduled standard reports for dataset {digest[:12]}")
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                if in_hours(self.hours) and self._hold_lock():
+                    self.run_once()
+            except Exception as e:
+                print(f"Error precomputing standard reports: {e}")
+
+    def _hold_lock(self):
+        """Take (or keep) this host's scheduler lock; False while another process holds it."""
+        if self._lock_file is not None or fcntl is None:
+            return True
+        os.makedirs(self.reports.root, exist_ok=True)
+        lock_file = open(os.path.join(self.reports.root, SCHEDULER_LOCK_FILE), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        # Held until the process exits, which releases it for another worker
+        self._lock_file = lock_file
+        print(f"Precomputing standard reports in process {os.getpid()}")
+        return True
+
+    def report(self, digest, start, end):
+        """The precomputed report of a dataset over a date range, or None if it isn't stored."""
+        from data_processor import range_analysis_key
+
+        return self.reports.get(range_analysis_key(digest, start, end, self.shipping_classifier))
+
+    def due(self, today=None):
+        """(digest, report name, start, end) of each standard report not yet in the report store."""
+        with self._lock:
+            digests = sorted(self._scheduled, key=self._scheduled.get, reverse=True)
+        digests += [upload['digest'] for upload in self.upload_store.recent(limit=PRECOMPUTE_DATASETS)]
+        ranges = standard_report_ranges(today)
+        candidates = [(digest, name, start, end) for digest in list(dict.fromkeys(digests))[:PRECOMPUTE_DATASETS]
+                      for name, (start, end) in ranges.items()]
+
+        # Forget failures once they are due for a retry or no longer among the candidates
+        now = time.time()
+        current = {(digest, start, end) for digest, _, start, end in candidates}
+        with self._lock:
+            self._failed = {key: failed_at for key, failed_at in self._failed.items()
+                            if key in current and now - failed_at < FAILED_RETRY_SECONDS}
+            failed = set(self._failed)
+        return [(digest, name, start, end) for digest, name, start, end in candidates
+                if (digest, start, end) not in failed and self.report(digest, start, end) is None]
+
+    def run_once(self, today=None):
+        """Submit every due report as a background job and return the job ids."""
+        from data_processor import range_analysis_key
+
+        job_ids = []
+        for digest, name, start, end in self.due(today):
+            source = self.upload_store.lookup(digest, touch=False)
+            if source is None:
+                continue
+            print(f"Precomputing {STANDARD_REPORTS[name].lower()} report for dataset {digest[:12]}")
+            job_ids.append(self.jobs.submit(
+                self._precompute, digest, source, start, end,
+                key=range_analysis_key(digest, start, end, self.shipping_classifier),
+                info={'precomputed': name, 'dataset': digest}
+            ))
+        with self._lock:
+            self._scheduled.clear()
+        self.reports.prune()
+        # Expire old uploads even when nothing new is uploaded
+        self.upload_store.evict()
+        return job_ids
+
+    def _precompute(self, digest, source, start, end):
+        from data_processor import analyze_dormant_customers_by_range, range_analysis_key
+
+        try:
+            result = analyze_dormant_customers_by_range(source, start, end, dataset_hash=digest,
+                                                        shipping_classifier=self.shipping_classifier,
+                                                        control=self.make_control())
+        except ValueError:
+            with self._lock:
+                self._failed[(digest, start, end)] = time.time()
+            raise
+        if not result.get('partial'):
+            self.reports.put(range_analysis_key(digest, start, end, self.shipping_classifier), result)
+        return result
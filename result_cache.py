@@ -0,0 +1,80 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+
+
+def normalize_date(value):
+    """Normalize a date/datetime/Timestamp to an ISO string; midnight datetimes become plain dates."""
+    if isinstance(value, datetime):
+        if value.hour == value.minute == value.second == value.microsecond == 0:
+            return value.date().isoformat()
+        return value.isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def make_cache_key(dataset_hash, start_date, end_date, version, *extra):
+    """Cache key for an analysis of one dataset over one date range."""
+    return (dataset_hash, normalize_date(start_date), normalize_date(end_date), version) + tuple(extra)
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache with a per-entry time-to-live.
+
+    Values are returned as stored, so callers must treat cached results as
+    read-only.
+    """
+
+    def __init__(self, max_entries=128, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached value for `key`, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, value = entry
+            if self.ttl_seconds is not None and time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            now = time.monotonic()
+            if self.ttl_seconds is not None:
+                for expired in [k for k, (stored_at, _) in self._entries.items() if now - stored_at > self.ttl_seconds]:
+                    del self._entries[expired]
+            self._entries[key] = (now, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, dataset_hash=None):
+        """Drop every entry, or only those for one dataset."""
+        with self._lock:
+            if dataset_hash is None:
+                self._entries.clear()
+                return
+            for key in [k for k in self._entries if k[0] == dataset_hash]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Shared cache for dormant-customer analyses in this process
+analysis_cache = ResultCache()
@@ -0,0 +1,98 @@
+from lazy_imports import lazy_module
+
+np = lazy_module('numpy')
+pd = lazy_module('pandas')
+
+RFM_BINS = 5
+
+# (segment, recency score range, frequency score range), checked in order
+RFM_SEGMENTS = [
+    ('Champions', (5, 5), (4, 5)),
+    ('Loyal Customers', (3, 4), (4, 5)),
+    ('Potential Loyalists', (4, 5), (2, 3)),
+    ('New Customers', (5, 5), (1, 1)),
+    ('Promising', (4, 4), (1, 1)),
+    ('Need Attention', (3, 3), (3, 3)),
+    ('About to Sleep', (3, 3), (1, 2)),
+    ("Can't Lose Them", (1, 2), (5, 5)),
+    ('At Risk', (1, 2), (3, 4)),
+    ('Hibernating', (1, 2), (1, 2)),
+]
+
+# Segments whose dormancy costs the most, in priority order for re-engagement
+PRIORITY_SEGMENTS = ["Can't Lose Them", 'Champions', 'Loyal Customers', 'At Risk']
+
+
+def quantile_scores(values, bins=RFM_BINS, ascending=True):
+    """
+    Score values 1..bins by quantile; the highest values score `bins` unless ascending is False.
+
+    Values are binned in value order and tied values share their lowest
+    rank, so they always get the same score whatever the row order. A heavy
+    tie (e.g. many one-order customers) falls in the bin where it starts and
+    the bins it spans stay empty.
+    """
+    values = pd.Series(values)
+    n = len(values)
+    if n == 0:
+        return np.array([], dtype='int64')
+    ranks = values.rank(method='min').to_numpy()
+    # Map ranks 1..n onto 1..bins in equal-sized groups, reversed when low values should score high
+    groups = min(bins, n)
+    scores = np.ceil(ranks * groups / n).astype('int64')
+    if not ascending:
+        scores = groups + 1 - scores
+    return scores + (bins - groups)
+
+
+def rfm_segments(summary, as_of=None, bins=RFM_BINS):
+    """
+    RFM scores and segments for every customer in a customer_summary frame.
+
+    Recency is measured from `as_of` (default: the latest order in the data).
+    Returns a DataFrame indexed like `summary` with recency_days, frequency,
+    monetary, r/f/m scores, rfm_score (e.g. "545") and segment.
+    """
+    last_orders = summary['last_order_date'].to_numpy(dtype='datetime64[D]')
+    if as_of is None:
+        as_of_day = last_orders.max() if len(last_orders) else np.datetime64('today', 'D')
+    else:
+        as_of_day = np.datetime64(as_of, 'D')
+
+    recency_days = (as_of_day - last_orders).astype('int64')
+    frequency = summary['total_orders'].to_numpy()
+    monetary = summary['total_spent'].to_numpy(dtype='float64')
+
+    r_score = quantile_scores(recency_days, bins, ascending=False)
+    f_score = quantile_scores(frequency, bins)
+    m_score = quantile_scores(monetary, bins)
+
+    # Scores are on a 1..5 scale for the segment map regardless of the bin count
+    r5 = np.ceil(r_score * 5 / bins)
+    f5 = np.ceil(f_score * 5 / bins)
+    conditions = [
+        (r5 >= r_lo) & (r5 <= r_hi) & (f5 >= f_lo) & (f5 <= f_hi)
+        for _, (r_lo, r_hi), (f_lo, f_hi) in RFM_SEGMENTS
+    ]
+    segment = np.select(conditions, [name for name, _, _ in RFM_SEGMENTS], default='Other')
+
+    return pd.DataFrame({
+        'recency_days': recency_days,
+        'frequency': frequency,
+        'monetary': monetary,
+        'r_score': r_score,
+        'f_score': f_score,
+        'm_score': m_score,
+        'rfm_score': pd.Series(r_score).astype(str).str.cat([pd.Series(f_score).astype(str), pd.Series(m_score).astype(str)]).to_numpy(),
+        'segment': segment
+    }, index=summary.index)
+
+
+def segment_summary(rfm):
+    """Customer count and lifetime value per segment, highest value first, as template-ready dicts."""
+    grouped = rfm.groupby('segment', sort=False)['monetary'].agg(['count', 'sum'])
+    grouped = grouped.sort_values('sum', ascending=False)
+    return [
+        {'segment': segment, 'count': int(row['count']), 'total_value': float(row['sum'])}
+        for segment, row in grouped.iterrows()
+    ]
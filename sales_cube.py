@@ -0,0 +1,164 @@
+from lazy_imports import lazy_module
+
+np = lazy_module('numpy')
+pd = lazy_module('pandas')
+
+MEASURES = ['sales', 'orders', 'lines']
+
+# Dimensions that can be derived from the stored ones at query time
+DERIVED_DIMENSIONS = {
+    'month_of_year': ('month', lambda months: months.dt.month),
+    'year': ('month', lambda months: months.dt.year)
+}
+
+
+class SalesCube:
+    """
+    Pre-aggregated sales by customer x month x item (x region when the export has one).
+
+    Built with a single groupby per dataset. Each cell holds `sales` (sum of
+    amounts), `lines` (transaction rows) and `orders` (distinct invoice
+    numbers, or distinct order days without a Num column). An invoice can
+    span several items and regions, so `invoices` also lists the distinct
+    (cell, order) pairs; roll-ups that drop item or region count distinct
+    orders from it instead of adding up cells. `slice` filters cells and
+    `rollup` aggregates them to coarser dimensions, so breakdowns never go
+    back to the raw rows.
+    """
+
+    def __init__(self, cells, dimensions, invoices=None):
+        self.cells = cells
+        self.dimensions = list(dimensions)
+        self.invoices = invoices
+
+    @classmethod
+    def from_transactions(cls, df, columns):
+        dims = {
+            'customer': df[columns['customer']].to_numpy(dtype=object),
+            'month': df[columns['date']].to_numpy(dtype='datetime64[M]')
+        }
+        if columns.get('item') and columns['item'] in df.columns:
+            dims['item'] = df[columns['item']].to_numpy(dtype=object)
+        if columns.get('region') and columns['region'] in df.columns:
+            dims['region'] = df[columns['region']].to_numpy(dtype=object)
+
+        if columns.get('num') and columns['num'] in df.columns:
+            order_keys = df[columns['num']].to_numpy()
+        else:
+            order_keys = df[columns['date']].to_numpy(dtype='datetime64[D]')
+
+        frame = pd.DataFrame(dims)
+        frame['sales'] = df[columns['amount']].to_numpy(dtype='float64')
+        frame['order_key'] = order_keys
+
+        grouped = frame.groupby(list(dims), sort=False, dropna=False)
+        cells = grouped.agg(
+            sales=('sales', 'sum'),
+            orders=('order_key', 'nunique'),
+            lines=('sales', 'size')
+        ).reset_index()
+        cells['month'] = pd.to_datetime(cells['month'])
+
+        # An order is one customer's invoice number (or order day); cell ids follow the cells' row order
+        customer_codes, _ = pd.factorize(dims['customer'], use_na_sentinel=False)
+        order_codes, order_values = pd.factorize(order_keys, use_na_sentinel=False)
+        invoices = pd.DataFrame({
+            'cell': grouped.ngroup().to_numpy(dtype='int64'),
+            'order': customer_codes.astype('int64') * (len(order_values) + 1) + order_codes
+        }).drop_duplicates(ignore_index=True)
+        return cls(cells, dims, invoices)
+
+    def __len__(self):
+        return len(self.cells)
+
+    def has_dimension(self, dimension):
+        return dimension in self.dimensions or (
+            dimension in DERIVED_DIMENSIONS and DERIVED_DIMENSIONS[dimension][0] in self.dimensions
+        )
+
+    def _dimension_values(self, cells, dimension):
+        if dimension in DERIVED_DIMENSIONS:
+            source, derive = DERIVED_DIMENSIONS[dimension]
+            return derive(cells[source])
+        return cells[dimension]
+
+    def slice(self, **filters):
+        """
+        Cube restricted to cells matching every filter.
+
+        Each filter value may be a single value or a collection; months may
+        be given as 'YYYY-MM' strings or timestamps.
+        """
+        mask = np.ones(len(self.cells), dtype=bool)
+        for dimension, wanted in filters.items():
+            if wanted is None:
+                continue
+            if not self.has_dimension(dimension):
+                raise ValueError(f"Unknown cube dimension: {dimension}")
+            if isinstance(wanted, (str, bytes)) or not hasattr(wanted, '__iter__'):
+                wanted = [wanted]
+            wanted = list(wanted)
+            if dimension == 'month':
+                wanted = pd.to_datetime(wanted).to_period('M').to_timestamp()
+            mask &= self._dimension_values(self.cells, dimension).isin(wanted).to_numpy()
+        return SalesCube(self.cells[mask], self.dimensions, self.invoices)
+
+    def _cell_invoices(self, cells):
+        """The (cell, order) pairs of `cells`, or None when the cube has no invoice list."""
+        if self.invoices is None:
+            return None
+        return self.invoices[self.invoices['cell'].isin(cells.index)]
+
+    def rollup(self, *dimensions, sort_by='sales', top=None):
+        """
+        Aggregate cells to `dimensions` (none = grand total).
+
+        Returns a DataFrame with sales, orders, lines and, when customer is
+        rolled away, the number of distinct customers per group. When item
+        or region is rolled away, orders are distinct orders counted from
+        the invoice list; a cube built without one leaves orders out then.
+        """
+        for dimension in dimensions:
+            if not self.has_dimension(dimension):
+                raise ValueError(f"Unknown cube dimension: {dimension}")
+
+        cells = self.cells
+        # Cells split an order only by item and region; each order has one customer and month
+        distinct_orders = any(d in self.dimensions and d not in dimensions for d in ('item', 'region'))
+        invoices = self._cell_invoices(cells) if distinct_orders else None
+        measures = [m for m in MEASURES if m != 'orders' or not distinct_orders or invoices is not None]
+
+        if not dimensions:
+            totals = {measure: cells[measure].sum() for measure in measures}
+            if invoices is not None:
+                totals['orders'] = invoices['order'].nunique()
+            totals['customers'] = cells['customer'].nunique()
+            return pd.DataFrame([totals])
+
+        keys = [self._dimension_values(cells, d).rename(d) for d in dimensions]
+        grouped = cells.groupby(keys, sort=False, dropna=False)
+        result = grouped[measures].sum()
+        if invoices is not None:
+            # Groups are numbered in the order of the summed rows
+            invoice_groups = grouped.ngroup().loc[invoices['cell']].to_numpy()
+            orders = invoices['order'].groupby(invoice_groups).nunique()
+            result['orders'] = orders.reindex(range(len(result)), fill_value=0).to_numpy()
+        if 'customer' not in dimensions:
+            result['customers'] = grouped['customer'].nunique()
+        result = result.reset_index()
+
+        if sort_by:
+            result = result.sort_values(sort_by, ascending=False, kind='stable')
+        if top:
+            result = result.head(top)
+        return result.reset_index(drop=True)
+
+    def share(self, dimension, measure='customers'):
+        """Top value of `dimension` and its share (0-1) of `measure`, or (None, 0.0) if empty."""
+        breakdown = self.rollup(dimension, sort_by=measure)
+        breakdown = breakdown[breakdown[dimension].notna()]
+        total = breakdown[measure].sum()
+        if breakdown.empty or not total:
+            return None, 0.0
+        top = breakdown.iloc[0]
+        return top[dimension], float(top[measure] / total)
@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep datasets cleaned during the tests out of the working tree
+os.environ.setdefault('TRENDD_DATASET_FOLDER', tempfile.mkdtemp(prefix='trendd-datasets-'))
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+import cutoff_index
+from cutoff_index import DormancyCutoffIndex
+
+
+def _random_index(n=500, seed=1):
+    rng = np.random.default_rng(seed)
+    customers = [f"Customer {i}" for i in range(n)]
+    last_orders = np.datetime64('2023-01-01') + rng.integers(0, 365, n).astype('timedelta64[D]')
+    sales = rng.integers(1, 5000, n).astype('float64')
+    return DormancyCutoffIndex(customers, last_orders, sales), customers, last_orders, sales
+
+
+@pytest.mark.parametrize('partition_limit', [16384, 8])
+def test_query_matches_brute_force(monkeypatch, partition_limit):
+    monkeypatch.setattr(cutoff_index, '_PARTITION_LIMIT', partition_limit)
+    monkeypatch.setattr(cutoff_index, '_SCAN_BLOCK', 16)
+    index, customers, last_orders, sales = _random_index()
+    for days in (0, 30, 90, 200, 400):
+        result = index.query(days, as_of='2024-01-01', top_k=5)
+        dormant = last_orders < np.datetime64('2024-01-01') - np.timedelta64(days, 'D')
+        assert result['dormant_count'] == int(dormant.sum())
+        assert result['total_value'] == pytest.approx(float(sales[dormant].sum()))
+        expected_top = sorted(sales[dormant], reverse=True)[:5]
+        assert [c['total_spent'] for c in result['top_customers']] == expected_top
+        for top in result['top_customers']:
+            assert dormant[customers.index(top['customer'])]
+
+
+def test_cutoff_is_exclusive():
+    index = DormancyCutoffIndex(['Alpha Ltd', 'Bravo Ltd'], np.array(['2023-12-02', '2023-12-01'], dtype='datetime64[D]'),
+                                [100.0, 200.0])
+    # A last order on the cutoff day itself is within the window
+    result = index.query(31, as_of='2024-01-01')
+    assert result['cutoff_date'] == '2023-12-01'
+    assert result['dormant_count'] == 0
+    assert index.query(30, as_of='2024-01-01')['top_customers'][0]['customer'] == 'Bravo Ltd'
@@ -0,0 +1,31 @@
+import pandas as pd
+
+from dataset_store import DatasetStore
+
+COLUMNS = {'customer': 'Name', 'date': 'Date', 'amount': 'Amount', 'num': 'Num', 'item': 'Item', 'region': None}
+
+
+def _frame(customer):
+    return pd.DataFrame({
+        'Name': [customer, customer],
+        'Date': pd.to_datetime(['2023-09-05', '2023-10-01']),
+        'Amount': [100.0, 50.0],
+        'Num': ['INV-1', 'INV-2'],
+        'Item': ['Widget', 'Gadget'],
+    })
+
+
+def test_keeps_text_arrow_backed_and_bounds_mappings(tmp_path):
+    store = DatasetStore(str(tmp_path), max_mapped=1)
+    df, _ = store.save('a' * 64, _frame('Alpha Ltd'), COLUMNS)
+    assert isinstance(df['Num'].dtype, pd.ArrowDtype)
+    assert df['Name'].dtype == 'category'
+
+    store.save('b' * 64, _frame('Bravo Ltd'), COLUMNS)
+    assert list(store._mapped) == ['b' * 64]
+
+    # A dropped mapping is mapped again from the file on the next load
+    df, columns = store.load('a' * 64)
+    assert list(df['Name']) == ['Alpha Ltd', 'Alpha Ltd']
+    assert columns['num'] == 'Num'
+    assert list(store._mapped) == ['a' * 64]
@@ -0,0 +1,88 @@
+from datetime import datetime
+
+import pandas as pd
+
+from customer_metrics import customer_summary
+from cutoff_index import DormancyCutoffIndex
+from data_processor import compare_dormant_ranges
+from dataset_handle import DatasetHandle
+from dormant_diff import DormantSetDiff
+from ingest import file_digest
+
+COLUMNS = {'customer': 'Name', 'date': 'Date', 'amount': 'Amount', 'num': 'Num', 'item': 'Item'}
+
+# (customer, order date, amount): A goes quiet after September, B orders again in October,
+# C only buys in October and D comes back in November
+ORDERS = [
+    ('Alpha Ltd', '2023-09-05', 100.0),
+    ('Bravo Ltd', '2023-09-10', 200.0),
+    ('Bravo Ltd', '2023-10-12', 50.0),
+    ('Charlie Ltd', '2023-10-20', 300.0),
+    ('Delta Ltd', '2023-09-15', 400.0),
+    ('Delta Ltd', '2023-11-10', 25.0),
+]
+
+SEP = (datetime(2023, 9, 1), datetime(2023, 9, 30))
+OCT = (datetime(2023, 10, 1), datetime(2023, 10, 31))
+
+
+def _frame(orders):
+    return pd.DataFrame({
+        'Name': [customer for customer, _, _ in orders],
+        'Date': pd.to_datetime([date for _, date, _ in orders]),
+        'Amount': [amount for _, _, amount in orders],
+        'Num': range(1000, 1000 + len(orders)),
+        'Item': 'Widget',
+    })
+
+
+def _write_export(path, orders):
+    frame = _frame(orders)
+    frame.insert(0, 'Type', 'Invoice')
+    frame['Date'] = frame['Date'].dt.strftime('%m/%d/%Y')
+    frame.to_csv(path, index=False)
+    return str(path)
+
+
+def test_dormant_customers_ignores_orders_after_as_of():
+    handle = DatasetHandle(_frame(ORDERS), COLUMNS)
+
+    as_of_october = handle.dormant_customers(*SEP, as_of=OCT[1])
+    assert set(as_of_october.index) == {'Alpha Ltd', 'Delta Ltd'}
+    assert as_of_october.loc['Delta Ltd', 'total_spent'] == 400.0
+    assert as_of_october.loc['Delta Ltd', 'last_order_date'] == pd.Timestamp('2023-09-15')
+
+    # Without as_of every later order counts, as in the range analysis
+    assert set(handle.dormant_customers(*SEP).index) == {'Alpha Ltd'}
+
+
+def test_diff_sets():
+    frame = _frame(ORDERS)
+    handle = DatasetHandle(frame, COLUMNS)
+    cutoff_index = DormancyCutoffIndex.from_summary(customer_summary(frame, COLUMNS))
+    diff = DormantSetDiff(handle.dormant_customers(*SEP, as_of=OCT[1]), handle.dormant_customers(*OCT), cutoff_index)
+
+    names = lambda codes: {diff.customers[code] for code in codes}
+    assert names(diff.newly_dormant) == {'Bravo Ltd', 'Charlie Ltd'}
+    assert names(diff.reactivated) == {'Delta Ltd'}
+    assert names(diff.out_of_range) == {'Alpha Ltd'}
+    assert names(diff.persisting) == set()
+    assert diff.summary()['reactivated']['value_delta'] == 25.0
+
+
+def test_adjacent_ranges_do_not_mark_every_earlier_buyer_dormant(tmp_path):
+    # Most September buyers order again in October; they must not count as dormant in September
+    orders = ORDERS + [(f'Echo {i}', '2023-09-20', 10.0) for i in range(20)]
+    orders += [(f'Echo {i}', '2023-10-05', 10.0) for i in range(20)]
+    path = _write_export(tmp_path / 'orders.csv', orders)
+
+    diff, partial = compare_dormant_ranges(file_digest(path), *OCT, *SEP, source=path)
+    summary = diff.summary(top=100)
+
+    assert not partial
+    september_buyers = 24
+    assert summary['previous']['count'] == 2 < september_buyers
+    assert summary['reactivated']['count'] == 1
+    assert [row['customer'] for row in summary['reactivated']['customers']] == ['Delta Ltd']
+    assert {row['customer'] for row in summary['newly_dormant']['customers']} == (
+        {'Bravo Ltd', 'Charlie Ltd'} | {f'Echo {i}' for i in range(20)})
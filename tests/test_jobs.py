@@ -0,0 +1,62 @@
+import threading
+
+from cancellation import AnalysisCancelled, CancelToken
+from jobs import JobRegistry
+
+
+def _wait(registry, job_id, status, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        job = registry.get(job_id)
+        if job is not None and job['status'] == status:
+            return job
+        threading.Event().wait(0.01)
+    raise AssertionError(f"job {job_id} never reached {status}")
+
+
+def test_other_worker_sees_result(tmp_path):
+    owner = JobRegistry(max_workers=1, root=str(tmp_path))
+    other = JobRegistry(max_workers=1, root=str(tmp_path))
+    job_id = owner.submit(lambda x: {'total': x * 2}, 21, info={'profile_id': None})
+    _wait(owner, job_id, 'done')
+    job = other.get(job_id)
+    assert job['status'] == 'done'
+    assert job['result'] == {'total': 42}
+    assert job['info'] == {'profile_id': None}
+    assert other.get('0' * 32) is None
+    assert other.get('../jobs') is None
+
+
+def test_other_worker_can_cancel(tmp_path):
+    owner = JobRegistry(max_workers=1, root=str(tmp_path))
+    other = JobRegistry(max_workers=1, root=str(tmp_path))
+    started = threading.Event()
+
+    def analyze(token):
+        started.set()
+        while not token.cancelled:
+            threading.Event().wait(0.01)
+        raise AnalysisCancelled("The analysis was cancelled.")
+
+    token = CancelToken()
+    job_id = owner.submit(analyze, token, cancel_token=token)
+    assert started.wait(5)
+    _wait(other, job_id, 'running')
+    assert other.cancel(job_id)
+    _wait(owner, job_id, 'cancelled')
+    assert other.get(job_id)['status'] == 'cancelled'
+    assert not other.cancel(job_id)
+
+
+def test_cancel_while_queued_never_runs():
+    registry = JobRegistry(max_workers=1)
+    release = threading.Event()
+    ran = []
+    blocker = registry.submit(release.wait, 5)
+    token = CancelToken()
+    job_id = registry.submit(ran.append, 'ran', cancel_token=token)
+    assert registry.get(job_id)['status'] == 'queued'
+    assert registry.cancel(job_id)
+    release.set()
+    _wait(registry, blocker, 'done')
+    _wait(registry, job_id, 'cancelled')
+    assert ran == []
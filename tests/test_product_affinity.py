@@ -0,0 +1,50 @@
+import pandas as pd
+import pytest
+
+import product_affinity
+from product_affinity import ProductAffinity
+
+COLUMNS = {'customer': 'Name', 'item': 'Item'}
+
+# Widget+Gadget and Widget+Gizmo are each bought by two customers; Gadget+Gizmo and
+# Gadget+Doohickey by only one, which is below MIN_SUPPORT
+PURCHASES = {
+    'Alpha Ltd': ['Widget', 'Gadget', 'Shipping'],
+    'Bravo Ltd': ['Widget', 'Gadget', 'Gizmo'],
+    'Charlie Ltd': ['Widget', 'Gizmo', 'Gizmo'],
+    'Delta Ltd': ['Widget'],
+    'Echo Ltd': ['Gadget', 'Doohickey'],
+}
+
+
+def _affinity():
+    rows = [(customer, item) for customer, items in PURCHASES.items() for item in items]
+    return ProductAffinity.from_transactions(pd.DataFrame(rows, columns=['Name', 'Item']), COLUMNS)
+
+
+@pytest.fixture(params=[True, False], ids=['scipy', 'pandas'])
+def backend(request, monkeypatch):
+    monkeypatch.setattr(product_affinity, 'scipy_available', lambda: request.param)
+
+
+def _links(affinity):
+    return {(affinity.items[i], affinity.items[o]) for i, o in zip(affinity.neighbours['item'], affinity.neighbours['other'])}
+
+
+def test_pairs_below_min_support_are_pruned(backend):
+    affinity = _affinity()
+    assert 'Shipping' not in list(affinity.items)
+    assert _links(affinity) == {('Widget', 'Gadget'), ('Gadget', 'Widget'), ('Widget', 'Gizmo'), ('Gizmo', 'Widget')}
+    assert affinity.companions('Widget') == [('Gizmo', 2)]
+
+
+def test_suggestions_skip_bought_items(backend):
+    suggestions = _affinity().suggestions(['Charlie Ltd', 'Delta Ltd', 'Echo Ltd', 'Unknown Ltd'])
+    assert suggestions == {'Charlie Ltd': ['Gadget'], 'Delta Ltd': ['Gizmo', 'Gadget'], 'Echo Ltd': ['Widget']}
+
+
+def test_neighbours_are_capped_per_item(backend, monkeypatch):
+    monkeypatch.setattr(product_affinity, 'NEIGHBOURS_PER_ITEM', 1)
+    affinity = _affinity()
+    assert affinity.neighbours['item'].value_counts().max() == 1
+    assert affinity.suggestions(['Delta Ltd']) == {'Delta Ltd': ['Gizmo']}
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+
+from rfm import quantile_scores, rfm_segments
+
+
+def test_scores_follow_value_quantiles():
+    assert list(quantile_scores(range(1, 11))) == [1, 1, 2, 2, 3, 3, 4, 4, 5, 5]
+    assert list(quantile_scores(range(1, 11), ascending=False)) == [5, 5, 4, 4, 3, 3, 2, 2, 1, 1]
+    # Fewer values than bins keep the top scores
+    assert list(quantile_scores([3, 1])) == [5, 4]
+
+
+def test_tied_values_share_a_score_in_any_order():
+    values = np.array([10, 1, 10, 10, 2, 7, 10, 1])
+    scores = quantile_scores(values)
+    for value in np.unique(values):
+        assert len(set(scores[values == value])) == 1
+
+    order = np.random.default_rng(0).permutation(len(values))
+    assert list(quantile_scores(values[order])) == list(scores[order])
+    descending = quantile_scores(values, ascending=False)
+    assert list(descending) == list(6 - scores)
+
+
+def test_tied_customers_get_the_same_segment():
+    summary = pd.DataFrame({
+        'last_order_date': pd.to_datetime(['2023-10-01', '2023-06-01', '2023-10-01', '2023-01-15']),
+        'total_orders': [3, 1, 3, 8],
+        'total_spent': [300.0, 50.0, 300.0, 900.0],
+    }, index=['Alpha Ltd', 'Bravo Ltd', 'Charlie Ltd', 'Delta Ltd'])
+    segments = rfm_segments(summary)
+    alpha, charlie = segments.loc['Alpha Ltd'], segments.loc['Charlie Ltd']
+    assert alpha['rfm_score'] == charlie['rfm_score']
+    assert alpha['segment'] == charlie['segment']
+    assert segments.loc['Delta Ltd', 'm_score'] == 5
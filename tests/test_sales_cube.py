@@ -0,0 +1,43 @@
+import pandas as pd
+
+from sales_cube import SalesCube
+
+COLUMNS = {'customer': 'Name', 'date': 'Date', 'amount': 'Amount', 'num': 'Num', 'item': 'Item', 'region': 'Region'}
+
+# INV-1 spans two items and two regions; Charlie reuses the invoice number INV-1
+LINES = [
+    ('Alpha Ltd', '2023-09-05', 'INV-1', 'Widget', 'East', 100.0),
+    ('Alpha Ltd', '2023-09-05', 'INV-1', 'Gadget', 'West', 50.0),
+    ('Alpha Ltd', '2023-09-20', 'INV-2', 'Widget', 'East', 70.0),
+    ('Bravo Ltd', '2023-10-02', 'INV-3', 'Gadget', 'East', 30.0),
+    ('Charlie Ltd', '2023-10-09', 'INV-1', 'Widget', 'East', 20.0),
+]
+
+
+def _cube():
+    df = pd.DataFrame(LINES, columns=['Name', 'Date', 'Num', 'Item', 'Region', 'Amount'])
+    df['Date'] = pd.to_datetime(df['Date'])
+    return SalesCube.from_transactions(df, COLUMNS)
+
+
+def _orders(rollup, dimension):
+    return dict(zip(rollup[dimension].astype(str), rollup['orders']))
+
+
+def test_orders_are_distinct_across_item_and_region():
+    cube = _cube()
+    total = cube.rollup()
+    assert total['orders'][0] == 4
+    assert total['lines'][0] == 5
+    assert total['sales'][0] == 270.0
+
+    assert _orders(cube.rollup('customer'), 'customer') == {'Alpha Ltd': 2, 'Bravo Ltd': 1, 'Charlie Ltd': 1}
+    assert _orders(cube.rollup('month'), 'month') == {'2023-09-01': 2, '2023-10-01': 2}
+    assert _orders(cube.rollup('item'), 'item') == {'Widget': 3, 'Gadget': 2}
+    assert _orders(cube.rollup('region'), 'region') == {'East': 4, 'West': 1}
+
+
+def test_slice_then_rollup_counts_distinct_orders():
+    cube = _cube().slice(region='East')
+    assert _orders(cube.rollup('customer'), 'customer') == {'Alpha Ltd': 2, 'Bravo Ltd': 1, 'Charlie Ltd': 1}
+    assert _orders(_cube().slice(customer='Alpha Ltd').rollup('month'), 'month') == {'2023-09-01': 2}
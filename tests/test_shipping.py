@@ -0,0 +1,19 @@
+import pandas as pd
+
+from data_helpers import ShippingClassifier
+
+
+def test_default_rules():
+    classifier = ShippingClassifier()
+    for item in ['Shipping', 'Shipment Fee', 'ShippingFee', 'Postage', 'Delivery Charge', 'Freight', 'Handling']:
+        assert classifier.is_shipping(item), item
+    for item in ['Airship Model', 'Delivery Van Rental', 'Handling Equipment', 'Material Handling Cart',
+                 'Shipping Supplies Kit', 'Widget', None]:
+        assert not classifier.is_shipping(item), item
+
+
+def test_shop_exclusions_replace_defaults():
+    classifier = ShippingClassifier(exclusions=['Shipley Donuts'])
+    assert not classifier.is_shipping('Shipley Donuts Dozen')
+    assert classifier.is_shipping('Delivery Van Rental')
+    assert list(classifier.mask(pd.Series(['Ship Charge', 'Shipley Donuts', None]))) == [True, False, False]
@@ -0,0 +1,48 @@
+import hashlib
+
+import upload_store
+from upload_store import UploadStore
+
+
+class Upload:
+    """The parts of ingest.IngestedUpload the store uses."""
+
+    def __init__(self, data, filename='export.csv'):
+        self.data = data
+        self.filename = filename
+        self.size = len(data)
+        self.digest = hashlib.sha256(data).hexdigest()
+        self.extension = '.csv'
+
+    def save_to(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.data)
+
+
+def test_lookup_keeps_recently_used_upload(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_store, 'TOUCH_INTERVAL_SECONDS', -1)
+    deleted = []
+    store = UploadStore(str(tmp_path), max_bytes=250, on_delete=deleted.append)
+    first, second, third = Upload(b'a' * 100), Upload(b'b' * 100), Upload(b'c' * 100)
+    store.put(first)
+    store.put(second)
+
+    # Reading the first upload makes the second the least recently used
+    assert store.lookup(first.digest) is not None
+    store.put(third)
+
+    assert deleted == [second.digest]
+    assert store.lookup(second.digest) is None
+    assert store.lookup(first.digest) is not None
+    assert store.stats() == {'objects': 2, 'bytes': 200, 'references': 2}
+
+
+def test_background_lookup_does_not_touch(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_store, 'TOUCH_INTERVAL_SECONDS', -1)
+    store = UploadStore(str(tmp_path), max_bytes=250)
+    first, second, third = Upload(b'a' * 100), Upload(b'b' * 100), Upload(b'c' * 100)
+    store.put(first)
+    store.put(second)
+    assert store.lookup(first.digest, touch=False) is not None
+    store.put(third)
+    assert store.lookup(first.digest) is None
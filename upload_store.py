@@ -0,0 +1,210 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to the in-process lock only
+    fcntl = None
+
+INDEX_FILE = 'index.json'
+OBJECTS_DIR = 'objects'
+
+# A lookup refreshes an object's last access at most this often, so reads rarely rewrite the index
+TOUCH_INTERVAL_SECONDS = 60
+
+
+class UploadStore:
+    """
+    Content-addressed storage for uploaded exports.
+
+    Each distinct file is stored once under its SHA-256 digest. A JSON index
+    records, per object, its size, a reference count and one metadata record
+    per upload (original name, uploaded at, size), so repeat uploads of the
+    same export only add an index entry. Objects are evicted when all their
+    references have expired (`max_age_days`) or, least recently used first,
+    when the store grows past `max_bytes`.
+
+    The index is guarded by a file lock so several web workers can share
+    one store directory. `on_delete`, when given, is called with the digest
+    of every object deleted, so data derived from it can be removed too.
+    """
+
+    def __init__(self, root, max_bytes=None, max_age_days=None, on_delete=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.on_delete = on_delete
+        self._index_path = os.path.join(root, INDEX_FILE)
+        self._lock_path = self._index_path + '.lock'
+        self._thread_lock = threading.Lock()
+        os.makedirs(os.path.join(root, OBJECTS_DIR), exist_ok=True)
+
+    @contextmanager
+    def _locked_index(self):
+        """Load the index under an exclusive lock and write it back on exit."""
+        with self._thread_lock, open(self._lock_path, 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                index = self._read_index()
+                yield index
+                self._write_index(index)
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_index(self):
+        try:
+            with open(self._index_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {'objects': {}}
+
+    def _write_index(self, index):
+        tmp_path = self._index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp_path, self._index_path)
+
+    def object_path(self, digest, extension=''):
+        """Path of a stored object, sharded by the first two digest characters."""
+        return os.path.join(self.root, OBJECTS_DIR, digest[:2], digest + extension)
+
+    def lookup(self, digest, touch=True):
+        """
+        Return the stored path for `digest`, or None if it is not in the store.
+
+        With `touch` the object counts as used now for size-based eviction;
+        background work such as report precomputation passes touch=False.
+        """
+        entry = self._read_index()['objects'].get(digest)
+        if entry is None:
+            return None
+        path = os.path.join(self.root, entry['path'])
+        if not os.path.exists(path):
+            return None
+        if touch and time.time() - entry.get('last_access', 0) > TOUCH_INTERVAL_SECONDS:
+            self.touch(digest)
+        return path
+
+    def put(self, upload):
+        """
+        Store an IngestedUpload and record a reference to it.
+
+        The bytes are only written when the digest isn't stored yet.
+        Returns (path, is_new).
+        """
+        now = datetime.now().isoformat(timespec='seconds')
+        record = {'original_name': upload.filename, 'uploaded_at': now, 'size': upload.size}
+
+        with self._locked_index() as index:
+            objects = index['objects']
+            entry = objects.get(upload.digest)
+            path = self.object_path(upload.digest, upload.extension)
+            is_new = entry is None or not os.path.exists(os.path.join(self.root, entry['path']))
+
+            if is_new:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                upload.save_to(path)
+                entry = {
+                    'path': os.path.relpath(path, self.root),
+                    'size': upload.size,
+                    'refcount': 0,
+                    'created_at': now,
+                    'uploads': []
+                }
+                objects[upload.digest] = entry
+            else:
+                path = os.path.join(self.root, entry['path'])
+
+            entry['refcount'] += 1
+            entry['uploads'].append(record)
+            entry['last_access'] = time.time()
+
+            self._evict(index, keep=upload.digest)
+
+        return path, is_new
+
+    def touch(self, digest):
+        """Mark an object as recently used so size-based eviction keeps it."""
+        with self._locked_index() as index:
+            entry = index['objects'].get(digest)
+            if entry is not None:
+                entry['last_access'] = time.time()
+
+    def evict(self):
+        """Apply the age and size limits now, as an upload would. Returns the evicted digests."""
+        with self._locked_index() as index:
+            return self._evict(index)
+
+    def _evict(self, index, keep=None):
+        objects = index['objects']
+        evicted = []
+
+        # Age: expire upload records past max_age; objects with no records left go
+        if self.max_age_days is not None:
+            cutoff = datetime.now().timestamp() - self.max_age_days * 86400
+            for digest, entry in list(objects.items()):
+                if digest == keep:
+                    continue
+                live = [r for r in entry['uploads']
+                        if datetime.fromisoformat(r['uploaded_at']).timestamp() >= cutoff]
+                entry['refcount'] -= len(entry['uploads']) - len(live)
+                entry['uploads'] = live
+                if entry['refcount'] <= 0:
+                    self._delete(index, digest)
+                    evicted.append(digest)
+
+        # Size: drop least recently used objects until the store fits
+        if self.max_bytes is not None:
+            total = sum(entry['size'] for entry in objects.values())
+            for digest in sorted(objects, key=lambda d: objects[d].get('last_access', 0)):
+                if total <= self.max_bytes:
+                    break
+                if digest == keep:
+                    continue
+                total -= objects[digest]['size']
+                self._delete(index, digest)
+                evicted.append(digest)
+
+        if evicted:
+            print(f"Evicted {len(evicted)} stored uploads")
+        return evicted
+
+    def _delete(self, index, digest):
+        entry = index['objects'].pop(digest, None)
+        if entry is None:
+            return
+        try:
+            os.remove(os.path.join(self.root, entry['path']))
+        except FileNotFoundError:
+            pass
+        if self.on_delete is not None:
+            try:
+                self.on_delete(digest)
+            except Exception as e:
+                print(f"Error removing data derived from upload {digest[:12]}: {e}")
+
+    def recent(self, limit=20):
+        """The most recently uploaded objects, newest first, as dicts with digest, original_name, uploaded_at and size."""
+        uploads = []
+        for digest, entry in self._read_index()['objects'].items():
+            if entry['uploads']:
+                latest = entry['uploads'][-1]
+                uploads.append({'digest': digest, 'original_name': latest['original_name'],
+                                'uploaded_at': latest['uploaded_at'], 'size': entry['size']})
+        uploads.sort(key=lambda upload: upload['uploaded_at'], reverse=True)
+        return uploads[:limit]
+
+    def stats(self):
+        """Object count, total stored bytes and total references."""
+        objects = self._read_index()['objects']
+        return {
+            'objects': len(objects),
+            'bytes': sum(entry['size'] for entry in objects.values()),
+            'references': sum(entry['refcount'] for entry in objects.values())
+        }